@@ -0,0 +1,268 @@
+"""Benchmarks for minimalisp's hot paths: parsing, running the programs in tests/, deep recursion
+through the standard library (and its native versions, and vectors, which need none), and evaluating random populations of GP programs.
+
+    python -m benchmarks -o before.json
+    ... change something ...
+    python -m benchmarks -o after.json
+    python -m benchmarks compare before.json after.json
+
+Each benchmark is a function, registered with @benchmark, which does any setup and returns the
+function to time. Results are the best and median times per call of several repeats, in seconds."""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import gc
+import atexit
+import json
+import random
+import shutil
+import tempfile
+import platform
+from StringIO import StringIO
+from timeit import default_timer
+
+# vm imports these when it needs them, which would fail in the scratch directory if minimalisp
+# were found relative to the working directory.
+from minimalisp import vm, bytecode, maths
+from minimalisp.values import Symbol, Value, Vector
+from minimalisp.parse import parse_program
+from minimalisp.stdlib import stdlib
+
+
+TESTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests')
+
+ENGINES = ['peval', 'compiled', 'stackless', 'lexical', 'bytecode']
+
+# (name, setup function) for each benchmark, in the order they run.
+registry = []
+
+
+def benchmark(name):
+    def register(setup):
+        registry.append((name, setup))
+        return setup
+    return register
+
+
+def engine_run(engine):
+    """the run function of one of the evaluation engines."""
+    if engine == 'peval':
+        return vm.run
+    module = 'minimalisp.' + engine
+    __import__(module)
+    return sys.modules[module].run
+
+
+class Discard(object):
+    def write(self, s):
+        pass
+
+
+_scratch = []
+
+
+def scratch_directory():
+    """a directory with the extensions library in lib/ext.l, where the tests import it from. It
+    is made once, so that the library is imported (and cached) once, as it would be in a program."""
+    if not _scratch:
+        directory = tempfile.mkdtemp(prefix='minimalisp-bench-')
+        atexit.register(shutil.rmtree, directory, True)
+        os.mkdir(os.path.join(directory, 'lib'))
+        with open(os.path.join(directory, 'lib', 'ext.l'), 'w') as f:
+            f.write(stdlib)
+        _scratch.append(directory)
+    return _scratch[0]
+
+
+class Sandbox(object):
+    """runs a program in the scratch directory, answering GETS from stdin, and discarding its
+    output."""
+    def __init__(self, stdin=""):
+        self.input = stdin
+
+    def __enter__(self):
+        self.cwd = os.getcwd()
+        os.chdir(scratch_directory())
+        self.stdin, self.stdout = sys.stdin, sys.stdout
+        sys.stdin, sys.stdout = StringIO(self.input), Discard()
+        return self
+
+    def __exit__(self, *exc_info):
+        sys.stdin, sys.stdout = self.stdin, self.stdout
+        os.chdir(self.cwd)
+
+
+def random_expression(rng, depth, variables=('x', 'y')):
+    """a random arithmetic tree, as source, of the kind a GP population is made of."""
+    if depth == 0 or rng.random() < 0.25:
+        if rng.random() < 0.5:
+            return rng.choice(variables)
+        return str(rng.randint(1, 9))
+    op = rng.choice(['+', '-', '*', '/', 'if'])
+    if op == 'if':
+        return "(if (< %s %s) '%s '%s)" % tuple(random_expression(rng, depth - 1, variables)
+            for i in range(4))
+    return "(%s %s %s)" % (op, random_expression(rng, depth - 1, variables),
+        random_expression(rng, depth - 1, variables))
+
+
+def synthetic_source(size):
+    """about size bytes of program: bindings of random expressions, and the tests' own code."""
+    rng = random.Random(size)
+    parts = []
+    length = 0
+    programs = [open(os.path.join(TESTS, name)).read() for name in ('tutorial.l', 'valid.l')]
+    while length < size:
+        if rng.random() < 0.2:
+            part = rng.choice(programs)
+        else:
+            part = "(bind 'f%d (with '(x y) '%s))\n" % (rng.randint(0, 99), random_expression(rng, 6))
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+for size in (10000, 100000, 1000000):
+    def parse_setup(size=size):
+        source = synthetic_source(size)
+        return lambda: parse_program(source)
+    benchmark("parse/synthetic-%dk" % (size // 1000))(parse_setup)
+
+
+for engine in ENGINES:
+    for program in ('tutorial', 'dowhile', 'valid', 'eval', 'tail_recursion'):
+        def run_setup(engine=engine, program=program):
+            run = engine_run(engine)
+            source = open(os.path.join(TESTS, program + '.l')).read()
+            parsed = parse_program(source)
+
+            def run_program():
+                with Sandbox("3\n4\n5\n"):
+                    try:
+                        run(parsed, "(benchmark)")
+                    except vm.LispRuntimeError:
+                        # the tutorial ends by demonstrating an error.
+                        pass
+            return run_program
+        benchmark("run/%s/%s" % (program, engine))(run_setup)
+
+
+def stdlib_context():
+    context = vm.Context(parent=vm.program_context("(benchmark)"))
+    vm.internal_import(context, "(stdlib)", parse_program(stdlib))
+    return context
+
+
+for function in ('len', 'pos'):
+    for size in (100, 1000, 5000):
+        def recursion_setup(function=function, size=size, native=False):
+            if native:
+                context = vm.Context(parent=vm.program_context("(benchmark)"))
+            else:
+                context = stdlib_context()
+            context[Symbol('l')] = parse_program("'(%s)" % " ".join(str(i) for i in range(size)))[0]
+            call = parse_program({
+                'len': "(len l)",
+                'pos': "(pos %d l)" % (size - 1)
+            }[function])[0]
+            return lambda: vm.peval(context, call)
+        benchmark("recursion/%s-%d" % (function, size))(recursion_setup)
+        # the builtin, which needs no recursion.
+        benchmark("native/%s-%d" % (function, size))(
+            lambda function=function, size=size: recursion_setup(function, size, native=True))
+
+
+for size in (100, 1000, 5000):
+    def vector_setup(size=size):
+        # the length and last item of a vector, for comparison with len and pos of a list.
+        context = vm.Context(parent=vm.program_context("(benchmark)"))
+        context[Symbol('v')] = Vector([Value(i, actual=True) for i in range(size)])
+        call = parse_program("(vget v (- (vlen v) 1))")[0]
+        return lambda: vm.peval(context, call)
+    benchmark("vector/last-%d" % size)(vector_setup)
+
+
+for size in (100, 500):
+    def population_setup(size=size):
+        from minimalisp.population import evaluate_population
+        rng = random.Random(size)
+        programs = [random_expression(rng, 6) for i in range(size)]
+        cases = [{'x': i, 'y': i / 4} for i in range(-20, 20)]
+        return lambda: evaluate_population(programs, cases, processes=1)
+    benchmark("gp/population-%d" % size)(population_setup)
+
+
+def time_benchmark(setup, repeat, minimum=0.05):
+    """times the function setup returns, repeat times. Functions faster than minimum are called
+    several times for each timing, as timeit does, and the time per call recorded."""
+    function = setup()
+    number = 1
+    while True:
+        start = default_timer()
+        for i in range(number):
+            function()
+        if default_timer() - start >= minimum:
+            break
+        number *= 2
+
+    times = []
+    for i in range(repeat):
+        start = default_timer()
+        for j in range(number):
+            function()
+        times.append((default_timer() - start) / number)
+    times.sort()
+    return {'best': times[0], 'median': times[len(times) // 2], 'number': number, 'times': times}
+
+
+def run_benchmarks(pattern=None, repeat=5, report=None):
+    """runs the benchmarks whose names contain pattern, returning the results as a dict."""
+    # deep recursion through peval needs more than the default stack.
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+    results = {}
+    for name, setup in registry:
+        if pattern is not None and pattern not in name:
+            continue
+        gc.collect()
+        results[name] = time_benchmark(setup, repeat)
+        if report is not None:
+            report(name, results[name])
+
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': numpy_version,
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def save(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+
+def load(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compare(before, after, threshold=0.1):
+    """compares the best times of two runs, returning (name, before, after, ratio, regressed) for
+    each benchmark in both. A benchmark has regressed if it takes more than threshold longer."""
+    rows = []
+    for name in sorted(set(before['results']) & set(after['results'])):
+        old = before['results'][name]['best']
+        new = after['results'][name]['best']
+        ratio = new / old if old else float('inf')
+        rows.append((name, old, new, ratio, ratio > 1 + threshold))
+    return rows
@@ -0,0 +1,60 @@
+from __future__ import print_function, division
+
+import sys
+import argparse
+
+import benchmarks
+
+
+def report(name, result):
+    print("%-36s best %10.6fs  median %10.6fs" % (name, result['best'], result['median']))
+
+
+def parse_args(args=sys.argv[1:]):
+    p = argparse.ArgumentParser(prog="python -m benchmarks",
+        description="times minimalisp's parsing, evaluation, recursion and GP workloads.")
+    p.add_argument('-o', '--output', help="write the results to this file, as JSON.", type=str)
+    p.add_argument('-k', help="only run benchmarks whose names contain this.", type=str)
+    p.add_argument('--repeat', help="times to run each benchmark.", type=int, default=5)
+    p.add_argument('--list', help="list the benchmarks, and exit.", action='store_true')
+    return p.parse_args(args)
+
+
+def parse_compare_args(args):
+    p = argparse.ArgumentParser(prog="python -m benchmarks compare",
+        description="compares two runs' results, failing if any benchmark has become slower.")
+    p.add_argument('before', help="results file of the first run.", type=str)
+    p.add_argument('after', help="results file of the second run.", type=str)
+    p.add_argument('--threshold', help="fraction slower which counts as a regression.",
+        type=float, default=0.1)
+    return p.parse_args(args)
+
+
+def compare(args):
+    rows = benchmarks.compare(benchmarks.load(args.before), benchmarks.load(args.after),
+        args.threshold)
+    for name, before, after, ratio, regressed in rows:
+        print("%-36s %10.6fs %10.6fs %6.2fx%s" % (name, before, after, ratio,
+            "  SLOWER" if regressed else ""))
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+def main():
+    if sys.argv[1:2] == ['compare']:
+        return compare(parse_compare_args(sys.argv[2:]))
+
+    args = parse_args()
+    if args.list:
+        for name, setup in benchmarks.registry:
+            if args.k is None or args.k in name:
+                print(name)
+        return 0
+
+    results = benchmarks.run_benchmarks(args.k, args.repeat, report)
+    if args.output is not None:
+        benchmarks.save(results, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
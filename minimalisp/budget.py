@@ -0,0 +1,102 @@
+"""Limits how much work evaluating a program may do, so that a generated program which loops
+forever, or recurses exponentially, is stopped rather than hanging its caller.
+
+    with Budget(steps=100000, seconds=1.0):
+        run(program, env)
+
+raises BudgetExceeded (a LispRuntimeError) as soon as any limit is passed. A step is a function
+call, or one more time round a DOWHILE loop, in any of the engines; allocations are the Pairs and
+Values created. The time is only checked every check_every steps, since reading the clock costs
+more than a step does.
+
+Budgets do not nest: an inner budget replaces the outer one until it ends."""
+
+from __future__ import print_function, division
+
+from timeit import default_timer
+
+import values
+import vm
+from vm import LispRuntimeError
+
+
+class BudgetExceeded(LispRuntimeError):
+    """stats is a dict of the steps, allocations and seconds used when the budget ran out, and
+    limit names the one which did."""
+    def __init__(self, message, limit, stats):
+        super(BudgetExceeded, self).__init__(message)
+        self.limit = limit
+        self.stats = stats
+
+    def __reduce__(self):
+        # so that it can be sent back from a worker process.
+        return (BudgetExceeded, (self.args[0], self.limit, self.stats))
+
+
+class Budget(object):
+    def __init__(self, steps=None, allocations=None, seconds=None, check_every=1000,
+            clock=default_timer):
+        self.max_steps = steps
+        self.max_allocations = allocations
+        self.max_seconds = seconds
+        self.check_every = check_every
+        self.clock = clock
+
+        self.steps = 0
+        self.allocations = 0
+        self.start = None
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.end()
+
+    def begin(self):
+        """starts limiting evaluation, until end is called."""
+        self.start = self.clock()
+        self.next_check = 0
+        self.schedule_check()
+
+        self.previous = vm.BUDGET, values.BUDGET
+        vm.BUDGET = self
+        # allocations are counted by the constructors of every Pair and Value, so only if asked.
+        values.BUDGET = self if self.max_allocations is not None else None
+
+    def end(self):
+        vm.BUDGET, values.BUDGET = self.previous
+
+    def stats(self):
+        return {
+            'steps': self.steps,
+            'allocations': self.allocations,
+            'seconds': self.clock() - self.start if self.start is not None else 0.0
+        }
+
+    def exceeded(self, limit, maximum):
+        raise BudgetExceeded("evaluation exceeded its budget of %r %s." % (maximum, limit), limit,
+            self.stats())
+
+    def schedule_check(self):
+        """sets the step at which to next look at the step count and the clock."""
+        checks = []
+        if self.max_steps is not None:
+            checks.append(self.max_steps + 1)
+        if self.max_seconds is not None:
+            checks.append(self.steps + self.check_every)
+        self.next_check = min(checks) if checks else float('inf')
+
+    def step(self):
+        self.steps += 1
+        if self.steps >= self.next_check:
+            if self.max_steps is not None and self.steps > self.max_steps:
+                self.exceeded('steps', self.max_steps)
+            if self.max_seconds is not None and self.clock() - self.start > self.max_seconds:
+                self.exceeded('seconds', self.max_seconds)
+            self.schedule_check()
+
+    def allocate(self):
+        self.allocations += 1
+        if self.allocations > self.max_allocations:
+            self.exceeded('allocations', self.max_allocations)
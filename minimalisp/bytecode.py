@@ -0,0 +1,494 @@
+"""Compiles S-expressions to a flat bytecode, run by a stack machine, and caches the bytecode of
+each program file beside it, so that a program which has not changed need not be parsed again.
+
+Each expression compiles to a Code object: a list of instructions, three ints each (an opcode and
+two arguments), and the constants they refer to by index. A call (f a b) compiles to
+
+    FUNCTION (f a b)    look up f, and push it
+    LOAD a              push the value of a
+    LOAD b              push the value of b
+    CALL 2              call f with the two values on top of the stack
+
+Function bodies, IF branches and anything else passed to EVAL are only known at runtime, since
+they are data until they are run, and are compiled the first time they are run.
+
+As with peval, a call which is the last thing a function (or IF, or EVAL) does is made without
+growing the python stack, and may reuse the context of the function it returns from.
+
+The cache for foo.l is foo.lc, and is used only if the source has the same hash as when it was
+written. Files whose names do not end in .l are compiled each time, and have no cache."""
+
+from __future__ import print_function, division
+
+import os
+import marshal
+import hashlib
+from array import array
+
+from values import NIL, LispType, LispValue, Symbol, Value, Pair, unquote
+from parse import parse_program
+
+import vm
+from vm import Context, LispRuntimeError, TailCall, UserLispFunction, check_count, truthy, \
+    _if, _eval, dowhile
+from compiled import CodeCache, argument_list
+
+
+# opcodes: each instruction is (opcode, a, b).
+CONST = 0     # push consts[a].
+QUOTE = 1     # push an unquoted copy of the quoted Pair consts[a].
+LOAD = 2      # push the value of the symbol consts[a].
+FUNCTION = 3  # push whether this is a tail call, then the function the call consts[a] names. If it
+              # is a callable which evaluates its own arguments, call it now and jump to b.
+TAIL = 4      # push whether this is a tail call, before computing a function with HEAD.
+HEAD = 5      # as FUNCTION, but the function is already on the stack.
+CALL = 6      # call the function under the top a values of the stack, with them as arguments.
+RAW = 7       # call the function on the stack with the unevaluated improper arguments of consts[a].
+ERROR = 8     # raise a LispRuntimeError with the message consts[a].
+
+
+class Code(object):
+    __slots__ = ('ops', 'consts')
+
+    def __init__(self, ops, consts):
+        self.ops = ops
+        self.consts = consts
+
+
+def compile_expression(o):
+    """compiles a single expression to a Code object."""
+    ops = []
+    consts = []
+    const_index = {}
+
+    def const(c):
+        i = const_index.get(id(c))
+        if i is None:
+            i = const_index[id(c)] = len(consts)
+            consts.append(c)
+        return i
+
+    def error(message):
+        ops.extend((ERROR, const(Value(message, actual=True)), 0))
+
+    def expression(o):
+        if not isinstance(o, LispType):
+            error("peval was passed %r, which is not a LispType instance." % o)
+        elif isinstance(o, LispValue):
+            ops.extend((CONST, const(o), 0))
+        elif isinstance(o, Pair) and o.quoted:
+            ops.extend((QUOTE, const(o), 0))
+        elif isinstance(o, Symbol):
+            if o.quoted:
+                ops.extend((CONST, const(o.unquoted), 0))
+            else:
+                ops.extend((LOAD, const(o), 0))
+        elif hasattr(o, '__call__'):
+            error("cannot evaluate a function")
+        elif not isinstance(o, Pair):
+            error("cannot evaluate %s" % o)
+        else:
+            call(o)
+
+    def call(o):
+        head = o.left
+        form = const(o)
+        if isinstance(head, Symbol):
+            start = len(ops)
+            ops.extend((FUNCTION, form, 0))
+        elif isinstance(head, Pair) or hasattr(head, '__call__'):
+            ops.extend((TAIL, 0, 0))
+            if isinstance(head, Pair):
+                expression(head)
+            else:
+                ops.extend((CONST, const(head), 0))
+            start = len(ops)
+            ops.extend((HEAD, form, 0))
+        else:
+            error("result %r cannot be executed as a function" % head)
+            return
+
+        items = argument_list(o.right)
+        if items is None:
+            # not a proper list of arguments: let the function itself deal with it.
+            ops.extend((RAW, form, 0))
+        else:
+            for i in items:
+                expression(i)
+            ops.extend((CALL, len(items), 0))
+
+        # where a function which evaluates its own arguments carries on from.
+        ops[start + 2] = len(ops)
+
+    expression(o)
+    return Code(ops, consts)
+
+
+class Machine(object):
+    def __init__(self):
+        # as compiled.Compiler.cache, for code which is only known at runtime.
+        self.cache = CodeCache()
+
+    def code_for(self, o):
+        if not isinstance(o, Pair):
+            return compile_expression(o)
+
+        key = (id(o.left), id(o.right), o.quoted)
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = (o.left, o.right, compile_expression(o))
+            self.cache.put(key, entry)
+        return entry[2]
+
+    def evaluate(self, context, o):
+        """equivalent to vm.peval(context, o)."""
+        return self.execute(self.code_for(o), context)
+
+    def execute(self, code, context, finished=None):
+        """runs code in context, returning its value. finished is context, if it belongs to a
+        user function which has returned, so that the first call made here may reuse it."""
+        ops, consts = code.ops, code.consts
+        end = len(ops)
+        stack = []
+        pc = 0
+
+        while True:
+            if pc == end:
+                return stack.pop()
+
+            op = ops[pc]
+
+            if op == LOAD:
+                stack.append(context[consts[ops[pc + 1]]])
+                pc += 3
+                continue
+            elif op == CONST:
+                stack.append(consts[ops[pc + 1]])
+                pc += 3
+                continue
+            elif op == QUOTE:
+                quoted = consts[ops[pc + 1]]
+                stack.append(unquote(quoted))
+                pc += 3
+                continue
+            elif op == FUNCTION or op == HEAD:
+                if vm.BUDGET is not None:
+                    vm.BUDGET.step()
+
+                form = consts[ops[pc + 1]]
+                if op == FUNCTION:
+                    tail = context is finished
+                    finished = None
+                    function = context[form.left]
+                    if not hasattr(function, '__call__'):
+                        raise LispRuntimeError("symbol %r is not bound to a function, but %r" % (
+                            form.left, function))
+                else:
+                    function = stack.pop()
+                    tail = stack.pop()
+                    if not hasattr(function, '__call__'):
+                        raise LispRuntimeError("result %r cannot be executed as a function" % function)
+
+                if isinstance(function, UserLispFunction) or hasattr(function, 'execute'):
+                    stack.append(tail)
+                    stack.append(function)
+                    pc += 3
+                    continue
+
+                # someone else's callable, which evaluates its own arguments.
+                result = function(context, form.right)
+                pc = ops[pc + 2]
+            elif op == TAIL:
+                stack.append(context is finished)
+                finished = None
+                pc += 3
+                continue
+            elif op == CALL:
+                count = ops[pc + 1]
+                if count:
+                    args = stack[-count:]
+                    del stack[-count:]
+                else:
+                    args = []
+                function = stack.pop()
+                tail = stack.pop()
+                pc += 3
+                result = self.call(context, function, args, tail)
+            elif op == RAW:
+                function = stack.pop()
+                tail = stack.pop()
+                result = function(context, consts[ops[pc + 1]].right)
+                pc += 3
+            else:
+                raise LispRuntimeError(consts[ops[pc + 1]].v)
+
+            if not isinstance(result, TailCall):
+                stack.append(result)
+                continue
+
+            if result.finished:
+                next_finished = result.context
+            elif result.context is context and tail:
+                # IF and EVAL pass on the tail call they were given.
+                next_finished = context
+            else:
+                next_finished = None
+
+            if pc == end:
+                # we have nothing left to do but this: do it here, rather than by recursing.
+                code = self.code_for(result.expression)
+                ops, consts = code.ops, code.consts
+                end = len(ops)
+                context = result.context
+                finished = next_finished
+                pc = 0
+            else:
+                stack.append(self.execute(
+                    self.code_for(result.expression), result.context, next_finished))
+
+    def call(self, context, function, args, tail):
+        """calls function with evaluated args, returning its value or a TailCall."""
+        count = len(args)
+
+        if isinstance(function, UserLispFunction):
+            check_count("(user function)", function.minc, function.maxc, count)
+            inner_context = function.new_context(context, args, reuse=tail)
+            function.last_execute_context = inner_context
+
+            body = function.functionbody
+            if not body:
+                return NIL()
+            for line in body[:-1]:
+                self.evaluate(inner_context, line)
+            return TailCall(inner_context, body[-1], finished=True)
+
+        check_count(function.method, function.minc, function.maxc, count)
+
+        if function is _if and 2 <= count <= 3:
+            if truthy(context, args[0]):
+                return TailCall(context, args[1])
+            elif count == 3:
+                return TailCall(context, args[2])
+            return NIL()
+        elif function is _eval:
+            if not args:
+                return NIL()
+            for line in args[:-1]:
+                self.evaluate(context, line)
+            return TailCall(context, args[-1])
+        elif function is dowhile:
+            result = NIL()
+            for line in args:
+                result = self.evaluate(context, line)
+            while truthy(context, result):
+                if vm.BUDGET is not None:
+                    vm.BUDGET.step()
+                for line in args:
+                    result = self.evaluate(context, line)
+            return NIL()
+
+        return function.execute(context, *args)
+
+
+# the kinds of node in a saved tree (see encode.)
+LIST = 'l'
+QUOTED_LIST = 'L'
+IMPROPER = 'i'
+QUOTED_IMPROPER = 'I'
+SYMBOL = 's'
+QUOTED_SYMBOL = 'S'
+VALUE = 'v'
+EMPTY = 'n'
+
+FORMAT = 1
+MAGIC = 'MLC%d' % FORMAT
+
+
+def packed(numbers):
+    """a marshallable string of non-negative ints, two bytes each if they fit."""
+    typecode = 'H' if max(numbers or [0]) < 2 ** 16 else 'l'
+    return typecode + array(typecode, numbers).tostring()
+
+
+def unpacked(string):
+    numbers = array(string[0])
+    numbers.fromstring(string[1:])
+    return numbers
+
+
+def encode(codes):
+    """returns a marshallable version of a list of Code objects. Their constants are encoded as
+    a table of nodes, each list (rather than each Pair) being one node, which refers to the nodes
+    it contains by their index. Nodes come before any which contain them."""
+    kinds = []
+    # for lists, the number of items, then their indices (and the tail's, for improper lists.)
+    numbers = []
+    atoms = []
+    index = {}
+
+    def add(o):
+        to_visit = [o]
+        while to_visit:
+            o = to_visit[-1]
+            if id(o) in index:
+                to_visit.pop()
+                continue
+
+            if isinstance(o, Pair):
+                items = [o.left]
+                rest = o.right
+                while isinstance(rest, Pair) and not rest.quoted:
+                    items.append(rest.left)
+                    rest = rest.right
+                if not isinstance(rest, NIL):
+                    items.append(rest)
+
+                missing = [i for i in items if id(i) not in index]
+                if missing:
+                    to_visit.extend(missing)
+                    continue
+
+                if isinstance(rest, NIL):
+                    kinds.append(QUOTED_LIST if o.quoted else LIST)
+                    numbers.append(len(items))
+                else:
+                    kinds.append(QUOTED_IMPROPER if o.quoted else IMPROPER)
+                    numbers.append(len(items) - 1)
+                numbers.extend(index[id(i)] for i in items)
+            elif isinstance(o, Symbol):
+                kinds.append(QUOTED_SYMBOL if o.quoted else SYMBOL)
+                atoms.append(o.s)
+            elif isinstance(o, NIL):
+                kinds.append(EMPTY)
+            elif isinstance(o, Value):
+                kinds.append(VALUE)
+                atoms.append(o.v)
+            else:
+                raise ValueError("%r cannot be saved." % (o,))
+
+            index[id(o)] = len(index)
+            to_visit.pop()
+
+    # every Code's instructions, and constants, one after the other.
+    ops = []
+    consts = []
+    lengths = []
+    for code in codes:
+        for c in code.consts:
+            add(c)
+        ops.extend(code.ops)
+        consts.extend(index[id(c)] for c in code.consts)
+        lengths.extend((len(code.ops), len(code.consts)))
+
+    return ("".join(kinds), packed(numbers), atoms, packed(ops), packed(consts), packed(lengths))
+
+
+def decode(data):
+    """the inverse of encode."""
+    kinds, numbers, atoms, ops, consts, lengths = data
+    numbers = unpacked(numbers)
+
+    nodes = []
+    position = 0
+    atom = 0
+    nil = NIL.instance
+
+    for kind in kinds:
+        if kind in 'lLiI':
+            count = numbers[position]
+            position += 1
+            items = numbers[position:position + count]
+            position += count
+            if kind in 'iI':
+                right = nodes[numbers[position]]
+                position += 1
+            else:
+                right = nil
+            for i in reversed(items):
+                right = Pair(nodes[i], right)
+            if kind in 'LI':
+                right.quoted = True
+            nodes.append(right)
+        elif kind == SYMBOL or kind == QUOTED_SYMBOL:
+            nodes.append(Symbol(atoms[atom], kind == QUOTED_SYMBOL))
+            atom += 1
+        elif kind == VALUE:
+            nodes.append(Value(atoms[atom], actual=True))
+            atom += 1
+        else:
+            nodes.append(nil)
+
+    ops = unpacked(ops).tolist()
+    consts = unpacked(consts)
+    lengths = unpacked(lengths)
+
+    codes = []
+    op, const = 0, 0
+    for i in xrange(0, len(lengths), 2):
+        op_count, const_count = lengths[i], lengths[i + 1]
+        codes.append(Code(ops[op:op + op_count], [nodes[c] for c in consts[const:const + const_count]]))
+        op += op_count
+        const += const_count
+    return codes
+
+
+def compile_program(program):
+    return [compile_expression(form) for form in program]
+
+
+def load(filename):
+    """returns the compiled top level forms of a program file, from its cache if that was written
+    from the same source, and otherwise by parsing and compiling it (and saving the cache.)"""
+    source = open(filename, 'r').read()
+    root, extension = os.path.splitext(filename)
+    if extension != '.l':
+        # the cache's name might be another file's, e.g. progc beside prog.
+        return compile_program(parse_program(source))
+    key = hashlib.sha1(source).digest()
+    cache_name = root + '.lc'
+
+    try:
+        with open(cache_name, 'rb') as f:
+            cached = f.read()
+        if cached[:len(MAGIC)] == MAGIC and cached[len(MAGIC):len(MAGIC) + len(key)] == key:
+            return decode(marshal.loads(cached[len(MAGIC) + len(key):]))
+    except (IOError, EOFError, ValueError, TypeError, IndexError):
+        # no cache, or an unreadable one: compile from source.
+        pass
+
+    codes = compile_program(parse_program(source))
+
+    try:
+        # written to a temporary file and renamed, so that no one can read half a cache.
+        temporary_name = "%s.%d" % (cache_name, os.getpid())
+        with open(temporary_name, 'wb') as f:
+            f.write(MAGIC + key + marshal.dumps(encode(codes)))
+        os.rename(temporary_name, cache_name)
+    except (IOError, OSError):
+        # e.g. a read only directory: we just don't get a cache.
+        pass
+
+    return codes
+
+
+def run_library(canonical_module_name, codes):
+    """runs an imported program in a context of its own, registered in the import cache, as
+    vm.eval_library does."""
+    outer_context = Context(vm.default_context_bindings(), environment=canonical_module_name)
+    context = Context(parent=outer_context)
+    machine = Machine()
+    for code in codes:
+        machine.execute(code, context)
+    vm.modules()[canonical_module_name] = context
+
+
+def run(program, program_environment, with_math=False):
+    """equivalent to vm.run, with the program compiled to bytecode. program may be a list of Code
+    objects (e.g. from load) or of top level forms."""
+    context = Context(parent=vm.program_context(program_environment, with_math))
+    machine = Machine()
+    for line in program:
+        if isinstance(line, Code):
+            machine.execute(line, context)
+        else:
+            machine.evaluate(context, line)
@@ -0,0 +1,312 @@
+"""An alternative to the tree-walking `peval`: each S-expression is compiled once into nested python
+closures, which can then be run any number of times. All the decisions peval makes by inspecting a
+node (is it a Value, a quoted Pair, a function call?) are made when the closure is built, rather
+than on every evaluation.
+
+Functions are still looked up by symbol when they are called, since any symbol can be rebound at
+runtime. Each call site remembers the last function it saw, and how to call it, so that a call site
+which always calls the same function only pays for the dispatch once."""
+
+from __future__ import print_function, division
+
+from values import NIL, LispType, LispValue, Symbol, Pair, SharedPair, unquote
+
+import vm
+from vm import LispRuntimeError, TailCall, UserLispFunction, check_count, truthy, _if, _eval, dowhile
+
+
+def argument_list(arguments):
+    """returns a python list of the items in an S-expression, or None if it is not a proper list
+    (in which case we leave pre_execute_impl to complain at runtime.)"""
+    items = []
+    while arguments is not NIL.instance:
+        if not isinstance(arguments, Pair):
+            return None
+        items.append(arguments.left)
+        arguments = arguments.right
+    return items
+
+
+def raiser(exception):
+    def raise_it(context):
+        raise exception
+    return raise_it
+
+
+class CodeCache(object):
+    """the code compiled for Pairs only known at runtime, keyed by what they contain. At most
+    maxsize entries are kept: as for memo.Memo's values, entries go in recent, and when it is half
+    full it becomes older, and what was older is forgotten. Entries found in older are moved back
+    to recent.
+
+    Each entry keeps a reference to the objects whose ids are in its key, so that their ids cannot
+    be reused while it is kept."""
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.recent, self.older = {}, {}
+
+    def __len__(self):
+        return len(self.recent) + len(self.older)
+
+    def get(self, key):
+        entry = self.recent.get(key)
+        if entry is None:
+            entry = self.older.get(key)
+            if entry is not None:
+                self.put(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        self.recent[key] = entry
+        if len(self.recent) >= self.maxsize // 2:
+            self.recent, self.older = {}, self.recent
+
+
+class Compiler(object):
+    """compiles lisp objects to closures which take a single argument, the context to run in.
+
+    Code which is only known at runtime (the quoted branches passed to IF, the lines of a user
+    function, anything passed to EVAL) is compiled the first time it is run, and cached.
+
+    As in peval, IF, EVAL and user functions return a TailCall rather than evaluating their last
+    expression, and trampoline evaluates these in a loop."""
+    def __init__(self):
+        self.cache = CodeCache()
+        # set by trampoline to a context whose user function has returned, for the call it is
+        # about to make to pick up (see vm.UserLispFunction.tail_call.)
+        self.finished = None
+
+    def ceval(self, context, o):
+        """equivalent to vm.peval, but runs the compiled version of o, and may return a TailCall."""
+        if not isinstance(o, Pair):
+            return self.compile(o)(context)
+
+        # unquoting a Pair always builds a new one, so we key on its contents rather than itself.
+        key = (id(o.left), id(o.right), o.quoted)
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = (o.left, o.right, self.compile(o))
+            self.cache.put(key, entry)
+        return entry[2](context)
+
+    def trampoline(self, result):
+        finished = None
+        while isinstance(result, TailCall):
+            if result.finished:
+                finished = result.context
+            elif result.context is not finished:
+                finished = None
+            self.finished = finished
+            result = self.ceval(result.context, result.expression)
+        self.finished = None
+        return result
+
+    def compile_value(self, o):
+        """as compile, but the closure always returns a value rather than a TailCall."""
+        code = self.compile(o)
+        if not isinstance(o, Pair) or o.quoted:
+            return code
+
+        trampoline = self.trampoline
+        return lambda context: trampoline(code(context))
+
+    def compile(self, o):
+        if not isinstance(o, LispType):
+            return raiser(LispRuntimeError(
+                "peval was passed %r, which is not a LispType instance." % o))
+
+        if isinstance(o, LispValue):
+            return lambda context: o
+
+        if isinstance(o, Pair) and o.quoted:
+            if type(o) is SharedPair:
+                # there is only one copy to give.
+                unquoted = unquote(o)
+                return lambda context: unquoted
+            left, right = o.left, o.right
+            return lambda context: Pair(left, right)
+
+        if isinstance(o, Symbol):
+            if o.quoted:
+                unquoted = o.unquoted
+                return lambda context: unquoted
+            return lambda context: context[o]
+
+        if hasattr(o, '__call__'):
+            return raiser(LispRuntimeError("cannot evaluate a function"))
+
+        if not isinstance(o, Pair):
+            return raiser(LispRuntimeError("cannot evaluate %s", o))
+
+        return self.compile_call(o)
+
+    def compile_call(self, pair):
+        head = pair.left
+
+        if isinstance(head, Symbol):
+            def function_of(context):
+                function = context[head]
+                if not hasattr(function, '__call__'):
+                    raise LispRuntimeError("symbol %r is not bound to a function, but %r" % (
+                        head, function))
+                return function
+        elif isinstance(head, Pair):
+            head_code = self.compile_value(head)
+
+            def function_of(context):
+                function = head_code(context)
+                if not hasattr(function, '__call__'):
+                    raise LispRuntimeError("result %r cannot be executed as a function" % function)
+                return function
+        elif hasattr(head, '__call__'):
+            function_of = lambda context: head
+        else:
+            return raiser(LispRuntimeError("result %r cannot be executed as a function" % head))
+
+        arguments = pair.right
+        items = argument_list(arguments)
+        if items is None:
+            # not a proper list of arguments: let the function itself deal with it.
+            def call_improper(context):
+                if vm.BUDGET is not None:
+                    vm.BUDGET.step()
+                return function_of(context)(context, arguments)
+            return call_improper
+
+        argument_codes = [self.compile_value(i) for i in items]
+
+        # inline cache: the last function called from here, and the handler which calls it.
+        last = [None, None]
+
+        def call(context):
+            # only the first call made in a finished context may reuse it: our arguments may make
+            # calls of their own, which must not.
+            tail = self.finished is context
+            if tail:
+                self.finished = None
+
+            if vm.BUDGET is not None:
+                vm.BUDGET.step()
+
+            function = function_of(context)
+            if function is not last[0]:
+                last[0] = function
+                last[1] = self.handler_for(function, arguments)
+            return last[1](context, [code(context) for code in argument_codes], tail)
+
+        return call
+
+    def handler_for(self, function, arguments):
+        """returns a function taking a context, the already evaluated arguments, and whether the
+        context is finished with."""
+        if isinstance(function, UserLispFunction):
+            return self.user_function_handler(function)
+
+        execute = getattr(function, 'execute', None)
+        if execute is None:
+            # someone else's callable, which evaluates its own arguments.
+            return lambda context, args, tail: function(context, arguments)
+
+        method, minc, maxc = function.method, function.minc, function.maxc
+        special = {
+            _if: self.if_handler,
+            _eval: self.eval_handler,
+            dowhile: self.dowhile_handler
+        }.get(function)
+
+        if special is not None:
+            return special(method, minc, maxc, execute)
+
+        # the number of arguments is known here, so we can use the implementation for that many
+        # (see vm.fixed_arity) rather than checking it on every call.
+        fast = getattr(function, 'fast', ())
+        count = len(argument_list(arguments))
+        if count < len(fast) and fast[count] is not None:
+            fixed = fast[count]
+            return lambda context, args, tail: fixed(context, *args)
+
+        def builtin(context, args, tail):
+            check_count(method, minc, maxc, len(args))
+            return execute(context, *args)
+        return builtin
+
+    def user_function_handler(self, function):
+        ceval, trampoline = self.ceval, self.trampoline
+
+        def user_function(context, args, tail):
+            check_count("(user function)", function.minc, function.maxc, len(args))
+            inner_context = function.new_context(context, args, reuse=tail)
+            function.last_execute_context = inner_context
+
+            body = function.functionbody
+            if not body:
+                return NIL()
+
+            for line in body[:-1]:
+                trampoline(ceval(inner_context, line))
+
+            return TailCall(inner_context, body[-1], finished=True)
+        return user_function
+
+    def if_handler(self, method, minc, maxc, execute):
+        def if_(context, args, tail):
+            count = len(args)
+            check_count(method, minc, maxc, count)
+            if count < 2 or count > 3:
+                # permissive mode, let the builtin fail in the same way.
+                return execute(context, *args)
+
+            if truthy(context, args[0]):
+                return TailCall(context, args[1])
+            elif count == 3:
+                return TailCall(context, args[2])
+            return NIL()
+        return if_
+
+    def eval_handler(self, method, minc, maxc, execute):
+        ceval, trampoline = self.ceval, self.trampoline
+
+        def eval_(context, args, tail):
+            check_count(method, minc, maxc, len(args))
+            if not args:
+                return NIL()
+
+            for line in args[:-1]:
+                trampoline(ceval(context, line))
+            return TailCall(context, args[-1])
+        return eval_
+
+    def dowhile_handler(self, method, minc, maxc, execute):
+        ceval, trampoline = self.ceval, self.trampoline
+
+        def dowhile_(context, body, tail):
+            check_count(method, minc, maxc, len(body))
+            result = NIL()
+            for line in body:
+                result = trampoline(ceval(context, line))
+
+            while truthy(context, result):
+                if vm.BUDGET is not None:
+                    vm.BUDGET.step()
+                for line in body:
+                    result = trampoline(ceval(context, line))
+
+            return NIL()
+        return dowhile_
+
+
+def compile_program(program, compiler=None):
+    """compiles each top level line of program (as returned by parse_program), returning a list
+    of closures which each take a context."""
+    if compiler is None:
+        compiler = Compiler()
+    return [compiler.compile_value(line) for line in program]
+
+
+def run(program, program_environment, with_math=False):
+    """equivalent to vm.run, using compiled closures rather than peval."""
+    context = vm.Context(parent=vm.program_context(program_environment, with_math))
+    compiler = Compiler()
+    for line in program:
+        # each top level form only runs once, so isn't worth caching.
+        compiler.compile_value(line)(context)
@@ -0,0 +1,259 @@
+"""Simplifies a parsed program before it is run, by evaluating what can be evaluated once and for
+all: calls to pure builtins whose arguments are all literal values, such as (+ 1 2), are replaced
+by their value, and IFs whose test is a literal value are replaced by the branch they take (if the
+branch not taken is literal or quoted, so that evaluating it, as IF's argument, does nothing.)
+
+    program, removed = fold_program(parse_program(source))
+    run(program, env)
+
+removed is the number of nodes (pairs, symbols and values) the program has lost.
+
+Any symbol can be rebound at runtime, so a call is only folded if the symbol at its head cannot
+be. Symbols are only ever bound by name, and names only come from the program's text (and the
+text of the libraries it imports), so a symbol can only be rebound if it appears quoted ('+), or
+anywhere inside quoted data ('(+ 1), whose CAR is the symbol +.) The quoted branches of IF, and
+the quoted lines of WITH, EVAL and DOWHILE, are code rather than data, unless those are rebindable
+themselves. A program which IMPORTs anything but a literal file name might rebind anything, so is
+left as it is.
+
+Calls which raise an error, such as (/ 1 0), are left to raise it when they are run."""
+
+from __future__ import print_function, division
+
+import os.path
+
+from values import NIL, Symbol, Value, Pair, SharedPair, shared_pair, unquote
+from parse import read_forms
+
+import vm
+import maths
+from vm import LispRuntimeError, check_count, truthy, _if, _with, _eval, dowhile
+from memo import PURE
+
+
+# the arguments of each of these builtins which are quoted code, by the number of arguments to
+# skip first.
+CODE_ARGUMENTS = {
+    _if: 1,
+    _with: 1,
+    _eval: 0,
+    dowhile: 0
+}
+
+IMPORT = Symbol('import')
+
+
+def call_parts(o):
+    """the head and list of arguments of an unquoted Pair, or None if it is an improper list."""
+    arguments = []
+    rest = o.right
+    while isinstance(rest, Pair):
+        arguments.append(rest.left)
+        rest = rest.right
+    if rest is not NIL.instance:
+        return None
+    return o.left, arguments
+
+
+def data_symbols(o, symbols):
+    """adds every symbol in o to symbols, without recursing."""
+    to_visit = [o]
+    while to_visit:
+        node = to_visit.pop()
+        if isinstance(node, Pair):
+            to_visit.extend([node.right, node.left])
+        elif isinstance(node, Symbol):
+            symbols.add(node.unquoted)
+
+
+def node_count(o):
+    """the number of pairs, symbols and values in o."""
+    count = 0
+    to_visit = [o]
+    while to_visit:
+        node = to_visit.pop()
+        if isinstance(node, Pair):
+            to_visit.extend([node.right, node.left])
+            count += 1
+        elif isinstance(node, (Symbol, Value)):
+            count += 1
+    return count
+
+
+class Folder(object):
+    """builtins is the dict of builtin functions the program will run with, and bound a set of
+    symbols which are rebound before it runs (the names of fitness cases, say.)"""
+    def __init__(self, builtins, bound=()):
+        self.builtins = builtins
+        self.bound = set(bound)
+        self.rebindable = None
+        # the libraries scanned so far.
+        self.imported = set()
+
+    def function_of(self, head):
+        """the builtin head will certainly call, or None."""
+        if not isinstance(head, Symbol) or head.quoted or head in self.rebindable:
+            return None
+        return self.builtins.get(head)
+
+    def code_arguments(self, head, arguments):
+        """the arguments which are quoted code, by index."""
+        skip = CODE_ARGUMENTS.get(self.function_of(head))
+        if skip is None:
+            return ()
+        return range(skip, len(arguments))
+
+    def analyse(self, program):
+        """works out the symbols which may be rebound, or returns False if any might be."""
+        self.rebindable = set(self.bound)
+        while True:
+            before = len(self.rebindable)
+            self.imported = set()
+            for line in program:
+                if not self.scan(line):
+                    return False
+            if IMPORT in self.rebindable:
+                # IMPORT may be called with any file name.
+                return False
+            if len(self.rebindable) == before:
+                return True
+
+    def scan(self, program_line):
+        """adds the symbols program_line could rebind to rebindable, returning False if it
+        could rebind any."""
+        to_visit = [program_line]
+        while to_visit:
+            o = to_visit.pop()
+            if isinstance(o, Symbol):
+                if o.quoted:
+                    self.rebindable.add(o.unquoted)
+                elif o is IMPORT:
+                    # passed around, to be called with who knows what.
+                    return False
+                continue
+            if not isinstance(o, Pair):
+                continue
+            if o.quoted:
+                data_symbols(o, self.rebindable)
+                continue
+
+            parts = call_parts(o)
+            if parts is None:
+                data_symbols(o, self.rebindable)
+                continue
+            head, arguments = parts
+
+            if head is IMPORT:
+                if not self.scan_import(arguments):
+                    return False
+            else:
+                to_visit.append(head)
+            code = self.code_arguments(head, arguments)
+            for i, a in enumerate(arguments):
+                if i in code and isinstance(a, Pair) and a.quoted:
+                    # as code, rather than data.
+                    to_visit.append(Pair(a.left, a.right))
+                else:
+                    to_visit.append(a)
+        return True
+
+    def scan_import(self, arguments):
+        if len(arguments) != 1 or not isinstance(arguments[0], Value) or \
+                not isinstance(arguments[0].v, str):
+            return False
+
+        path = os.path.abspath(arguments[0].v)
+        if path in self.imported:
+            return True
+        self.imported.add(path)
+        try:
+            with open(path, 'r') as library:
+                lines = list(read_forms(library))
+        except (IOError, AssertionError):
+            return False
+        return all(self.scan(line) for line in lines)
+
+    def fold(self, o):
+        """the simplified equivalent of the code o."""
+        if not isinstance(o, Pair) or o.quoted:
+            return o
+
+        parts = call_parts(o)
+        if parts is None:
+            return o
+        head, arguments = parts
+
+        code = self.code_arguments(head, arguments)
+        folded = [self.fold_quoted(a) if i in code else self.fold(a)
+            for i, a in enumerate(arguments)]
+        head = self.fold(head)
+
+        function = self.function_of(head)
+        if function in PURE and all(isinstance(a, Value) for a in folded):
+            try:
+                check_count(function.method, function.minc, function.maxc, len(folded))
+                value = function.execute(None, *folded)
+            except (LispRuntimeError, ArithmeticError, ValueError, TypeError):
+                pass
+            else:
+                if isinstance(value, Value) or value is NIL.instance:
+                    return value
+
+        if function is _if and 2 <= len(folded) <= 3 and \
+                (isinstance(folded[0], Value) or folded[0] is NIL.instance):
+            if truthy(None, folded[0]):
+                branch, others = folded[1], folded[2:]
+            elif len(folded) == 3:
+                branch, others = folded[2], folded[1:2]
+            else:
+                branch, others = NIL.instance, folded[1:2]
+            # IF evaluates both branches as its arguments before choosing, so the one not taken
+            # may only be dropped if evaluating it can have no effect.
+            taken = self.unquoted(branch)
+            if taken is not None and all(self.unquoted(b) is not None for b in others):
+                return taken
+
+        if head is o.left and all(a is b for a, b in zip(folded, arguments)):
+            return o
+        return Pair.pair_list_from_sexpr([head] + folded, shared=type(o) is SharedPair)
+
+    def fold_quoted(self, o):
+        """as fold, for quoted code: the quoted code, or the value, it simplifies to."""
+        if not isinstance(o, Pair) or not o.quoted:
+            return self.fold(o)
+
+        folded = self.fold(Pair(o.left, o.right))
+        if not isinstance(folded, Pair):
+            # a Value or NIL, which evaluates to itself just as well.
+            return folded
+        if folded.left is o.left and folded.right is o.right:
+            return o
+        if type(o) is SharedPair:
+            return shared_pair(folded.left, folded.right, True)
+        return Pair(folded.left, folded.right, True)
+
+    def unquoted(self, branch):
+        """the code which evaluates to what evaluating the value of branch does, or None."""
+        if isinstance(branch, Value) or branch is NIL.instance:
+            return branch
+        if isinstance(branch, Symbol) and branch.quoted:
+            return branch.unquoted
+        if isinstance(branch, Pair) and branch.quoted:
+            return unquote(branch)
+        return None
+
+
+def fold_program(program, with_math=False, bound=()):
+    """returns the simplified program, and the number of nodes removed from it. bound is the
+    symbols which the program will be run with bound, besides the builtins."""
+    builtins = dict(vm.default_context_bindings())
+    if with_math:
+        builtins.update(maths.maths_functions)
+
+    folder = Folder(builtins, bound)
+    if not folder.analyse(program):
+        return program, 0
+
+    folded = [folder.fold(line) for line in program]
+    removed = sum(node_count(line) for line in program) - sum(node_count(line) for line in folded)
+    return folded, removed
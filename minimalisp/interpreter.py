@@ -0,0 +1,62 @@
+"""An interpreter with state of its own: its builtins, the modules it has imported, whether it is
+permissive, and its random numbers. Interpreters configured differently can be used one after
+another, or inside one another, or in different threads at the same time, without seeing each
+other's modules or settings.
+
+    interpreter = Interpreter(with_math=True, permissive=True, seed=1)
+    interpreter.run(parse_program(source), "(program)")
+
+    with interpreter:
+        compiled.run(program, "(program)")
+
+Any engine's run may be used inside a with block: while an interpreter runs in a thread, vm looks
+its state up there rather than in vm's module globals (PERMISSIVE, import_cache, lib and the random
+module), which are used when none is running.
+
+A budget or profiler (see budget.py and profiler.py) still applies to every thread in the
+process."""
+
+from __future__ import print_function, division
+
+import random
+
+from parse import parse_program
+
+import vm
+import maths
+
+
+class Interpreter(object):
+    def __init__(self, with_math=False, permissive=False, seed=None):
+        self.builtins = dict(vm.BUILTINS)
+        if with_math:
+            self.builtins.update(maths.maths_functions)
+        self.import_cache = {}
+        self.permissive = permissive
+        self.random = random.Random(seed)
+
+    def __enter__(self):
+        # the interpreters which were running when this one was entered, to go back to, are kept
+        # for each thread, as the running interpreter is: one interpreter may be entered in several
+        # threads at once.
+        previous = getattr(vm._running, 'previous', None)
+        if previous is None:
+            previous = vm._running.previous = []
+        previous.append(vm.interpreter())
+        vm._running.interpreter = self
+        return self
+
+    def __exit__(self, *exc_info):
+        vm._running.interpreter = vm._running.previous.pop()
+
+    def run(self, program, program_environment, run=vm.run):
+        """runs program, a list of top level forms, with run (vm.run, or another engine's.)"""
+        with self:
+            return run(program, program_environment)
+
+    def run_source(self, source, program_environment, run=vm.run):
+        return self.run(parse_program(source), program_environment, run)
+
+    def forget_modules(self):
+        """so that the next IMPORT of each module runs it again."""
+        self.import_cache.clear()
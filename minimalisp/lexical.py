@@ -0,0 +1,268 @@
+"""A lexically scoped execution mode, built on the closure compiler.
+
+In the default mode each user function runs in a Context whose parent is its caller's, so looking up
+a global such as + walks one dictionary per call on the stack. Here, the names a WITH body can bind
+(its arguments, and the targets of any literal BIND or GETS in it) are found once, before the
+function is first called, and numbered. Each call gets a Frame: a fixed size list of those slots,
+whose parent is the frame the function was defined in. A symbol in the body compiles straight to a
+(depth, slot) address, so variable access costs the same however deep the recursion is.
+
+Symbols bound any other way (e.g. (bind (car l) 5)) still work, through a dictionary on the frame."""
+
+from __future__ import print_function, division
+
+from values import NIL, Symbol, Pair
+
+import vm
+from vm import Context, UserLispFunction, sexpr_from_iterator, TailCall, _with, imported
+
+from compiled import Compiler, CodeCache
+
+
+WITH = Symbol('with')
+BIND = Symbol('bind')
+GETS = Symbol('gets')
+
+# an empty slot: a local which has not been bound yet.
+_unbound = object()
+
+
+def bound_names(lines):
+    """finds the symbols a function body binds with literal BINDs and GETSs, including in quoted
+    code it will later EVAL, but not in the bodies of functions it defines."""
+    names = []
+    to_visit = list(lines)
+
+    while to_visit:
+        o = to_visit.pop()
+        if not isinstance(o, Pair):
+            continue
+
+        if o.left == WITH:
+            continue
+
+        targets = []
+        if o.left == BIND and isinstance(o.right, Pair):
+            targets = [o.right.left]
+        elif o.left == GETS:
+            arguments = o.right
+            while isinstance(arguments, Pair):
+                targets.append(arguments.left)
+                arguments = arguments.right
+
+        for t in targets:
+            if isinstance(t, Symbol) and t.quoted:
+                names.append(t.unquoted)
+
+        to_visit.append(o.left)
+        to_visit.append(o.right)
+
+    return names
+
+
+class Scope(object):
+    """the slots of one WITH body, and of the scopes it is nested in."""
+    def __init__(self, parameters, lines, parent):
+        self.parent = parent
+        self.index = {}
+        for name in list(parameters) + bound_names(lines):
+            if name not in self.index:
+                self.index[name] = len(self.index)
+
+    def resolve(self, symbol):
+        """returns (depth, slot) for symbol, or None if it is not a local of any enclosing scope."""
+        scope, depth = self, 0
+        while scope is not None:
+            slot = scope.index.get(symbol)
+            if slot is not None:
+                return depth, slot
+            scope, depth = scope.parent, depth + 1
+        return None
+
+
+class Frame(object):
+    """the context a lexically scoped function runs in. Supports the same lookups as Context, so
+    that builtins need not know the difference."""
+
+    # closures may still refer to a frame after its function returns, so it cannot be reused for
+    # a tail call.
+    captured = True
+
+    # the contexts of the modules imported into this frame, most recent first (see Context.attach.)
+    imports = ()
+
+    def __init__(self, scope, parent):
+        self.scope = scope
+        self.parent = parent
+        self.env = parent.env
+        self.slots = [_unbound] * len(scope.index)
+        # anything bound which the scope has no slot for.
+        self.extra = None
+
+    def __getitem__(self, key):
+        slot = self.scope.index.get(key)
+        if slot is not None:
+            value = self.slots[slot]
+            if value is not _unbound:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        if self.imports:
+            value = imported(self.imports, key, _unbound)
+            if value is not _unbound:
+                return value
+        return self.parent[key]
+
+    def __setitem__(self, key, value):
+        slot = self.scope.index.get(key)
+        if slot is not None:
+            self.slots[slot] = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        slot = self.scope.index.get(key)
+        if slot is not None:
+            if self.slots[slot] is not _unbound:
+                return True
+        elif self.extra is not None and key in self.extra:
+            return True
+        if self.imports and imported(self.imports, key, _unbound) is not _unbound:
+            return True
+        return key in self.parent
+
+    def attach(self, module):
+        for key, slot in self.scope.index.items():
+            if module.own(key, _unbound) is not _unbound:
+                self.slots[slot] = _unbound
+        if self.extra is not None:
+            for key in [k for k in self.extra if module.own(k, _unbound) is not _unbound]:
+                del self.extra[key]
+        self.imports = (module,) + tuple(m for m in self.imports if m is not module)
+
+
+class LexicalFunction(UserLispFunction):
+    """a user function which runs in a Frame whose parent is the context it was defined in, rather
+    than the one it is called from."""
+    def __init__(self, function, scope, definition_context, compiler):
+        super(LexicalFunction, self).__init__(NIL(), function.functionbody, function.env,
+            args_as_list=function.args_as_list)
+        self.argbindings = function.argbindings
+        self.maxc = function.maxc
+        self.scope = scope
+        self.definition_context = definition_context
+        self.compiler = compiler
+
+    def new_context(self, outer_context, ap, reuse=False):
+        frame = Frame(self.scope, self.definition_context)
+
+        if self.args_as_list:
+            frame.slots[0] = sexpr_from_iterator(ap)
+        else:
+            # the arguments have the first slots, in order.
+            frame.slots[:len(ap)] = ap
+
+        return frame
+
+    def run_body(self, context):
+        """only used when called from peval: the compiled engine runs the body itself."""
+        compiler = self.compiler
+        for line in self.functionbody[:-1]:
+            compiler.trampoline(compiler.ceval(context, line))
+
+        return TailCall(context, self.functionbody[-1])
+
+
+class LexicalCompiler(Compiler):
+    def __init__(self):
+        super(LexicalCompiler, self).__init__()
+        # the scope of the code being compiled.
+        self.scope = None
+        # the Scope of each function body, bounded as the compiled code is.
+        self.scopes = CodeCache()
+
+    def ceval(self, context, o):
+        scope = context.scope if isinstance(context, Frame) else None
+        if not isinstance(o, Pair):
+            return self.compile_in(scope, o)(context)
+
+        # as Compiler.ceval, but the same code compiles differently in different scopes.
+        key = (id(scope), id(o.left), id(o.right), o.quoted)
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = (scope, o.left, o.right, self.compile_in(scope, o))
+            self.cache.put(key, entry)
+        return entry[3](context)
+
+    def compile_in(self, scope, o):
+        outer, self.scope = self.scope, scope
+        try:
+            return self.compile(o)
+        finally:
+            self.scope = outer
+
+    def compile(self, o):
+        if not isinstance(o, Symbol) or o.quoted or self.scope is None:
+            return super(LexicalCompiler, self).compile(o)
+
+        address = self.scope.resolve(o)
+        if address is None:
+            # not a local of any enclosing function: a global, or bound some other way.
+            return lambda frame: frame[o]
+
+        depth, slot = address
+
+        def local(frame):
+            for i in xrange(depth):
+                frame = frame.parent
+            value = frame.slots[slot]
+            if value is _unbound:
+                # not bound yet: look for it in a module the frame has imported, or further out.
+                return frame[o]
+            return value
+        return local
+
+    def handler_for(self, function, arguments):
+        if function is _with:
+            return self.with_handler(function.execute)
+        return super(LexicalCompiler, self).handler_for(function, arguments)
+
+    def with_handler(self, execute):
+        def with_(context, args, tail):
+            # let WITH itself check its arguments and build the function.
+            function = execute(context, *args)
+            if not isinstance(function, UserLispFunction):
+                return function
+
+            context.captured = True
+            parent = context.scope if isinstance(context, Frame) else None
+            return LexicalFunction(function, self.scope_for(parent, function), context, self)
+        return with_
+
+    def scope_for(self, parent, function):
+        # WITH's arguments are usually quoted literals, which are unquoted into new Pairs each time
+        # it is called, so we recognise the same function body by what the Pairs contain. The
+        # parameters are a new list each time too, but of interned Symbols.
+        if function.args_as_list:
+            parameters = [function.argbindings]
+        else:
+            parameters = function.argbindings
+        parts = list(function.functionbody)
+        key = (id(parent), tuple(parameters)) + tuple(
+            (id(p.left), id(p.right)) if isinstance(p, Pair) else id(p) for p in parts)
+
+        entry = self.scopes.get(key)
+        if entry is None:
+            entry = (parts, Scope(parameters, function.functionbody, parent))
+            self.scopes.put(key, entry)
+        return entry[1]
+
+
+def run(program, program_environment, with_math=False):
+    """equivalent to vm.run, with lexically scoped functions."""
+    context = Context(parent=vm.program_context(program_environment, with_math))
+    compiler = LexicalCompiler()
+    for line in program:
+        compiler.compile_value(line)(context)
@@ -0,0 +1,380 @@
+"""Caches the values of pure subexpressions, for populations of GP programs which share many
+identical subtrees.
+
+    memo = Memo()
+    for program in population:
+        for line in program:
+            memo.evaluate(context, line)
+    print(memo.hits, memo.misses)
+
+A subexpression is pure if every function it calls is one of the PURE builtins (or IF, with quoted
+branches which are themselves pure,) so that its value depends only on its structure and the values
+of the symbols it reads. Its value is cached under a number identifying its structure (equal trees
+get the same number, wherever they come from) and the values of those symbols, in a bounded,
+approximately least recently used, cache.
+Anything else (BIND, PUTS, GETS, RAND, IMPORT, user functions...) is evaluated as peval would, with
+its arguments still looked up in the cache.
+
+The functions a subexpression calls are checked by identity each time it is looked up, so that
+rebinding + makes (+ x 1) impure rather than giving a stale value. Nor is a call to which a
+Vector is passed, by itself or in a list, cached, since VSET can change it. Pure builtins which build a
+new list, such as CONS, give the same list each time their result is found in the cache, which
+only == can tell apart."""
+
+from __future__ import print_function, division
+
+from values import NIL, Symbol, Value, Vector, Pair, unquote
+
+import vm
+import maths
+from vm import LispRuntimeError, UnboundSymbolError, TailCall, check_count, truthy, _if
+from budget import BudgetExceeded
+
+
+# builtins whose result depends only on their arguments, and which change nothing.
+PURE = set([
+    vm.plus, vm.minus, vm.multiply, vm.divide, vm.idivide, vm.modulo, vm._round,
+    vm.concatinate, vm.split, vm.cons, vm.car, vm.cdr, vm.equal, vm.greater_than, vm.less_than
+]) | set(maths.maths_functions.values())
+
+# the key for a symbol which is unbound (in the branch of an IF which is not taken, say,) and
+# the value of a key which is not in the cache.
+_unbound = object()
+
+
+class Raised(object):
+    """in the cache in place of the value of a subexpression which raised an error."""
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def number_key(v):
+    """a dict key for the python value of a Value: floats by hex, so that 0.0 and -0.0, which are
+    equal but give different results (e.g. from ATAN2), are kept apart, and nan is equal to itself."""
+    return (type(v), v.hex() if type(v) is float else v)
+
+
+def value_key(v):
+    """a dict key for the value of a symbol: numbers and strings by value (see number_key), and
+    anything else (interned symbols, NIL, lists and functions) by identity."""
+    if isinstance(v, Value):
+        return number_key(v.v)
+    return id(v), v
+
+
+def holds_vector(o):
+    """whether o is a Vector, or a list with one anywhere in it, without recursing."""
+    to_visit = [o]
+    while to_visit:
+        node = to_visit.pop()
+        if isinstance(node, Vector):
+            return True
+        if isinstance(node, Pair):
+            to_visit.append(node.right)
+            to_visit.append(node.left)
+    return False
+
+
+class Analysis(object):
+    """what the memo knows about one node: whether it is pure, the number identifying its
+    structure, its size, the symbols whose values it reads, and the (symbol, function) pairs which
+    must be bound for it to be pure."""
+    __slots__ = ('node', 'pure', 'structure', 'size', 'free', 'expected', 'function', 'arguments',
+        'parts')
+
+    def __init__(self, node, pure):
+        self.node = node
+        self.pure = pure
+        self.structure = None
+        self.size = 1
+        self.free = ()
+        self.expected = ()
+        self.function = None
+        self.arguments = None
+        # the Analyses of a pure call's arguments (IF's test and branches.)
+        self.parts = None
+
+
+class Memo(object):
+    """maxsize is the most values kept, and min_size the fewest nodes a subexpression must
+    have for its value to be worth caching. max_nodes bounds the analyses kept: when it is
+    reached, everything is forgotten."""
+    def __init__(self, maxsize=100000, min_size=4, max_nodes=1000000, pure=PURE):
+        self.maxsize = maxsize
+        self.min_size = min_size
+        self.max_nodes = max_nodes
+        self.pure = pure
+
+        self.recent, self.older = {}, {}
+        self.analyses = {}
+        self.structures = {}
+        self.hits = 0
+        self.misses = 0
+        # set while computing a value which depends on something other than its free symbols.
+        self.tainted = False
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.recent) + len(self.older)}
+
+    def clear(self):
+        self.recent, self.older = {}, {}
+        self.analyses.clear()
+        self.structures.clear()
+
+    def remember(self, key, value):
+        # an approximate LRU, which costs no more than a dict: values are kept in recent, and when
+        # it is half full it becomes older, and what was older is forgotten. Values found in older
+        # are moved back to recent.
+        self.recent[key] = value
+        if len(self.recent) >= self.maxsize // 2:
+            self.recent, self.older = {}, self.recent
+
+    def structure_of(self, description):
+        """the number for a node described by a tuple of its kind and its parts' numbers."""
+        number = self.structures.get(description)
+        if number is None:
+            number = self.structures[description] = len(self.structures)
+        return number
+
+    def data_structure(self, o):
+        """the number for o as data (the contents of a quote,) without recursing."""
+        numbers = {}
+        to_visit = [o]
+        while to_visit:
+            node = to_visit[-1]
+            if not isinstance(node, Pair):
+                to_visit.pop()
+                numbers[id(node)] = self.leaf_structure(node)
+            elif id(node.left) in numbers and id(node.right) in numbers:
+                to_visit.pop()
+                numbers[id(node)] = self.structure_of(('pair', node.quoted,
+                    numbers[id(node.left)], numbers[id(node.right)]))
+            else:
+                to_visit.extend([node.right, node.left])
+        return numbers[id(o)]
+
+    def leaf_structure(self, o):
+        if isinstance(o, Symbol):
+            return self.structure_of(('symbol', o.s, o.quoted))
+        if isinstance(o, Value):
+            return self.structure_of(('value',) + number_key(o.v))
+        if o is NIL.instance:
+            return self.structure_of(('nil',))
+        # a function someone has put in the tree.
+        return self.structure_of(('object', id(o), o))
+
+    def analyse(self, context, o):
+        """the Analysis of o, which is cached until a function something calls is rebound."""
+        cached = self.analyses.get(id(o))
+        if cached is not None and cached.node is o:
+            return cached
+
+        if len(self.analyses) >= self.max_nodes:
+            self.clear()
+
+        analysis = self.analyse_node(context, o)
+        self.analyses[id(o)] = analysis
+        return analysis
+
+    def analyse_node(self, context, o):
+        if isinstance(o, Symbol) and not o.quoted:
+            analysis = Analysis(o, True)
+            analysis.structure = self.leaf_structure(o)
+            analysis.free = (o,)
+            return analysis
+
+        if not isinstance(o, Pair):
+            # Values and NIL evaluate to themselves, and quoted symbols to the unquoted symbol.
+            analysis = Analysis(o, not hasattr(o, '__call__'))
+            analysis.structure = self.leaf_structure(o)
+            return analysis
+
+        if o.quoted:
+            analysis = Analysis(o, True)
+            analysis.structure = self.data_structure(o)
+            return analysis
+
+        analysis = Analysis(o, False)
+        head, arguments = o.left, []
+        rest = o.right
+        while isinstance(rest, Pair):
+            arguments.append(rest.left)
+            rest = rest.right
+        if not isinstance(head, Symbol) or head.quoted or rest is not NIL.instance:
+            return analysis
+
+        try:
+            function = context[head]
+        except UnboundSymbolError:
+            return analysis
+        analysis.function = function
+        analysis.arguments = arguments
+
+        if function is _if:
+            return self.analyse_if(context, analysis, head, arguments)
+        if function not in self.pure:
+            return analysis
+
+        parts = [self.analyse(context, a) for a in arguments]
+        return self.combine(analysis, head, function, parts)
+
+    def analyse_if(self, context, analysis, head, arguments):
+        """IF is pure if its test is, and its branches are quoted pure code or values."""
+        if not 2 <= len(arguments) <= 3:
+            return analysis
+
+        branches = []
+        for branch in arguments[1:]:
+            if isinstance(branch, Symbol) and branch.quoted:
+                branches.append(branch.unquoted)
+            elif isinstance(branch, Pair) and branch.quoted:
+                branches.append(Pair(branch.left, branch.right))
+            elif isinstance(branch, Value):
+                branches.append(branch)
+            else:
+                # evaluated twice, once as an argument and again as the result.
+                return analysis
+
+        parts = [self.analyse(context, arguments[0])] + [self.analyse(context, b) for b in branches]
+        return self.combine(analysis, head, _if, parts)
+
+    def combine(self, analysis, head, function, parts):
+        if not all(p.pure for p in parts):
+            return analysis
+
+        free = set()
+        expected = set([(head, function)])
+        for p in parts:
+            free.update(p.free)
+            expected.update(p.expected)
+
+        analysis.pure = True
+        analysis.parts = parts
+        # the function, rather than the symbol it is bound to, so that equal structures call the
+        # same functions.
+        analysis.structure = self.structure_of(('call', function) +
+            tuple(p.structure for p in parts))
+        analysis.size = 1 + sum(p.size for p in parts)
+        analysis.free = tuple(sorted(free, key=lambda s: s.s))
+        analysis.expected = tuple(expected)
+        return analysis
+
+    def lookup(self, context, symbol):
+        try:
+            return context[symbol]
+        except UnboundSymbolError:
+            return _unbound
+
+    def evaluate(self, context, o):
+        """equivalent to vm.peval(context, o)."""
+        analysis = self.analyse(context, o)
+
+        if analysis.pure:
+            for symbol, function in analysis.expected:
+                if self.lookup(context, symbol) is not function:
+                    # something it calls has been rebound since it was analysed.
+                    self.analyses.clear()
+                    return self.evaluate(context, o)
+            return self.value(context, analysis)
+
+        function = analysis.function
+        if function is not None and self.lookup(context, o.left) is not function:
+            self.analyses.clear()
+            return self.evaluate(context, o)
+        if function is None or isinstance(function, vm.UserLispFunction) or \
+                not hasattr(function, 'execute'):
+            return vm.peval(context, o)
+
+        # an impure builtin: its arguments may still be pure.
+        args = [self.evaluate(context, a) for a in analysis.arguments]
+        check_count(function.method, function.minc, function.maxc, len(args))
+        result = function.execute(context, *args)
+        if isinstance(result, TailCall):
+            return self.evaluate(result.context, result.expression)
+        return result
+
+    def value(self, context, analysis):
+        """the value of a pure node, whose functions are known to be the ones it was analysed
+        with, from the cache if it is there."""
+        if analysis.size < self.min_size:
+            return self.compute(context, analysis)
+
+        key = [analysis.structure]
+        for symbol in analysis.free:
+            try:
+                key.append(value_key(context[symbol]))
+            except UnboundSymbolError:
+                key.append(_unbound)
+        key = tuple(key)
+
+        value = self.recent.get(key, _unbound)
+        if value is _unbound:
+            value = self.older.get(key, _unbound)
+            if value is not _unbound:
+                self.remember(key, value)
+        if value is not _unbound:
+            self.hits += 1
+            if isinstance(value, Raised):
+                raise value.error
+            return value
+
+        self.misses += 1
+        tainted, self.tainted = self.tainted, False
+        try:
+            value = self.compute(context, analysis)
+        except (LispRuntimeError, ArithmeticError, ValueError) as e:
+            # the same arguments will raise the same error, unless it was running out of time.
+            if isinstance(e, BudgetExceeded):
+                self.tainted = True
+            value = Raised(e)
+
+        if not self.tainted:
+            self.remember(key, value)
+        self.tainted = self.tainted or tainted
+
+        if isinstance(value, Raised):
+            raise value.error
+        return value
+
+    def compute(self, context, analysis):
+        o = analysis.node
+        if isinstance(o, Symbol):
+            if o.quoted:
+                return o.unquoted
+            return context[o]
+        if not isinstance(o, Pair):
+            return o
+        if o.quoted:
+            return unquote(o)
+
+        parts = analysis.parts
+        function = analysis.function
+        if function is _if:
+            test = self.value(context, parts[0])
+            if isinstance(test, Symbol):
+                # whether it is true depends on whether it is bound.
+                self.tainted = True
+            if truthy(context, test):
+                return self.value(context, parts[1])
+            if len(parts) == 3:
+                return self.value(context, parts[2])
+            return NIL()
+
+        args = [self.value(context, p) for p in parts]
+        if not self.tainted and any([holds_vector(a) for a in args]):
+            # what a vector holds can change under the same identity, e.g. (= v w) after a VSET,
+            # or (= l m) where l is a list with v in it.
+            self.tainted = True
+        check_count(function.method, function.minc, function.maxc, len(args))
+        return function.execute(context, *args)
+
+
+def run(program, program_environment, with_math=False, memo=None):
+    """equivalent to vm.run, looking up pure subexpressions in memo (a new Memo by default.)"""
+    if memo is None:
+        memo = Memo()
+    context = vm.Context(parent=vm.program_context(program_environment, with_math))
+    for line in program:
+        memo.evaluate(context, line)
@@ -1,103 +1,6 @@
+import gc
 import re
-
-class sexpr(list):
-    def __init__(self, *args, **kwargs):
-        self.quoted = False
-        super(sexpr, self).__init__(*args, **kwargs)
-
-    def __repr__(self):
-        outer = super(sexpr, self).__repr__()
-        if self.quoted:
-            return "'" + outer
-        return outer
-
-def remove_comments(inp):
-    commentless_lines = []
-
-    # kill comment characters ; onwards, when not inside a string.
-    for l in inp.split("\n"):
-        splits = l.split(';')
-        if len(splits) == 1:
-            commentless_lines.append(l)
-            continue
-
-        previous_string = splits.pop(0)
-
-        while len(re.findall(r'(?<!\\)"', previous_string)) % 2 != 0:
-            previous_string += ';' + splits.pop()
-
-        commentless_lines.append(previous_string)
-    return "\n".join(commentless_lines)
-
-
-def clever_split(inp):
-    commentless_inp = remove_comments(inp)
-
-    # rather than splitting on all whitespace, we want to split only on
-    # whitespace not inside a string.
-    # strings cannot contain newlines, so start by splitting on those:
-    lines = commentless_inp.split("\n")
-    tokens = []
-    for i, l in enumerate(lines):
-        splits = [s for s in l.split('"')]
-
-        # if there were no "s in this line, split the whole thing by whitespace:
-        if len(splits) == 1:
-            tokens.extend(l.split())
-            continue
-
-        # first " can't be escaped.
-        tokens.extend(splits.pop(0).split())
-
-        while splits:
-            this_string = splits.pop(0)
-            # while the quotes are escaped:
-            while this_string[-1] == "\\":
-                assert len(splits) > 0, "string on line %d is not terminated correctly." % i
-                this_string = this_string[:-1] + '\\"' + splits.pop(0)
-            # we've got to the end of this string, add it as its own token:
-            tokens.append('"' + this_string + '"')
-
-            # the next tokens are not strings, so just extend them (if any):
-            if splits:
-                tokens.extend(splits.pop(0).split())
-
-    return tokens
-
-
-
-def parse(inp):
-    toks = clever_split(inp)
-    parents = {}
-    output_list = sexpr()
-    current_list = output_list
-    while True:
-        try:
-            tok = toks.pop(0)
-        except IndexError:
-            break
-        while tok and tok[0] in "'(" and (tok[0] == '(' or tok[:2] == "'("):
-            current_list.append(sexpr())
-            parents[id(current_list[-1])] = current_list
-            current_list = current_list[-1]
-            if tok[0] == '(':
-                tok = tok[1:]
-            else:
-                tok = tok[2:]
-                current_list.quoted = True
-
-        end_here = 0
-        while tok and tok[-1] == ')':
-            end_here += 1
-            tok = tok[:-1]
-        if tok:
-            current_list.append(tok)
-        while end_here:
-            end_here -= 1
-            current_list = parents[id(current_list)]
-    assert id(current_list) == id(output_list), "s expressions not closed"
-    return output_list
-
+import threading
 
 PAIR_SEPARATOR = '.'
 
@@ -116,7 +19,7 @@ STRINGY = '"'
 DUBIOUS = "+-"
 ALLOWED_IN_NUMERIC = NUMERIC + DUBIOUS + "eE."
 
-from values import Value, Symbol, NIL, Pair, LispType
+from values import Value, Symbol, NIL, Pair, crepr, shared_pair
 
 def parse_token(t):
     char1 = t[0]
@@ -132,9 +35,9 @@ def parse_token(t):
 
     if char1 in NUMERIC:
         assert all([c in ALLOWED_IN_NUMERIC for c in t]), "token %s contains invalid characters to be a numeric literal." % t
-        v = Value(t)
+        v = numeric_value(t)
     elif char1 in STRINGY:
-        v = Value(t)
+        v = Value(t[1:-1].decode('string_escape'), actual=True)
     elif char1 in BEGIN_HEXANUMERIC:
         assert all([c in HEXANUMERIC for c in t[1:]]), "token %s contains invalid characters for a hexadecimal literal." % t
         t = t.replace('#', '0x').upper()
@@ -150,6 +53,20 @@ def parse_token(t):
             v = Symbol(t)
     return v
 
+def numeric_value(t):
+    """Value(t), without the cost of eval for the common cases."""
+    digits = t.lstrip(DUBIOUS)
+    try:
+        if digits.isdigit():
+            # leading zeros mean octal to eval.
+            if digits[0] != '0' or len(digits) == 1:
+                return Value(int(t), actual=True)
+        else:
+            return Value(float(t), actual=True)
+    except ValueError:
+        pass
+    return Value(t)
+
 def parse_token_prompt(t):
     v = parse_token(t)
     if v == PAIR_LITERAL:
@@ -159,52 +76,188 @@ def parse_token_prompt(t):
     return v
 
 
-def parse_tokens(s):
-    for i, t in enumerate(s):
-        if type(t) == sexpr:
-            parse_tokens(t)
-            continue
-        s[i] = parse_token(t)
-        if s[i] == PAIR_LITERAL:
-            assert i == 1 and len(s) == 3, "incorrect context for a pair literal, %s." % repr(s)
-
-
-def do_pair_literals(s):
-    for i, t in enumerate(s):
-        if type(t) == sexpr:
-            do_pair_literals(t)
-
-            if len(t) == 3 and t[1] == PAIR_LITERAL:
-                s[i] = Pair(t[0], t[2], t.quoted)
-
-
-def sexprs_to_pairs(s):
-    if isinstance(s, LispType):
-        # value literal or pair literal at top level in source, not a problem.
-        return s
-    for i, t in enumerate(s):
-        if type(t) == sexpr:
-            s[i] = sexprs_to_pairs(t)
-        elif type(t) == Pair:
-            # was specified as a pair literal in the source, may contain s-expressions inside.
-            if type(t.left) == sexpr:
-                t.left = sexprs_to_pairs(t.left)
-            if type(t.right) == sexpr:
-                t.right = sexprs_to_pairs(t.right)
-    assert all([type(t) is not sexpr for t in s]), "programming error in parser."
-    return Pair.pair_list_from_sexpr(s, s.quoted)
-
-
-def parse_program(inp):
-    prog = parse(inp)
-
-    # now recursively walk over all s-expressions, building tokens into Values, Symbols, and Pair Separator placeholders.
-    parse_tokens(prog)
+# each token is one of these, matched one line at a time (strings cannot contain newlines.)
+TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>;.*)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<unterminated>")
+  | (?P<open_quoted>'\()
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<atom>[^\s()";]+)
+""", re.VERBOSE)
+
+
+class ParseError(AssertionError):
+    """raised for malformed source. (Subclasses AssertionError, which the parser used to raise.)"""
+    def __init__(self, message, line, column):
+        super(ParseError, self).__init__("line %d, column %d: %s" % (line, column, message))
+        self.line = line
+        self.column = column
+
+
+class Reader(object):
+    """builds Pairs, Values and Symbols directly from source, one line at a time, handing back each
+    top level form as soon as it is complete. If shared, the Pairs are hash-consed (see
+    values.SharedPair.)"""
+    def __init__(self, shared=False):
+        # the S-expressions we are part way through: (items so far, quoted, line, column).
+        self.open_lists = []
+        self.line = 0
+        self.shared = shared
+
+    def feed(self, line):
+        """reads one line of source, returning a list of the top level forms it completed."""
+        self.line += 1
+        forms = []
+        open_lists = self.open_lists
+
+        for m in TOKEN.finditer(line):
+            kind = m.lastgroup
+            if kind == 'space' or kind == 'comment':
+                continue
+
+            if kind == 'open' or kind == 'open_quoted':
+                open_lists.append(([], kind == 'open_quoted', self.line, m.start() + 1))
+                continue
+
+            if kind == 'close':
+                if not open_lists:
+                    raise ParseError("unexpected ')'.", self.line, m.start() + 1)
+                o = self.build(*open_lists.pop())
+            elif kind == 'unterminated':
+                raise ParseError("string is not terminated correctly.", self.line, m.start() + 1)
+            else:
+                try:
+                    o = parse_token(m.group())
+                except AssertionError as e:
+                    raise ParseError(str(e), self.line, m.start() + 1)
 
-    # identify any pair literals and instantiate those first:
-    do_pair_literals(prog)
+            if o is PAIR_LITERAL and not (open_lists and len(open_lists[-1][0]) == 1):
+                raise ParseError("incorrect context for a pair literal.", self.line, m.start() + 1)
 
-    # finally, build actual Pairs for all the proper S-expressions:
-    prog = [sexprs_to_pairs(s) for s in prog]
+            if open_lists:
+                open_lists[-1][0].append(o)
+            else:
+                forms.append(o)
+
+        return forms
+
+    def build(self, items, quoted, line, column):
+        # feed has already checked that a pair literal can only be the second item.
+        if len(items) > 1 and items[1] is PAIR_LITERAL:
+            if len(items) != 3:
+                raise ParseError("incorrect context for a pair literal, %r." % items, line, column)
+            if self.shared:
+                return shared_pair(items[0], items[2], quoted)
+            return Pair(items[0], items[2], quoted)
+
+        return Pair.pair_list_from_sexpr(items, quoted, self.shared)
+
+    def close(self):
+        """checks that the source did not end part way through an S-expression."""
+        if self.open_lists:
+            items, quoted, line, column = self.open_lists[-1]
+            raise ParseError("s expressions not closed", line, column)
+
+
+def read_lines(lines, shared=False):
+    """generates the top level forms of a program from an iterable of its lines."""
+    reader = Reader(shared)
+    for line in lines:
+        for form in reader.feed(line):
+            yield form
+    reader.close()
+
+
+def read_forms(source_file, shared=False):
+    """generates the top level forms of a program as they are read from a file object, so that it
+    can be run before the rest of it has been read, in memory bounded by the largest single form."""
+    # readline, rather than iterating over the file, which reads ahead (and so would block waiting
+    # for more of a pipe than the form we need.)
+    return read_lines(iter(source_file.readline, ''), shared)
+
+
+# parsing allocates a great many objects but creates no reference cycles, so the garbage
+# collector's repeated scans of them are wasted (and make parsing large programs superlinear.) It is
+# paused while a program of at least LARGE characters is parsed: only then, since this pauses it for
+# every thread in the process. _pauses counts the parses which have paused it, so that when several
+# threads parse at once, the last to finish puts it back as it was before the first began.
+LARGE = 100000
+_pause_lock = threading.Lock()
+_pauses = 0
+_gc_was_enabled = False
+
+
+def pause_collection():
+    global _pauses, _gc_was_enabled
+    with _pause_lock:
+        if _pauses == 0:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _pauses += 1
+
+
+def resume_collection():
+    global _pauses
+    with _pause_lock:
+        _pauses -= 1
+        if _pauses == 0 and _gc_was_enabled:
+            gc.enable()
+
+
+def parse_program(inp, shared=False):
+    if len(inp) < LARGE:
+        return list(read_lines(inp.split("\n"), shared))
+
+    pause_collection()
+    try:
+        return list(read_lines(inp.split("\n"), shared))
+    finally:
+        resume_collection()
+
+
+def unparse(o):
+    """returns source which reads back as an object equal to o, as compactly as we can: proper
+    lists are written (a b c) rather than in dotted pairs. Raises ValueError for anything with no
+    source form, such as a function."""
+    parts = []
+    to_write = [o]
+
+    while to_write:
+        o = to_write.pop()
+        if type(o) is str:
+            # punctuation we pushed ourselves.
+            parts.append(o)
+        elif isinstance(o, Pair):
+            items = [o.left]
+            rest = o.right
+            while isinstance(rest, Pair) and not rest.quoted:
+                items.append(rest.left)
+                rest = rest.right
+
+            if isinstance(rest, NIL):
+                tokens = ["'(" if o.quoted else "("]
+                for i in items:
+                    tokens.extend([i, " "])
+                tokens[-1] = ")"
+            else:
+                # an improper list can only be written as nested pair literals.
+                tokens = ["'(" if o.quoted else "("]
+                for i in items[:-1]:
+                    tokens.extend([i, " . ("])
+                tokens.extend([items[-1], " . ", rest, ")" * len(items)])
+            to_write.extend(reversed(tokens))
+        elif isinstance(o, (Symbol, NIL)):
+            parts.append(repr(o))
+        elif isinstance(o, Value) and isinstance(o.v, (int, long)) and not isinstance(o.v, bool):
+            parts.append(str(o.v))
+        elif isinstance(o, Value) and isinstance(o.v, float) and o.v - o.v == 0:
+            parts.append(repr(o.v))
+        elif isinstance(o, Value) and isinstance(o.v, str):
+            parts.append(crepr(o.v))
+        else:
+            raise ValueError("%r has no source form." % (o,))
 
-    return prog
+    return "".join(parts)
@@ -0,0 +1,192 @@
+"""Evaluates a population of programs against a set of fitness cases, for genetic programming.
+
+    results = evaluate_population(["(+ x (* y y))", "(- x y)"], [{'x': 1, 'y': 2}, {'x': 3, 'y': 4}])
+
+returns one row per program and one column per case: the value of the program's last top level
+form, run with the case's bindings. A program which fails gives the error it raised (a
+LispRuntimeError, or e.g. ZeroDivisionError) so that the fitness function can penalise it.
+
+The work is spread over a multiprocessing pool. Each worker builds the interpreter (an
+interpreter.Interpreter with the builtins, maths library if asked for, and the cases) once, when it
+starts, and is then sent only the source of each program, as written by parse.unparse, which is
+several times smaller than pickled Pairs.
+
+A program which is a single arithmetic expression is evaluated over all the cases at once, if numpy
+is installed (see vectorized.py.)
+
+Given a budget, such as {'steps': 10000, 'seconds': 0.1}, each program is stopped when it passes
+any of the limits on any case, and gives a budget.BudgetExceeded for that case. A single expression
+cannot loop, so is not limited when it is vectorized.
+
+Given memo, the number of values to cache, each worker keeps a memo.Memo of the values of the pure
+subexpressions it has evaluated, and looks them up when they appear again, in other programs.
+
+Given fold, each program is simplified by fold.fold_program before it is evaluated."""
+
+from __future__ import print_function, division
+
+import multiprocessing
+
+from values import NIL, LispType, Symbol, Value
+from parse import parse_program, unparse
+
+import vm
+from vm import Context, LispRuntimeError, sexpr_from_iterator
+from compiled import Compiler
+from budget import Budget
+from memo import Memo
+from interpreter import Interpreter
+from fold import fold_program
+from vectorized import evaluate_vector, lisp_values, Unvectorizable
+
+
+ENVIRONMENT = "(population)"
+
+
+def lisp_value(v):
+    """converts python ints, floats, strings, None and lists to the lisp equivalents."""
+    if isinstance(v, LispType):
+        return v
+    if v is None:
+        return NIL()
+    if isinstance(v, (list, tuple)):
+        return sexpr_from_iterator([lisp_value(i) for i in v])
+    if isinstance(v, (int, long, float, str)):
+        return Value(v, actual=True)
+    raise ValueError("%r has no lisp equivalent." % (v,))
+
+
+def case_bindings(case):
+    return dict((Symbol(name) if isinstance(name, str) else name, lisp_value(v))
+        for name, v in case.items())
+
+
+class Evaluator(object):
+    """the interpreter each worker keeps between programs."""
+    def __init__(self, cases, with_math=False, budget=None, memo=None, fold=False,
+            permissive=False):
+        self.interpreter = Interpreter(with_math, permissive)
+        with self.interpreter:
+            self.context = vm.program_context(ENVIRONMENT)
+        self.cases = [case_bindings(c) for c in cases]
+        self.with_math = with_math
+        self.budget = budget
+        self.memo = Memo(memo) if memo is not None else None
+        self.fold = fold
+
+        # for evaluating a single expression over every case at once, if the cases all bind the
+        # same names.
+        self.columns = None
+        if self.cases and all(set(c) == set(self.cases[0]) for c in self.cases):
+            self.columns = dict((name, [c[name] for c in self.cases]) for name in self.cases[0])
+
+    def evaluate(self, source):
+        """returns the row of results for one program."""
+        with self.interpreter:
+            return self.evaluate_program(source)
+
+    def evaluate_program(self, source):
+        try:
+            program = parse_program(source)
+        except AssertionError as e:
+            return [LispRuntimeError("program could not be parsed: %s" % e)] * len(self.cases)
+
+        if self.fold:
+            # the cases may bind any name.
+            bound = set(name for bindings in self.cases for name in bindings)
+            program = fold_program(program, self.with_math, bound)[0]
+
+        if len(program) == 1 and self.columns is not None:
+            try:
+                return lisp_values(evaluate_vector(program[0], self.columns, self.context))
+            except Unvectorizable:
+                pass
+
+        if self.memo is not None:
+            codes = [self.memoized(line) for line in program]
+        else:
+            # the compiled code is only useful for this program, so isn't kept for the next.
+            compiler = Compiler()
+            codes = [compiler.compile_value(line) for line in program]
+
+        row = []
+        for bindings in self.cases:
+            context = Context(bindings, parent=self.context)
+            try:
+                result = self.run(codes, context)
+                if hasattr(result, '__call__'):
+                    raise LispRuntimeError("program returned a function, %r." % result)
+            except (LispRuntimeError, ArithmeticError, ValueError) as e:
+                # the builtins raise python's errors for bad arithmetic, such as dividing by zero.
+                result = e
+            except RuntimeError as e:
+                # python's recursion limit: no worse than any other broken program.
+                result = LispRuntimeError(str(e))
+            row.append(result)
+        return row
+
+    def memoized(self, line):
+        return lambda context: self.memo.evaluate(context, line)
+
+    def run(self, codes, context):
+        if self.budget is not None:
+            with Budget(**self.budget):
+                return self.run_unlimited(codes, context)
+        return self.run_unlimited(codes, context)
+
+    def run_unlimited(self, codes, context):
+        result = NIL()
+        for code in codes:
+            result = code(context)
+        return result
+
+
+# each worker process's Evaluator.
+_evaluator = None
+
+
+def _start_worker(cases, with_math, permissive, budget, memo, fold):
+    global _evaluator
+    _evaluator = Evaluator(cases, with_math, budget, memo, fold, permissive)
+
+
+def _evaluate(source):
+    return _evaluator.evaluate(source)
+
+
+def encode(program):
+    """the source of a program given as source, a parsed Pair tree, or a list of top level forms."""
+    if isinstance(program, str):
+        return program
+    if isinstance(program, LispType):
+        program = [program]
+    return "\n".join(unparse(line) for line in program)
+
+
+def evaluate_population(programs, cases, processes=None, with_math=False, permissive=False,
+        chunksize=None, budget=None, memo=None, fold=False):
+    """returns a list, for each program, of its result for each case.
+
+    programs may be source strings, parsed trees, or lists of parsed top level forms. Each case
+    is a dict of the names to bind (as strings or Symbols) to values (lisp, or python values which
+    lisp_value can convert.) processes is the size of the pool: None for one per CPU, or 1 to
+    evaluate in this process. budget is a dict of the keyword arguments of budget.Budget, which
+    limits each program's evaluation of each case. memo is the number of subexpression values
+    each worker caches, or None to cache none. fold simplifies each program before evaluating it."""
+    sources = [encode(p) for p in programs]
+
+    if processes == 1:
+        evaluator = Evaluator(cases, with_math, budget, memo, fold, permissive)
+        return [evaluator.evaluate(s) for s in sources]
+
+    pool = multiprocessing.Pool(processes, _start_worker, (cases, with_math, permissive, budget, memo,
+        fold))
+    try:
+        if chunksize is None:
+            # a few chunks per worker, so that a slow chunk does not leave the others idle.
+            workers = processes or multiprocessing.cpu_count()
+            chunksize = max(1, len(sources) // (workers * 4))
+        return pool.map(_evaluate, sources, chunksize)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,95 @@
+"""Counts and times calls to each function, as they pass through pre_execute.
+
+    with Profiler() as profiler:
+        run(program, env)
+    print(profiler.report())
+
+For each function name (a builtin's, such as BIND, or the symbol a user function was first bound
+to,) records the number of calls, cumulative time (from the call until it returns, counted once
+for recursive calls,) self time (less the time spent in the functions it called,) and the part of
+its cumulative time spent evaluating its arguments.
+
+The last expression of a user function, and the branch IF chooses, are returned to peval as tail
+calls and evaluated after the function has returned, so their time is counted in the caller's.
+
+Only the peval engine calls functions through pre_execute: the other engines call builtins'
+implementations directly."""
+
+from __future__ import print_function, division
+
+from timeit import default_timer
+
+import vm
+
+
+class FunctionStats(object):
+    __slots__ = ('calls', 'cumulative', 'own', 'arguments')
+
+    def __init__(self):
+        self.calls = 0
+        self.cumulative = 0.0
+        self.own = 0.0
+        self.arguments = 0.0
+
+
+class Profiler(object):
+    def __init__(self, clock=default_timer):
+        self.clock = clock
+        self.stats = {}
+        # for each call in progress, the time spent in the calls it has made.
+        self.nested = []
+        # the number of calls in progress of each function, so that recursion is only counted once
+        # in cumulative time.
+        self.active = {}
+
+    def __enter__(self):
+        self.previous, vm.PROFILER = vm.PROFILER, self
+        return self
+
+    def __exit__(self, *exc_info):
+        vm.PROFILER = self.previous
+
+    def call(self, name, evaluate, execute, context, arguments):
+        """called by pre_execute in place of the function: evaluate evaluates the arguments, and
+        execute runs the function on the evaluated arguments."""
+        clock = self.clock
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = FunctionStats()
+        self.active[name] = self.active.get(name, 0) + 1
+        self.nested.append(0.0)
+
+        start = clock()
+        evaluated = None
+        try:
+            evaluated = evaluate(context, arguments)
+            arguments_time = clock() - start
+            return execute(context, evaluated)
+        finally:
+            elapsed = clock() - start
+            if evaluated is None:
+                arguments_time = elapsed
+
+            nested = self.nested.pop()
+            if self.nested:
+                self.nested[-1] += elapsed
+            self.active[name] -= 1
+
+            stats.calls += 1
+            stats.own += elapsed - nested
+            if not self.active[name]:
+                stats.cumulative += elapsed
+                stats.arguments += arguments_time
+
+    def report(self, sort='own', limit=None):
+        """a table of the stats, sorted by sort: 'calls', 'cumulative', 'own' or 'arguments'."""
+        rows = sorted(self.stats.items(), key=lambda row: getattr(row[1], sort), reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+
+        lines = ["%-24s %10s %12s %12s %12s" % ("function", "calls", "cumulative", "self",
+            "arguments")]
+        for name, s in rows:
+            lines.append("%-24s %10d %12.6f %12.6f %12.6f" % (name, s.calls, s.cumulative, s.own,
+                s.arguments))
+        return "\n".join(lines)
@@ -0,0 +1,155 @@
+"""Runs many programs at once in one thread, taking turns: each gets a quantum of function calls
+(see stackless.Machine.steps) before the next has its turn, and a program waiting for input to
+GETS is passed over until some arrives, rather than blocking the others.
+
+    scheduler = Scheduler(quantum=1000)
+    task = scheduler.spawn(parse_program(source))
+    task.feed("3")
+    scheduler.run()
+    print(task.output, task.error)
+
+A Task's input is fed to it a line at a time (close_input ends it, after which GETS raises
+EOFError, as raw_input would), and what it PUTS is kept in task.output, or passed to on_output.
+
+run carries on until every task has finished or is waiting for input. step gives each task which
+can run one turn and returns, so that the scheduler can be driven by some other event loop, e.g.
+one which feeds tasks lines from sockets as they arrive. (This is python 2, which has no asyncio:
+step is the hook for whatever loop the caller has.)"""
+
+from __future__ import print_function, division
+
+from collections import deque
+
+import vm
+from vm import LispRuntimeError
+from stackless import Machine, Read, Write, Done, EVALUATE
+
+
+# the states of a task.
+READY = 'ready'
+WAITING = 'waiting'
+FINISHED = 'finished'
+
+
+class Task(object):
+    """a program being run by a Scheduler. Once it has finished, value is the value of its last
+    top level form, or error the error it stopped with."""
+    def __init__(self, program, program_environment, machine, with_math=False, interpreter=None,
+            on_output=None):
+        self.interpreter = interpreter
+        self.on_output = on_output
+        self.output = []
+        self.input = deque()
+        self.input_closed = False
+
+        self.state = READY
+        self.value = None
+        self.error = None
+        # what the program is waiting for, and what to send it when it runs next.
+        self.request = None
+        self.reply = None
+
+        self.running = self.steps(program, program_environment, machine, with_math)
+
+    def steps(self, program, program_environment, machine, with_math):
+        context = vm.Context(parent=vm.program_context(program_environment, with_math))
+        for line in program:
+            steps = machine.steps(EVALUATE, context, line, None)
+            reply = None
+            while True:
+                request = steps.send(reply)
+                if type(request) is Done:
+                    self.value = request.value
+                    break
+                reply = yield request
+
+    def feed(self, line):
+        """a line of input for GETS, without its newline."""
+        self.input.append(line)
+        if self.state == WAITING:
+            self.state = READY
+
+    def close_input(self):
+        self.input_closed = True
+        if self.state == WAITING:
+            self.state = READY
+
+    def write(self, line):
+        if self.on_output is not None:
+            self.on_output(line)
+        else:
+            self.output.append(line)
+
+    def turn(self):
+        """runs the task until it has used its quantum, needs input it hasn't got, or finishes."""
+        if self.interpreter is not None:
+            with self.interpreter:
+                self.run_turn()
+        else:
+            self.run_turn()
+
+    def run_turn(self):
+        while True:
+            if type(self.request) is Read:
+                if self.input:
+                    self.reply = self.input.popleft()
+                elif not self.input_closed:
+                    self.state = WAITING
+                    return
+                # otherwise we send None, and GETS raises EOFError.
+
+            try:
+                request, self.reply = self.running.send(self.reply), None
+            except StopIteration:
+                self.finish()
+                return
+            except (LispRuntimeError, Exception) as e:
+                self.finish(e)
+                return
+
+            self.request = request
+            if type(request) is Write:
+                self.write(request.line)
+            elif type(request) is not Read:
+                # a slice: our turn is over.
+                return
+
+    def finish(self, error=None):
+        self.state = FINISHED
+        self.error = error
+        self.request = self.running = None
+
+
+class Scheduler(object):
+    """quantum is the number of function calls each task makes in a turn."""
+    def __init__(self, quantum=1000, max_depth=None):
+        self.machine = Machine(max_depth, quantum, io=True)
+        self.tasks = []
+        self.spawned = 0
+
+    def spawn(self, program, program_environment=None, with_math=False, interpreter=None,
+            on_output=None):
+        """starts a task running program, a list of top level forms, and returns it. Each task's
+        program_environment should be its own: by default, "(task N)"."""
+        self.spawned += 1
+        if program_environment is None:
+            program_environment = "(task %d)" % self.spawned
+        task = Task(program, program_environment, self.machine, with_math, interpreter, on_output)
+        self.tasks.append(task)
+        return task
+
+    def step(self):
+        """gives each task which is ready a turn, and forgets those which have finished. Returns
+        whether any were ready."""
+        ran = False
+        for task in self.tasks:
+            if task.state == READY:
+                task.turn()
+                ran = True
+        self.tasks = [task for task in self.tasks if task.state != FINISHED]
+        return ran
+
+    def run(self):
+        """runs until every task has finished, or is waiting for input."""
+        while self.step():
+            pass
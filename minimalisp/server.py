@@ -0,0 +1,159 @@
+"""A long running server, which runs programs sent to it over a unix socket, so that running many
+small programs does not pay each time for starting python and importing the interpreter.
+
+    minimalisp --serve /tmp/minimalisp.sock &
+    minimalisp-client --socket /tmp/minimalisp.sock -m program.l
+
+Each request is a line of JSON, answered with a line of JSON:
+
+    {"source": "(puts (+ 1 2))", "math": false, "permissive": false, "engine": "peval",
+        "stdin": "", "max_steps": null, "max_allocations": null, "max_seconds": null}
+    {"stdout": "3\\n", "error": null, "exception": null}
+
+"file" may be given instead of "source": the server reads it, and keeps the parsed program (or
+for the bytecode engine, uses its .lc cache, as it does for the modules it imports) so that a
+program run again and again is only parsed once. error is the message of the LispRuntimeError the
+program stopped with, if any, and exception the traceback of any other error.
+
+Modules IMPORTed by programs stay loaded between requests, in one interpreter.Interpreter for each
+combination of math and permissive, so changes to a module are only seen after a request with
+"reload": true. Requests are handled one at a time, on as many connections as the clients like."""
+
+from __future__ import print_function, division
+
+import hashlib
+import json
+import os
+import sys
+import traceback
+import SocketServer
+from StringIO import StringIO
+
+from parse import parse_program
+
+import vm
+import compiled
+import stackless
+import lexical
+import bytecode
+import memo
+from vm import LispRuntimeError
+from interpreter import Interpreter
+from budget import Budget
+
+
+ENGINES = {
+    'peval': vm.run,
+    'compiled': compiled.run,
+    'stackless': stackless.run,
+    'lexical': lexical.run,
+    'bytecode': bytecode.run,
+    'memo': memo.run
+}
+
+
+class Server(object):
+    """runs requests, keeping the interpreters and parsed programs between them. Only the most
+    recent cache_size programs are kept."""
+    def __init__(self, cache_size=1000):
+        self.cache_size = cache_size
+        self.interpreters = {}
+        self.programs = {}
+
+    def interpreter(self, with_math, permissive):
+        key = (with_math, permissive)
+        interpreter = self.interpreters.get(key)
+        if interpreter is None:
+            interpreter = self.interpreters[key] = Interpreter(with_math, permissive)
+        return interpreter
+
+    def program(self, request, engine):
+        """the program to run, and its environment."""
+        # (json gives unicode strings, the parser expects str.)
+        if 'file' in request:
+            filename = os.path.abspath(request['file'].encode('utf-8'))
+            if engine == 'bytecode':
+                return bytecode.load(filename), filename
+            source = open(filename, 'r').read()
+        else:
+            filename = "(request)"
+            source = request['source'].encode('utf-8')
+
+        key = hashlib.sha1(source).digest()
+        program = self.programs.get(key)
+        if program is None:
+            if len(self.programs) >= self.cache_size:
+                self.programs.clear()
+            program = self.programs[key] = parse_program(source)
+        return program, filename
+
+    def handle(self, request):
+        """runs one request, returning the response."""
+        response = {'stdout': "", 'error': None, 'exception': None}
+        engine = request.get('engine', 'peval')
+        interpreter = self.interpreter(bool(request.get('math')), bool(request.get('permissive')))
+        if request.get('reload'):
+            interpreter.forget_modules()
+
+        stdout, stdin = sys.stdout, sys.stdin
+        sys.stdout, sys.stdin = StringIO(), StringIO(request.get('stdin', "").encode('utf-8'))
+        try:
+            program, environment = self.program(request, engine)
+            limits = [request.get(limit) for limit in ('max_steps', 'max_allocations', 'max_seconds')]
+            self.run(interpreter, program, environment, ENGINES[engine], limits)
+        except LispRuntimeError as e:
+            response['error'] = e.message
+        except Exception:
+            response['exception'] = traceback.format_exc()
+        finally:
+            response['stdout'] = sys.stdout.getvalue()
+            sys.stdout, sys.stdin = stdout, stdin
+        return response
+
+    def run(self, interpreter, program, environment, run, limits):
+        # a program's context is put in the import cache under its file name while it runs (see
+        # vm.program_context), which must not be mistaken afterwards for the module of that name.
+        module = interpreter.import_cache.get(environment)
+        vm.BYTECODE_IMPORTS = run is bytecode.run
+        try:
+            if any(limit is not None for limit in limits):
+                with Budget(*limits):
+                    interpreter.run(program, environment, run)
+            else:
+                interpreter.run(program, environment, run)
+        finally:
+            vm.BYTECODE_IMPORTS = False
+            if module is None:
+                interpreter.import_cache.pop(environment, None)
+            else:
+                interpreter.import_cache[environment] = module
+
+
+class Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {'stdout': "", 'error': None, 'exception': "bad request: %s" % e}
+            else:
+                response = self.server.runner.handle(request)
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+
+
+def serve(path, cache_size=1000):
+    """serves requests on a unix socket at path until interrupted."""
+    if os.path.exists(path):
+        # left over from a server which did not shut down cleanly.
+        os.unlink(path)
+
+    server = SocketServer.UnixStreamServer(path, Handler)
+    server.runner = Server(cache_size)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
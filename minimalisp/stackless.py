@@ -0,0 +1,330 @@
+"""An evaluator which keeps the work still to be done after each sub-expression returns (argument
+lists half evaluated, lines of a function body still to run) as frames in a list, rather than on the
+python stack as peval does. Nesting and non-tail recursion are then limited only by memory, or by
+max_depth, which raises a LispRuntimeError rather than letting python run out of stack.
+
+Tail calls work as in peval: a frame is removed before its last expression is evaluated, so the
+stack does not grow, and a finished user function's context is reused by the function it calls.
+
+Since the whole state of an evaluation is in the stack, it can be paused: Machine.steps generates
+a Slice every quantum function calls, and with io, a Read or Write for each line GETS reads or
+PUTS prints, and carries on when it is sent the line read (or None for the end of the input.) The
+scheduler (scheduler.py) uses this to interleave many programs. Machine.evaluate does the I/O
+itself, as the builtins would."""
+
+from __future__ import print_function, division
+
+from values import NIL, LispType, LispValue, Symbol, Pair, unquote
+
+import vm
+from vm import LispRuntimeError, TailCall, UserLispFunction, check_count, truthy, _if, _eval, dowhile
+
+
+class Call(object):
+    """a call whose arguments are being evaluated. tail is set if the calling context is finished
+    with."""
+    def __init__(self, context, function, arguments, tail):
+        self.context = context
+        self.function = function
+        self.arguments = arguments
+        self.evaled = []
+        self.tail = tail
+
+
+class Head(object):
+    """a call whose function is itself being computed, by evaluating a Pair."""
+    def __init__(self, context, arguments, tail):
+        self.context = context
+        self.arguments = arguments
+        self.tail = tail
+
+
+class Lines(object):
+    """the lines of a user function or EVAL, of which the last will be evaluated as a tail call.
+    index is the line we are waiting on."""
+    def __init__(self, context, lines, finished):
+        self.context = context
+        self.lines = lines
+        self.index = 0
+        self.finished = finished
+
+
+class Loop(object):
+    """the body of a DOWHILE."""
+    def __init__(self, context, body):
+        self.context = context
+        self.body = body
+        self.index = 0
+
+
+class Slice(object):
+    """generated when a machine has made quantum function calls since it last paused."""
+    __slots__ = ()
+
+SLICE = Slice()
+
+
+class Read(object):
+    """generated for each line GETS reads: send the line, without its newline."""
+    __slots__ = ('prompt',)
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+
+
+class Write(object):
+    """generated for each line PUTS prints."""
+    __slots__ = ('line',)
+
+    def __init__(self, line):
+        self.line = line
+
+
+class Done(object):
+    """generated last, with the value of the expression."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+# what the machine is doing on each step:
+EVALUATE = 0 # evaluating expression in context.
+RETURN = 1   # handing value back to the frame on top of the stack.
+APPLY = 2    # calling call.function, now its arguments are all evaluated.
+
+
+class Machine(object):
+    def __init__(self, max_depth=None, quantum=None, io=False):
+        self.max_depth = max_depth
+        self.quantum = quantum
+        self.io = io
+
+    def evaluate(self, context, o):
+        """equivalent to vm.peval(context, o)."""
+        return self.execute(EVALUATE, context, o, None)
+
+    def call(self, context, function, arguments):
+        """calls function with a list of arguments which have already been evaluated."""
+        call = Call(context, function, NIL(), False)
+        call.evaled = list(arguments)
+        return self.execute(APPLY, context, None, call)
+
+    def execute(self, state, context, expression, call):
+        steps = self.steps(state, context, expression, call)
+        reply = None
+        while True:
+            request = steps.send(reply)
+            reply = None
+            if type(request) is Done:
+                return request.value
+            elif type(request) is Read:
+                reply = raw_input(request.prompt)
+            elif type(request) is Write:
+                print(request.line)
+
+    def steps(self, state, context, expression, call):
+        """generates the requests described above, ending with a Done."""
+        stack = []
+        max_depth = self.max_depth
+        quantum, io = self.quantum, self.io
+        countdown = quantum
+
+        # the context of a user function which has already returned, if we are evaluating its tail.
+        finished = None
+        value = None
+
+        while True:
+            if max_depth is not None and len(stack) > max_depth:
+                raise LispRuntimeError("maximum evaluation depth of %d exceeded." % max_depth)
+
+            if state == EVALUATE:
+                o = expression
+
+                if not isinstance(o, LispType):
+                    raise LispRuntimeError("peval was passed %r, which is not a LispType instance." % o)
+
+                state = RETURN
+                if isinstance(o, LispValue):
+                    value = o
+                elif isinstance(o, Pair) and o.quoted:
+                    value = unquote(o)
+                elif isinstance(o, Symbol):
+                    if o.quoted:
+                        value = o.unquoted
+                    else:
+                        value = context[o]
+                elif hasattr(o, '__call__'):
+                    raise LispRuntimeError("cannot evaluate a function")
+                elif not isinstance(o, Pair):
+                    raise LispRuntimeError("cannot evaluate %s", o)
+                else:
+                    tail = context is finished
+                    finished = None
+
+                    head = o.left
+                    if isinstance(head, Pair):
+                        stack.append(Head(context, o.right, tail))
+                        expression = head
+                        state = EVALUATE
+                    else:
+                        if isinstance(head, Symbol):
+                            function = context[head]
+                            if not hasattr(function, '__call__'):
+                                raise LispRuntimeError("symbol %r is not bound to a function, but %r" % (
+                                    head, function))
+                        elif hasattr(head, '__call__'):
+                            function = head
+                        else:
+                            raise LispRuntimeError("result %r cannot be executed as a function" % head)
+                        call = Call(context, function, o.right, tail)
+                        state = APPLY
+
+            if state == RETURN:
+                finished = None
+                if not stack:
+                    yield Done(value)
+                    return
+
+                frame = stack[-1]
+                context = frame.context
+
+                if isinstance(frame, Call):
+                    frame.evaled.append(value)
+                    frame.arguments = frame.arguments.right
+                    if frame.arguments is NIL.instance:
+                        stack.pop()
+                        call = frame
+                        state = APPLY
+                    else:
+                        expression = frame.arguments.left
+                        state = EVALUATE
+                elif isinstance(frame, Head):
+                    stack.pop()
+                    if not hasattr(value, '__call__'):
+                        raise LispRuntimeError("result %r cannot be executed as a function" % value)
+                    call = Call(context, value, frame.arguments, frame.tail)
+                    state = APPLY
+                elif isinstance(frame, Lines):
+                    frame.index += 1
+                    expression = frame.lines[frame.index]
+                    if frame.index == len(frame.lines) - 1:
+                        stack.pop()
+                        finished = frame.finished
+                    state = EVALUATE
+                else:
+                    frame.index += 1
+                    if frame.index == len(frame.body):
+                        if truthy(context, value):
+                            if vm.BUDGET is not None:
+                                vm.BUDGET.step()
+                            frame.index = 0
+                        else:
+                            stack.pop()
+                            value = NIL()
+                            continue
+                    expression = frame.body[frame.index]
+                    state = EVALUATE
+
+            elif state == APPLY:
+                function, context = call.function, call.context
+                state = EVALUATE
+
+                if vm.BUDGET is not None and not call.evaled:
+                    # (the first time we come here for this call, before its arguments.)
+                    vm.BUDGET.step()
+
+                if quantum is not None and not call.evaled:
+                    countdown -= 1
+                    if countdown == 0:
+                        countdown = quantum
+                        yield SLICE
+
+                # an argument list we must evaluate before calling, as pre_execute would.
+                if (isinstance(function, UserLispFunction) or hasattr(function, 'execute')) and \
+                        call.arguments is not NIL.instance:
+                    stack.append(call)
+                    expression = call.arguments.left
+                    continue
+
+                args = call.evaled
+                count = len(args)
+
+                if isinstance(function, UserLispFunction):
+                    check_count("(user function)", function.minc, function.maxc, count)
+                    context = function.new_context(context, args, reuse=call.tail)
+                    function.last_execute_context = context
+                    lines, lines_finished = function.functionbody, context
+                elif function is _if and 2 <= count <= 3:
+                    check_count(function.method, function.minc, function.maxc, count)
+                    if truthy(context, args[0]):
+                        expression = args[1]
+                    elif count == 3:
+                        expression = args[2]
+                    else:
+                        value = NIL()
+                        state = RETURN
+                        continue
+                    if call.tail:
+                        finished = context
+                    continue
+                elif function is _eval:
+                    check_count(function.method, function.minc, function.maxc, count)
+                    lines, lines_finished = args, context if call.tail else None
+                elif function is dowhile:
+                    check_count(function.method, function.minc, function.maxc, count)
+                    if not args:
+                        value = NIL()
+                        state = RETURN
+                        continue
+                    stack.append(Loop(context, args))
+                    expression = args[0]
+                    continue
+                elif io and (function is vm.puts or function is vm.gets):
+                    check_count(function.method, function.minc, function.maxc, count)
+                    value = NIL()
+                    if function is vm.puts:
+                        yield Write(vm.puts_line(args))
+                    else:
+                        for symbol, prompt in vm.gets_prompts(args):
+                            line = yield Read(prompt)
+                            if line is None:
+                                raise EOFError("EOF when reading a line")
+                            value = vm.gets_bind(context, symbol, line)
+                    state = RETURN
+                    continue
+                else:
+                    if hasattr(function, 'execute'):
+                        check_count(function.method, function.minc, function.maxc, count)
+                        result = function.execute(context, *args)
+                    else:
+                        # someone else's callable, which evaluates its own arguments.
+                        result = function(context, call.arguments)
+
+                    if isinstance(result, TailCall):
+                        context, expression = result.context, result.expression
+                        if result.finished:
+                            finished = context
+                    else:
+                        value = result
+                        state = RETURN
+                    continue
+
+                if not lines:
+                    value = NIL()
+                    state = RETURN
+                    continue
+
+                if len(lines) == 1:
+                    finished = lines_finished
+                else:
+                    stack.append(Lines(context, lines, lines_finished))
+                expression = lines[0]
+
+
+def run(program, program_environment, with_math=False, max_depth=None):
+    """equivalent to vm.run, evaluating with a Machine rather than peval."""
+    context = vm.Context(parent=vm.program_context(program_environment, with_math))
+    machine = Machine(max_depth)
+    for line in program:
+        machine.evaluate(context, line)
@@ -1,7 +1,7 @@
 stdlib = """; `apply` is trivial to implement in minimalisp itself:
+; the call is EVAL's last (and only) expression, so it is a tail call.
 (bind 'apply (with '(f args)
-                   '(eval (bind 'expr (cons 'f args))
-                          (eval expr))))
+                   '(eval (cons 'f args))))
 
 ; position of a value in an S-expression
 (bind 'pos (with '(v l i)
@@ -1,5 +1,8 @@
 from __future__ import print_function
 
+# a budget.Budget, while one limits how many Pairs and Values evaluation may create.
+BUDGET = None
+
 def crepr(s):
     assert type(s) is str, "crepr is for strings, i.e. str() instances."
     prepr = repr(s)
@@ -20,55 +23,102 @@ def lrepr(s):
 
 
 class LispType(object):
-    pass
+    # programs can be made of millions of these, so none of them has an instance __dict__.
+    __slots__ = ()
 
 
 class Symbol(LispType):
-    """only stores its text representation as a python string in upper case
-    - can therefore be used as a dict key."""
-    def __init__(self, s, quoted=False):
-        self.s = s.upper()
-        self.quoted = quoted
-
-    def __eq__(self, other):
-        if type(other) is not Symbol:
-            return False
-        return self.s == other.s
-
-    def __ne__(self, other):
-        return not self == other
+    """only stores its text representation as a python string in upper case.
+
+    Symbols are interned: there is exactly one Symbol for each name (and one quoted Symbol, see
+    QuotedSymbol), so unquoted Symbols compare and hash by identity, which makes them fast dict
+    keys. Symbols must not be modified."""
+
+    __slots__ = ('s', 'quoted', 'unquoted')
+
+    # every symbol, by the text it was created from and whether it is quoted.
+    _table = {}
+
+    def __new__(cls, s, quoted=False):
+        try:
+            return Symbol._table[s, quoted]
+        except KeyError:
+            pass
+
+        upper = s.upper()
+        symbol = Symbol._table.get((upper, quoted))
+        if symbol is None:
+            if quoted:
+                symbol = object.__new__(QuotedSymbol)
+                symbol.unquoted = Symbol(upper)
+            else:
+                symbol = object.__new__(Symbol)
+                symbol.unquoted = symbol
+            symbol.s = upper
+            symbol.quoted = quoted
+            # (setdefault, rather than setting it, so that of two threads creating the same
+            # symbol at once, both get the one which went in first.)
+            symbol = Symbol._table.setdefault((upper, quoted), symbol)
+
+        return Symbol._table.setdefault((s, quoted), symbol)
+
+    def __reduce__(self):
+        # so that unpickled symbols are interned too.
+        return (Symbol, (self.s, self.quoted))
 
     def __repr__(self):
         if self.quoted:
             return "'" + self.s
         return self.s
 
+
+class QuotedSymbol(Symbol):
+    """a quoted symbol is equal to the unquoted symbol with the same name, as it always has been,
+    so it hashes and compares as that symbol does."""
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return isinstance(other, Symbol) and self.unquoted is other.unquoted
+
+    def __ne__(self, other):
+        return not self == other
+
     def __hash__(self):
-        return hash(self.s)
+        return hash(self.unquoted)
 
 
 class LispValue(LispType):
-    pass
+    __slots__ = ()
 
 
 class NIL(LispValue):
-    def __eq__(self, other):
-        return isinstance(other, NIL)
+    """the empty list. There is only one: NIL() always returns NIL.instance, so it can be tested
+    for with `is`."""
+    __slots__ = ()
 
-    def __ne__(self, other):
-        return not self == other
+    def __new__(cls):
+        return NIL.instance
+
+    def __reduce__(self):
+        return (NIL, ())
 
     def __repr__(self):
         return 'NIL'
 
+NIL.instance = object.__new__(NIL)
+
 
 class Value(LispValue):
     """stored simply as the relevant python type (string, int or float)."""
+    __slots__ = ('v',)
+
     def __init__(self, v, actual=False):
         if actual:
             self.v = v
         else:
             self.v = eval(v)
+        if BUDGET is not None:
+            BUDGET.allocate()
 
     def __eq__(self, other):
         if not isinstance(other, Value):
@@ -78,6 +128,10 @@ class Value(LispValue):
     def __ne__(self, other):
         return not self == other
 
+    def __hash__(self):
+        # as the python value, so that 1 and 1.0 hash alike, as they are equal.
+        return hash(self.v)
+
     def __repr__(self):
         if isinstance(self.v, (str, unicode)):
             return self.v
@@ -85,44 +139,261 @@ class Value(LispValue):
             return repr(self.v)
 
 
-class Pair(LispType):
-    def __init__(self, left=None, right=None, quoted=False):
-        self.left = left
-        self.right = right
-        self.quoted = quoted
+class Vector(LispValue):
+    """a fixed length sequence of lisp objects, stored as a python list, so that its length and
+    each of its items can be had without walking a list of Pairs. Unlike Pairs, Vectors can be
+    changed (by VSET), so they all hash alike: a Pair's cached hash must not depend on what a
+    Vector inside it holds. = compares them item by item."""
+    __slots__ = ('items',)
+
+    def __init__(self, items):
+        self.items = items
+        if BUDGET is not None:
+            BUDGET.allocate()
 
     def __eq__(self, other):
-        if not isinstance(other, Pair):
+        if not isinstance(other, Vector) or len(self.items) != len(other.items):
             return False
+        # (as Pairs compare their leaves, rather than as python lists, which take an item to be
+        # equal to itself.)
+        return not any([x != y for x, y in zip(self.items, other.items)])
 
-        # This is recursive for large pair structures, and should test equality of all
-        # leaf values.
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(Vector)
 
-        # We change the order to avoid making depth-first the enemy of speed (one side may be a
-        # single different value, the other may be a large, equal linked list.)
-        left_is_pair = isinstance(self.left, Pair) and isinstance(other.left, Pair)
-        right_is_pair = isinstance(self.right, Pair) and isinstance(other.right, Pair)
+    def __repr__(self):
+        return "[" + " ".join(["%s" % (i,) for i in self.items]) + "]"
 
-        if left_is_pair and not right_is_pair:
-            return (self.right == other.right and self.left == other.left)
 
-        return (self.left == other.left and self.right == other.right)
+class Pair(LispType):
+    """Pairs are hashable, by their structure: the hash is worked out the first time it is asked
+    for and cached, so left and right must not be changed once a Pair has been hashed. As with =,
+    whether pairs and symbols are quoted makes no difference to it."""
+    __slots__ = ('left', 'right', 'quoted', 'cached_hash')
+
+    def __init__(self, left=None, right=None, quoted=False):
+        self.left = left
+        self.right = right
+        self.quoted = quoted
+        self.cached_hash = None
+        if BUDGET is not None:
+            BUDGET.allocate()
+
+    def __eq__(self, other):
+        # This should test equality of all leaf values, so we keep a list of the pairs still to
+        # compare rather than recursing, which would fail for long lists.
+        to_compare = [(self, other)]
+
+        while to_compare:
+            a, b = to_compare.pop()
+            if a is b:
+                continue
+            if not isinstance(b, Pair):
+                return False
+            if a.cached_hash is not None and b.cached_hash is not None and \
+                    a.cached_hash != b.cached_hash:
+                return False
+            if type(a) is SharedPair and type(b) is SharedPair and a.generation == b.generation \
+                    and a.shape is not None and b.shape is not None:
+                # there is only one shared pair with each shape.
+                if a.shape is b.shape:
+                    continue
+                return False
+
+            # We compare leaves before following pairs, to avoid making depth-first the enemy of
+            # speed (one side may be a single different value, the other may be a large, equal
+            # linked list.)
+            for x, y in ((a.left, b.left), (a.right, b.right)):
+                if isinstance(x, Pair) and isinstance(y, Pair):
+                    to_compare.append((x, y))
+                elif x != y:
+                    return False
+
+        return True
 
     def __ne__(self, other):
         return not self == other
 
+    def __hash__(self):
+        if self.cached_hash is not None:
+            return self.cached_hash
+
+        # hash every pair below this one which hasn't been yet, children first, without recursing.
+        to_visit = [self]
+        while to_visit:
+            node = to_visit[-1]
+            left, right = node.left, node.right
+            if isinstance(left, Pair):
+                if left.cached_hash is None:
+                    to_visit.append(left)
+                    continue
+                left = left.cached_hash
+            if isinstance(right, Pair):
+                if right.cached_hash is None:
+                    to_visit.append(right)
+                    continue
+                right = right.cached_hash
+            to_visit.pop()
+            node.cached_hash = hash((left, right))
+        return self.cached_hash
+
 
     @classmethod
-    def pair_list_from_sexpr(cls, s, outermost_quoted = False):
-        right = NIL()
+    def pair_list_from_sexpr(cls, s, outermost_quoted = False, shared=False):
+        if shared:
+            return shared_list(s, outermost_quoted)
+        right = NIL.instance
         for v in reversed(s):
             right = Pair(v, right)
-        if outermost_quoted:
+        # (an empty list is just NIL, quoted or not.)
+        if outermost_quoted and isinstance(right, Pair):
             right.quoted = True
         return right
 
     def __repr__(self):
-        q = ""
-        if self.quoted:
-            q = "'"
-        return "%s(%s . %s)" % (q, self.left, self.right)
+        # Equivalent to "%s(%s . %s)" % (q, self.left, self.right), but with a stack rather than
+        # recursion, so that long lists can be printed.
+        parts = []
+        to_print = [self]
+
+        while to_print:
+            o = to_print.pop()
+            if isinstance(o, Pair):
+                q = ""
+                if o.quoted:
+                    q = "'"
+                to_print.extend([")", o.right, " . ", o.left, q + "("])
+            elif type(o) is str:
+                parts.append(o)
+            else:
+                parts.append("%s" % (o,))
+
+        return "".join(parts)
+
+
+class SharedPair(Pair):
+    """a hash-consed Pair: made by shared_pair, which returns the same SharedPair every time it is
+    asked for the same structure, so that a program or data set full of duplicate trees holds one
+    copy of each. = ignores which pairs and symbols are quoted, and compares numbers by value, so
+    each also has a shape: the SharedPair with the same structure, nothing quoted, and one Value for
+    each number. Two SharedPairs are equal only if they have the same shape, and = need not look
+    inside them. (Pairs containing nan, which is equal to nothing, or a Vector, have no shape.)
+
+    Every pair below a SharedPair is shared too. Pairs are never modified, so sharing them is only
+    visible to ==, which compares identity. clear_shared forgets them all, starting a new
+    generation: pairs from an older one are no longer assumed to be the only copy."""
+    __slots__ = ('generation', 'shape')
+
+    # every SharedPair, by the keys of its left and right, and whether it is quoted.
+    _table = {}
+    _generation = 0
+    # the Value which stands for each number or string in shapes.
+    _shape_values = {}
+
+
+def shape_of(o):
+    if type(o) is SharedPair:
+        return o.shape
+    if isinstance(o, Vector):
+        # it may be changed, so is equal to different things at different times.
+        return None
+    if isinstance(o, Symbol):
+        return o.unquoted
+    if isinstance(o, Value):
+        if o.v != o.v:
+            return None
+        return SharedPair._shape_values.setdefault(o.v, o)
+    return o
+
+
+def share_key(o):
+    """what identifies o as part of a shared structure, or None if it is not shared itself."""
+    if type(o) is SharedPair:
+        return id(o) if o.generation == SharedPair._generation else None
+    if isinstance(o, Pair):
+        return None
+    if isinstance(o, Value):
+        v = o.v
+        if v != v:
+            # nan, which is equal to nothing: each is its own, so that pairs holding different
+            # nans are not made into one pair, which = would find equal.
+            return (id(o), o)
+        # by hex for floats, so that 0.0 and -0.0 are kept apart.
+        return (type(v), v.hex() if type(v) is float else v)
+    # interned symbols, NIL, and anything else, by identity. (Quoted symbols compare equal to
+    # unquoted ones, so must not be compared at all.)
+    return (id(o), o)
+
+
+def shared_pair(left, right=None, quoted=False):
+    """the SharedPair (left . right), sharing left and right first if they are Pairs which are
+    not shared already."""
+    left_key, right_key = share_key(left), share_key(right)
+    if left_key is None:
+        left = share(left)
+        left_key = id(left)
+    if right_key is None:
+        right = share(right)
+        right_key = id(right)
+
+    key = (left_key, right_key, quoted)
+    pair = SharedPair._table.get(key)
+    if pair is None:
+        pair = SharedPair(left, right, quoted)
+        pair.generation = SharedPair._generation
+        SharedPair._table[key] = pair
+
+        left_shape, right_shape = shape_of(left), shape_of(right)
+        if left_shape is None or right_shape is None:
+            pair.shape = None
+        elif quoted or left_shape is not left or right_shape is not right:
+            pair.shape = shared_pair(left_shape, right_shape)
+        else:
+            pair.shape = pair
+    return pair
+
+
+def shared_list(items, quoted=False):
+    """as Pair.pair_list_from_sexpr, with SharedPairs."""
+    right = NIL.instance
+    for i, v in enumerate(reversed(items)):
+        right = shared_pair(v, right, quoted and i == len(items) - 1)
+    return right
+
+
+def share(o):
+    """the shared equivalent of o: o itself if it is not a Pair, or already shared. Walks the tree
+    with a stack rather than recursing, so that long lists can be shared."""
+    if not isinstance(o, Pair) or share_key(o) is not None:
+        return o
+
+    done = {}
+    to_visit = [o]
+    while to_visit:
+        node = to_visit[-1]
+        children = [c for c in (node.left, node.right)
+            if isinstance(c, Pair) and share_key(c) is None and id(c) not in done]
+        if children:
+            to_visit.extend(children)
+            continue
+        to_visit.pop()
+        left, right = (done.get(id(c), c) for c in (node.left, node.right))
+        done[id(node)] = shared_pair(left, right, node.quoted)
+    return done[id(o)]
+
+
+def unquote(pair):
+    """the unquoted copy of a quoted Pair, which is what evaluating it gives."""
+    if type(pair) is SharedPair:
+        return shared_pair(pair.left, pair.right)
+    return Pair(pair.left, pair.right)
+
+
+def clear_shared():
+    """forgets every SharedPair, so that they can be freed."""
+    SharedPair._table = {}
+    SharedPair._shape_values = {}
+    SharedPair._generation += 1
@@ -0,0 +1,345 @@
+"""Evaluates one arithmetic expression over many points at once, for symbolic regression.
+
+    evaluate_points(parse_program("(+ (* x x) (sin y))")[0], {'x': xs, 'y': ys}, with_math=True)
+
+binds each free variable to a numpy array of its values, and walks the tree once, running + - * /
+< > IF ROUND and the maths library element-wise. Integers are kept in arrays of python ints, so
+they behave exactly as they would in peval; floats are float64, as they are in python.
+
+The result must be the same as evaluating the expression once per point. Anything the vector code
+cannot do exactly (user functions, BIND, strings, a point which would raise an error, or no numpy)
+raises Unvectorizable inside, and the whole expression is then evaluated point by point instead."""
+
+from __future__ import print_function, division
+
+import math
+
+from values import NIL, Symbol, Value, Pair
+
+import vm
+import maths
+from vm import Context, LispRuntimeError, _if
+from compiled import Compiler
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+ENVIRONMENT = "(vectorized)"
+
+
+class Unvectorizable(Exception):
+    """raised when an expression cannot be evaluated element-wise with the same results as it
+    would have at each point."""
+    pass
+
+
+def truth(x):
+    """is x the result of a comparison, (Value(1) or NIL at each point,) rather than a number?"""
+    return isinstance(x, bool) or (isinstance(x, numpy.ndarray) and x.dtype == bool)
+
+
+def as_array(values):
+    """converts a column of numbers to an array: float64 if they are all floats, python objects
+    otherwise, so that ints keep their unlimited precision."""
+    if isinstance(values, numpy.ndarray):
+        if values.dtype.kind == 'f':
+            return values.astype(float)
+        if values.dtype.kind in 'iu':
+            return values.astype(object)
+        values = values.tolist()
+
+    values = [v.v if isinstance(v, Value) else v for v in values]
+    for v in values:
+        if isinstance(v, bool) or not isinstance(v, vm.numbers):
+            raise Unvectorizable("%r is not a number." % (v,))
+
+    if all(type(v) is float for v in values):
+        return numpy.array(values, dtype=float)
+    return numpy.array(values, dtype=object)
+
+
+def conditional(mask, then_value, else_value, n):
+    """the element-wise choice between two results, computed only where they are chosen."""
+    if truth(then_value) != truth(else_value):
+        raise Unvectorizable("IF branches give numbers at some points and NIL at others.")
+
+    def dtype_of(x):
+        if isinstance(x, numpy.ndarray):
+            return x.dtype
+        return numpy.array([x]).dtype if type(x) is float or isinstance(x, bool) else object
+
+    dtype = dtype_of(then_value)
+    if dtype != dtype_of(else_value):
+        dtype = object
+
+    result = numpy.empty(n, dtype=dtype)
+    result[mask] = then_value
+    result[~mask] = else_value
+    return result
+
+
+class VectorEvaluator(object):
+    """walks an expression with numpy arrays in place of Values. Each builtin is recognised by
+    identity, so that it is still the builtin bound to its symbol in context which is vectorized,
+    and a program which rebinds + is evaluated point by point."""
+    def __init__(self, context):
+        self.context = context
+        self.operations = {
+            vm.plus: self.plus,
+            vm.minus: self.minus,
+            vm.multiply: self.multiply,
+            vm.divide: self.divide,
+            vm._round: self.round,
+            vm.less_than: lambda args: self.compare(numpy.less, args),
+            vm.greater_than: lambda args: self.compare(numpy.greater, args),
+            maths.sin: lambda args: self.math(numpy.sin, math.sin, args),
+            maths.cos: lambda args: self.math(numpy.cos, math.cos, args),
+            maths.tan: lambda args: self.math(numpy.tan, math.tan, args),
+            maths.asin: lambda args: self.math(numpy.arcsin, math.asin, args),
+            maths.acos: lambda args: self.math(numpy.arccos, math.acos, args),
+            maths.atan: lambda args: self.math(numpy.arctan, math.atan, args),
+            maths.exp: lambda args: self.math(numpy.exp, math.exp, args),
+            maths.atan2: self.atan2,
+            maths.log: self.log
+        }
+
+    def evaluate(self, o, columns, n):
+        """returns a python number or bool (if o is the same at every point), or an array of n."""
+        if isinstance(o, Value):
+            if isinstance(o.v, bool) or not isinstance(o.v, vm.numbers):
+                raise Unvectorizable("%r is not a number." % o)
+            return o.v
+
+        if isinstance(o, Symbol) and not o.quoted:
+            if o in columns:
+                return columns[o]
+            try:
+                value = self.context[o]
+            except LispRuntimeError:
+                raise Unvectorizable("symbol %r is unbound." % o)
+            # a symbol's value is not evaluated again: only numbers can be used as constants.
+            if not isinstance(value, Value):
+                raise Unvectorizable("symbol %r is bound to %r." % (o, value))
+            return self.evaluate(value, columns, n)
+
+        if not isinstance(o, Pair) or o.quoted or not isinstance(o.left, Symbol) or \
+                o.left in columns:
+            raise Unvectorizable("%r is not a call to a builtin." % o)
+
+        try:
+            function = self.context[o.left]
+        except LispRuntimeError:
+            raise Unvectorizable("symbol %r is unbound." % o.left)
+
+        arguments = []
+        rest = o.right
+        while isinstance(rest, Pair):
+            arguments.append(rest.left)
+            rest = rest.right
+        if rest is not NIL.instance or getattr(function, 'minc', 0) > len(arguments) or \
+                getattr(function, 'maxc', 0) < len(arguments):
+            raise Unvectorizable("%r has the wrong arguments." % o)
+
+        if function is _if:
+            return self.conditional(arguments, columns, n)
+
+        operation = self.operations.get(function)
+        if operation is None:
+            raise Unvectorizable("%r cannot be vectorized." % function)
+
+        args = [self.evaluate(a, columns, n) for a in arguments]
+        for a in args:
+            if truth(a):
+                raise Unvectorizable("NIL cannot be computed with.")
+        return operation(args)
+
+    def conditional(self, arguments, columns, n):
+        test = self.evaluate(arguments[0], columns, n)
+        if not truth(test):
+            test = test != 0
+        if isinstance(test, numpy.ndarray):
+            test = test.astype(bool)
+
+        branches = []
+        for branch in arguments[1:]:
+            # a quoted branch is unquoted as IF's argument, and the result evaluated; anything
+            # else is evaluated as the argument, and must then evaluate to itself.
+            if isinstance(branch, (Pair, Symbol)) and branch.quoted:
+                branch = branch.unquoted if isinstance(branch, Symbol) else Pair(branch.left, branch.right)
+            elif not isinstance(branch, Value):
+                raise Unvectorizable("IF branch %r is not quoted." % branch)
+            branches.append(branch)
+
+        if not isinstance(test, numpy.ndarray):
+            if test:
+                return self.evaluate(branches[0], columns, n)
+            if len(branches) < 2:
+                raise Unvectorizable("IF gives NIL.")
+            return self.evaluate(branches[1], columns, n)
+
+        chosen = [test, ~test]
+        results = []
+        for branch, mask in zip(branches, chosen):
+            count = int(mask.sum())
+            if count == 0:
+                results.append(None)
+                continue
+            subset = dict((name, column[mask]) for name, column in columns.items())
+            results.append(self.evaluate(branch, subset, count))
+
+        if len(branches) < 2 and not test.all():
+            raise Unvectorizable("IF gives NIL at some points.")
+        if results[0] is None:
+            return results[1]
+        if len(results) < 2 or results[1] is None:
+            return results[0]
+        return conditional(test, results[0], results[1], n)
+
+    def plus(self, args):
+        # exactly as python's sum does it.
+        result = 0
+        for a in args:
+            result = result + a
+        return result
+
+    def minus(self, args):
+        return args[0] - self.plus(args[1:])
+
+    def multiply(self, args):
+        result = 1
+        for a in args:
+            result = result * a
+        return result
+
+    def divide(self, args):
+        numerator, denominator = args[0], self.multiply(args[1:])
+        if not isinstance(numerator, numpy.ndarray) and not isinstance(denominator, numpy.ndarray):
+            return numerator / denominator
+        # true_divide, since numpy's divide does integer division of ints.
+        return numpy.true_divide(numerator, denominator)
+
+    def round(self, args):
+        f = args[0]
+        if not isinstance(f, numpy.ndarray):
+            if type(f) is not float:
+                raise Unvectorizable("ROUND needs a float.")
+            return int(round(f))
+
+        if f.dtype != float:
+            raise Unvectorizable("ROUND needs floats.")
+        if not numpy.isfinite(f).all() or (numpy.abs(f) > 2 ** 62).any():
+            raise Unvectorizable("ROUND cannot convert these to ints.")
+        # python rounds halves away from zero, numpy to even. f - whole is exact.
+        whole = numpy.trunc(f)
+        rounded = whole + numpy.sign(f) * (numpy.abs(f - whole) >= 0.5)
+        return rounded.astype(numpy.int64).astype(object)
+
+    def compare(self, operation, args):
+        # like the builtins, compares the first argument with each of the others.
+        result = True
+        for a in args[1:]:
+            result = numpy.logical_and(result, operation(args[0], a))
+        if isinstance(result, numpy.ndarray):
+            return result.astype(bool)
+        return bool(result)
+
+    def floats(self, x):
+        if isinstance(x, numpy.ndarray):
+            return x.astype(float)
+        return float(x)
+
+    def math(self, vector_function, scalar_function, args):
+        x = args[0]
+        if not isinstance(x, numpy.ndarray):
+            return scalar_function(x)
+        return vector_function(self.floats(x))
+
+    def atan2(self, args):
+        a, b = args
+        if not isinstance(a, numpy.ndarray) and not isinstance(b, numpy.ndarray):
+            return math.atan2(a, b)
+        return numpy.arctan2(self.floats(a), self.floats(b))
+
+    def log(self, args):
+        a = args[0]
+        b = args[1] if len(args) > 1 else 10
+        if not isinstance(a, numpy.ndarray) and not isinstance(b, numpy.ndarray):
+            return math.log(a, b)
+        # as math.log does it, rather than numpy.log10.
+        return numpy.true_divide(numpy.log(self.floats(a)), numpy.log(self.floats(b)))
+
+
+def evaluate_vector(expression, columns, context):
+    """returns an array with the value of expression at each point, True or False where it is a
+    comparison, or raises Unvectorizable. columns is a dict of Symbols to columns of numbers."""
+    if numpy is None:
+        raise Unvectorizable("numpy is not installed.")
+    if vm.permissive():
+        raise Unvectorizable("permissive mode changes what errors do.")
+
+    arrays = dict((name, as_array(column)) for name, column in columns.items())
+    lengths = set(len(a) for a in arrays.values())
+    if len(lengths) != 1:
+        raise ValueError("columns must all be the same length, and there must be at least one.")
+    n = lengths.pop()
+
+    with numpy.errstate(all='raise'):
+        try:
+            result = VectorEvaluator(context).evaluate(expression, arrays, n)
+        except ArithmeticError as e:
+            # including numpy's FloatingPointError: a point at which python would raise an error.
+            raise Unvectorizable(str(e))
+        except (ValueError, TypeError) as e:
+            raise Unvectorizable(str(e))
+
+    if not isinstance(result, numpy.ndarray):
+        result = numpy.array([result] * n, dtype=bool if truth(result) else object)
+    return result
+
+
+def evaluate_points(expression, columns, with_math=False, context=None):
+    """returns a list of the value of expression at each point, as peval would give it. columns is
+    a dict of names (strings or Symbols) to columns of values, all the same length.
+
+    A point at which evaluating the expression raises an error gives that error in the list
+    instead. context defaults to a program context, with the maths library if with_math is set."""
+    if context is None:
+        context = vm.program_context(ENVIRONMENT, with_math)
+    columns = dict((Symbol(name) if isinstance(name, str) else name, column)
+        for name, column in columns.items())
+
+    try:
+        result = evaluate_vector(expression, columns, context)
+    except Unvectorizable:
+        return evaluate_each(expression, columns, context)
+    return lisp_values(result)
+
+
+def lisp_values(result):
+    """converts an array from evaluate_vector to a list of Values and NILs."""
+    if result.dtype == bool:
+        return [Value(1, actual=True) if r else NIL() for r in result]
+    # an array of python objects may hold numpy floats, where ints and float64s have been mixed.
+    return [Value(float(r) if isinstance(r, numpy.floating) else r, actual=True)
+        for r in result.tolist()]
+
+
+def evaluate_each(expression, columns, context):
+    """the fallback: evaluates expression once per point."""
+    code = Compiler().compile_value(expression)
+    names = list(columns.keys())
+    rows = zip(*[column.tolist() if hasattr(column, 'tolist') else column
+        for column in (columns[name] for name in names)])
+
+    results = []
+    for row in rows:
+        bindings = dict((name, v if isinstance(v, Value) else Value(v, actual=True))
+            for name, v in zip(names, row))
+        try:
+            results.append(code(Context(bindings, parent=context)))
+        except (LispRuntimeError, ArithmeticError, ValueError) as e:
+            results.append(e)
+    return results
@@ -1,6 +1,6 @@
 from __future__ import print_function, division
 
-from values import NIL, LispType, LispValue, Symbol, Value, Pair
+from values import NIL, LispType, LispValue, Symbol, Value, Vector, Pair, shared_pair, unquote
 
 from parse import parse_token_prompt, parse_program
 
@@ -10,10 +10,53 @@ import random
 random.seed()
 
 import os.path
+import threading
 
 # overwritten in the executible
 PERMISSIVE = False
 
+# the interpreter.Interpreter running in each thread, if any, and (previous) those it was entered
+# inside. While one runs, the builtins, import cache, permissive flag and random numbers are its
+# own, rather than this module's.
+_running = threading.local()
+
+# a profiler.Profiler, while one is recording function calls.
+PROFILER = None
+
+# a budget.Budget, while one limits the steps and time evaluation may take.
+BUDGET = None
+
+# set to build lists with values.shared_pair, so that equal lists are the same object.
+SHARE = False
+
+# set to use the definitions of APPLY, POS, LEN, NOT, AND, OR and RANDINT written in minimalisp
+# (stdlib.py) rather than the native ones below.
+LISP_STDLIB = False
+
+# set to load IMPORTed modules through bytecode.py, which keeps a .lc cache beside each one, rather
+# than parsing and evaluating them.
+BYTECODE_IMPORTS = False
+
+def interpreter():
+    """the Interpreter running in this thread, or None."""
+    return getattr(_running, 'interpreter', None)
+
+
+def permissive():
+    running = getattr(_running, 'interpreter', None)
+    if running is None:
+        return PERMISSIVE
+    return running.permissive
+
+
+def modules():
+    """the import cache: the context each module ran in, by its canonical name."""
+    running = getattr(_running, 'interpreter', None)
+    if running is None:
+        return import_cache
+    return running.import_cache
+
+
 class LispRuntimeError(BaseException):
     pass
 
@@ -22,15 +65,29 @@ class UnboundSymbolError(LispRuntimeError):
     pass
 
 def sexpr_from_iterator(it):
-    pair = NIL()
+    make_pair = shared_pair if SHARE else Pair
+    pair = NIL.instance
     for i in reversed(it):
-        pair = Pair(i, pair)
+        pair = make_pair(i, pair)
 
     return pair
 
 
+# marks a symbol missing from a single level of Context.
+_unbound = object()
+
+
 class Context(dict):
-    """stack-like dictionary."""
+    """stack-like dictionary.
+
+    The modules a context has IMPORTed are attached to it (see attach) rather than copied into
+    it: looking up a symbol tries the context's own bindings, then its modules', most recently
+    imported first, then its parent's."""
+
+    # set once a lexically scoped function (see lexical.py) has been defined in this context, so
+    # that it is not reused for a tail call while the function may still refer to it.
+    captured = False
+
     def __init__(self, *args, **kwargs):
         # default arg that can only be specified by keyword. Python 3 fixes this problem.
         self.parent = kwargs.pop('parent', None)
@@ -44,78 +101,178 @@ class Context(dict):
         super(Context, self).__init__(*args, **kwargs)
 
     def __getitem__(self, key):
-        try:
-            return super(Context, self).__getitem__(key)
-        except KeyError:
-            if self.parent is None:
-                if PERMISSIVE:
-                    return NIL()
-                raise UnboundSymbolError("symbol %r was used unbound." % key)
+        # walk up the chain in a loop: it is as long as the (non-tail) recursion is deep.
+        context = self
+        while isinstance(context, Context):
+            value = dict.get(context, key, _unbound)
+            if value is not _unbound:
+                return value
+            context = context.parent
+
+        if context is not None:
+            # some other kind of context, e.g. a lexical.Frame.
+            return context[key]
+
+        if permissive():
+            return NIL()
+        raise UnboundSymbolError("symbol %r was used unbound." % key)
+
+    def __contains__(self, key):
+        context = self
+        while isinstance(context, Context):
+            if dict.__contains__(context, key):
+                return True
+            context = context.parent
+
+        if context is not None:
+            return key in context
+
+        return False
+
+    def own(self, key, default=None):
+        """the value of key in this context, or the modules it has imported, but not its parents:
+        what this context gives the contexts which import it."""
+        value = dict.get(self, key, _unbound)
+        if value is _unbound and isinstance(self.parent, Imports):
+            value = imported(self.parent.modules, key, _unbound)
+        if value is _unbound:
+            return default
+        return value
+
+    def attach(self, module):
+        """makes the bindings of module (an imported program's context) visible here, as if they had
+        just been bound here, without copying them: later changes to the module are seen, and the
+        module is shared by everything which imports it."""
+        # it takes precedence over anything already bound here, so those bindings are forgotten.
+        for key in [k for k in dict.keys(self) if module.own(k, _unbound) is not _unbound]:
+            del self[key]
+
+        modules, parent = (module,), self.parent
+        if isinstance(parent, Imports):
+            modules += tuple(m for m in parent.modules if m is not module)
+            parent = parent.parent
+        self.parent = Imports(modules, parent)
+
+
+class Imports(object):
+    """the modules imported into a context, which sit between it and its parent, so that only the
+    lookups which get that far pay for them."""
+    def __init__(self, modules, parent):
+        self.modules = modules
+        self.parent = parent
+        self.env = parent.env
 
+    def __getitem__(self, key):
+        value = imported(self.modules, key, _unbound)
+        if value is not _unbound:
+            return value
         return self.parent[key]
 
     def __contains__(self, key):
-        ret = super(Context, self).__contains__(key)
+        return imported(self.modules, key, _unbound) is not _unbound or key in self.parent
+
+
+def imported(modules, key, default=None):
+    """the value of key in the first of modules to bind it."""
+    for module in modules:
+        value = module.own(key, _unbound)
+        if value is not _unbound:
+            return value
+    return default
+
+
+class TailCall(object):
+    """returned by IF, EVAL and user functions in place of evaluating their last expression
+    themselves, so that peval can evaluate it in a loop rather than by growing the python stack.
 
-        if ret is False and self.parent is not None:
-            ret = key in self.parent
+    finished is set when context belongs to a user function which has returned, and so may be
+    reused by the next user function called from it."""
+    def __init__(self, context, expression, finished=False):
+        self.context = context
+        self.expression = expression
+        self.finished = finished
 
-        return ret
+
+def force(result):
+    """for callers of functions other than peval: evaluates the expression a TailCall defers."""
+    if isinstance(result, TailCall):
+        return peval(result.context, result.expression)
+    return result
 
 
 # evaluate - should be a Symbol, Value or a Pair.
 def peval(context, o):
-    if not isinstance(o, LispType):
-        raise LispRuntimeError("peval was passed %r, which is not a LispType instance." % o)
-
-    # Value's and NIL
-    if isinstance(o, LispValue):
-        return o
-
-    # if object is quoted, un-quote it:
-    if isinstance(o, Pair) and o.quoted:
-        return Pair(o.left, o.right)
-    if isinstance(o, Symbol) and o.quoted:
-        return Symbol(o.s)
-
-    # if object is a bound symbol, substitute its value:
-    if isinstance(o, Symbol):
-        return context[o]
-
-    # if o is a function:
-    if hasattr(o, '__call__'):
-        raise LispRuntimeError("cannot evaluate a function")
-
-    # in other cases, o must be a pair.
-    if not isinstance(o, Pair):
-        raise LispRuntimeError("cannot evaluate %s", o)
-    pair = o
-
-    # in which case, if we have been asked to run a function!
-    if isinstance(pair.left, Symbol):
-        try:
-            function = context[pair.left]
-        except KeyError:
-            raise LispRuntimeError("unbound symbol %r" % pair.left)
-
-        if not hasattr(function, '__call__'):
-            raise LispRuntimeError("symbol %r is not bound to a function, but %r" % (pair.left, function))
-    elif isinstance(pair.left, Pair):
-        # pair.left is a pair. it is important to eval it here - this is the one context in which
-        # it won't be evaled by pre_execute_impl, which only acts on arguments - and check we get a
-        # function, rather than dying here.
-        function = peval(context, pair.left)
-
-        if not hasattr(function, '__call__'):
-            raise LispRuntimeError("result %r cannot be executed as a function" % function)
-    elif hasattr(pair.left, '__call__'):
-        # someone has got a function object in the right place for us. Go them!
-        function = pair.left
-    else:
-        # pair.left is a Value, or something.
-        raise LispRuntimeError("result %r cannot be executed as a function" % pair.left)
+    # the context of a user function which has already returned, if we are evaluating its tail.
+    finished = None
+
+    while True:
+        if not isinstance(o, LispType):
+            raise LispRuntimeError("peval was passed %r, which is not a LispType instance." % o)
+
+        # Value's and NIL
+        if isinstance(o, LispValue):
+            return o
+
+        # if object is quoted, un-quote it:
+        if isinstance(o, Pair) and o.quoted:
+            return unquote(o)
+        if isinstance(o, Symbol) and o.quoted:
+            return o.unquoted
+
+        # if object is a bound symbol, substitute its value:
+        if isinstance(o, Symbol):
+            return context[o]
+
+        # if o is a function:
+        if hasattr(o, '__call__'):
+            raise LispRuntimeError("cannot evaluate a function")
+
+        # in other cases, o must be a pair.
+        if not isinstance(o, Pair):
+            raise LispRuntimeError("cannot evaluate %s", o)
+        pair = o
+
+        # in which case, if we have been asked to run a function!
+        if isinstance(pair.left, Symbol):
+            try:
+                function = context[pair.left]
+            except KeyError:
+                raise LispRuntimeError("unbound symbol %r" % pair.left)
+
+            if not hasattr(function, '__call__'):
+                raise LispRuntimeError("symbol %r is not bound to a function, but %r" % (pair.left, function))
+        elif isinstance(pair.left, Pair):
+            # pair.left is a pair. it is important to eval it here - this is the one context in which
+            # it won't be evaled by pre_execute_impl, which only acts on arguments - and check we get a
+            # function, rather than dying here.
+            function = peval(context, pair.left)
+
+            if not hasattr(function, '__call__'):
+                raise LispRuntimeError("result %r cannot be executed as a function" % function)
+        elif hasattr(pair.left, '__call__'):
+            # someone has got a function object in the right place for us. Go them!
+            function = pair.left
+        else:
+            # pair.left is a Value, or something.
+            raise LispRuntimeError("result %r cannot be executed as a function" % pair.left)
 
-    return function(context, pair.right)
+        if BUDGET is not None:
+            BUDGET.step()
+
+        if context is finished and isinstance(function, UserLispFunction):
+            result = function.tail_call(context, pair.right)
+        else:
+            result = function(context, pair.right)
+
+        if not isinstance(result, TailCall):
+            return result
+
+        # a tail call: loop round to evaluate it, rather than recursing.
+        if result.finished:
+            finished = result.context
+        elif result.context is not finished:
+            finished = None
+        context, o = result.context, result.expression
 
 
 def pre_execute_impl(context, arguments):
@@ -124,35 +281,114 @@ def pre_execute_impl(context, arguments):
     pair = arguments
 
     evaled_args = []
+    nil = NIL.instance
 
-    while not isinstance(pair, NIL):
+    while pair is not nil:
         evaled_args.append(peval(context, pair.left))
         pair = pair.right
 
     return evaled_args
 
 
+def check_count(method, minc, maxc, count):
+    if (count < minc or count > maxc) and not permissive():
+        raise LispRuntimeError("%s: incorrect number of arguments. accepts %r-%r, recieved %r." % (
+            method, minc, maxc, count))
+
+
 def pre_execute(method="", minc=0, maxc=float('inf')):
     def inner_decorator(execute):
+        # the implementation to call with one, two or three arguments, by number of arguments: to
+        # begin with execute itself, for the numbers of arguments it accepts (see fixed_arity.)
+        fast = [None] + [execute if minc <= count <= maxc else None for count in (1, 2, 3)]
+        nil = NIL.instance
+
         def actual_execute(context, arguments):
+            if PROFILER is not None:
+                return PROFILER.call(method, pre_execute_impl, run, context, arguments)
+
+            # up to three arguments are evaluated straight into a call, without building a list.
+            if isinstance(arguments, Pair):
+                second = arguments.right
+                if second is nil:
+                    if fast[1] is not None:
+                        return fast[1](context, peval(context, arguments.left))
+                elif isinstance(second, Pair):
+                    third = second.right
+                    if third is nil:
+                        if fast[2] is not None:
+                            return fast[2](context, peval(context, arguments.left),
+                                peval(context, second.left))
+                    elif isinstance(third, Pair) and third.right is nil and fast[3] is not None:
+                        return fast[3](context, peval(context, arguments.left),
+                            peval(context, second.left), peval(context, third.left))
+
             evaled_arguments = pre_execute_impl(context, arguments)
-            count = len(evaled_arguments)
-            if not PERMISSIVE and (count < minc or count > maxc):
-                raise LispRuntimeError("%s: incorrect number of arguments. accepts %r-%r, recieved %r." % (
-                    method, minc, maxc, count))
+            check_count(method, minc, maxc, len(evaled_arguments))
+            return execute(*([context] + evaled_arguments))
+
+        def run(context, evaled_arguments):
+            check_count(method, minc, maxc, len(evaled_arguments))
             return execute(*([context] + evaled_arguments))
+
+        # expose the undecorated implementation, so that other engines can call it with arguments
+        # they have evaluated themselves.
+        actual_execute.execute = execute
+        actual_execute.method = method
+        actual_execute.minc = minc
+        actual_execute.maxc = maxc
+        actual_execute.fast = fast
         return actual_execute
     return inner_decorator
 
 
+def fixed_arity(builtin, count, types=None):
+    """registers the decorated function as builtin's implementation when it is called with exactly
+    count (1, 2 or 3) arguments, which are passed to it as they are evaluated, rather than in a
+    list. Given types, each argument is checked to be a Value of one of them first, as
+    static_validate_value_type would."""
+    def inner_decorator(implementation):
+        assert builtin.minc <= count <= builtin.maxc, "%s cannot take %d arguments." % (
+            builtin.method, count)
+
+        call = implementation
+        if types is not None:
+            method = builtin.method
+            if count == 1:
+                def call(context, a):
+                    if not (isinstance(a, Value) and isinstance(a.v, types)):
+                        validate_value(method, types, a)
+                    return implementation(context, a)
+            elif count == 2:
+                def call(context, a, b):
+                    if not (isinstance(a, Value) and isinstance(a.v, types) and
+                            isinstance(b, Value) and isinstance(b.v, types)):
+                        validate_value(method, types, a, b)
+                    return implementation(context, a, b)
+            else:
+                def call(context, a, b, c):
+                    if not (isinstance(a, Value) and isinstance(a.v, types) and
+                            isinstance(b, Value) and isinstance(b.v, types) and
+                            isinstance(c, Value) and isinstance(c.v, types)):
+                        validate_value(method, types, a, b, c)
+                    return implementation(context, a, b, c)
+
+        builtin.fast[count] = call
+        return implementation
+    return inner_decorator
+
+
 def instance_pre_execute(method=""):
     def inner_decorator(execute):
         def actual_execute(self, context, arguments):
+            if PROFILER is not None:
+                def run(context, evaled_arguments):
+                    check_count(method, self.minc, self.maxc, len(evaled_arguments))
+                    return execute(self, *([context] + evaled_arguments))
+                name = method if self.name is None else repr(self.name)
+                return PROFILER.call(name, pre_execute_impl, run, context, arguments)
             evaled_arguments = pre_execute_impl(context, arguments)
-            count = len(evaled_arguments)
-            if not PERMISSIVE and (count < self.minc or count > self.maxc):
-                raise LispRuntimeError("%s: incorrect number of arguments. accepts %r-%r, recieved %r." % (
-                    method, self.minc, self.maxc, count))
+            check_count(method, self.minc, self.maxc, len(evaled_arguments))
             return execute(self, *([context] + evaled_arguments))
         return actual_execute
     return inner_decorator
@@ -166,14 +402,18 @@ strings = (str, unicode)
 values = numbers + strings
 
 
+def validate_value(method, types, *terms):
+    for t in terms:
+        if not isinstance(t, Value):
+            raise ValueError("%s: cannot compute with non-value %r" % (method, t))
+        if not isinstance(t.v, types):
+            raise ValueError("%s: expected %r, found %r" % (method, types, t))
+
+
 def static_validate_value_type(method="", types=(object,)):
     def inner_decorator(execute):
         def actual_validate(context, *terms):
-            for t in terms:
-                if not isinstance(t, Value):
-                    raise ValueError("%s: cannot compute with non-value %r" % (method, t))
-                if not isinstance(t.v, types):
-                    raise ValueError("%s: expected %r, found %r" % (method, types, t))
+            validate_value(method, types, *terms)
 
             # *args arrives as a tuple, not a list.
             return execute(*([context] + list(terms)))
@@ -184,10 +424,13 @@ def static_validate_value_type(method="", types=(object,)):
 @pre_execute("BIND", 2, 2)
 def bind(context, symbol=None, value=NIL(), *args):
     if not isinstance(symbol, Symbol):
-        if not PERMISSIVE:
+        if not permissive():
             raise LispRuntimeError('cannot BIND value %r to non-symbol %r' % (value, symbol))
     else:
         context[symbol] = value
+        if isinstance(value, UserLispFunction) and value.name is None:
+            # the name the profiler reports it by.
+            value.name = symbol
 
     return NIL()
 
@@ -201,14 +444,14 @@ def _with(context, arg_bindings=NIL(), *lines_of_function_body):
     # unwind with's arguments; two pairs.
     args_as_list = False
     if not (isinstance(arg_bindings, Pair) or isinstance(arg_bindings, Symbol)):
-        if not PERMISSIVE:
+        if not permissive():
             raise LispRuntimeError('WITH: %r is not an argument list.' % arg_bindings)
     else:
         if isinstance(arg_bindings, Symbol):
             args_as_list = True
 
     if not lines_of_function_body:
-        if PERMISSIVE:
+        if permissive():
             return noop
         else:
             raise LispRuntimeError('WITH: cannot define an empty function.')
@@ -219,82 +462,118 @@ def _with(context, arg_bindings=NIL(), *lines_of_function_body):
 
 @pre_execute("EVAL", 1)
 def _eval(context, *lines):
-    retval = NIL()
+    if not lines:
+        return NIL()
 
-    for l in lines:
-        retval = peval(context, l)
+    for l in lines[:-1]:
+        peval(context, l)
 
-    return retval
+    return TailCall(context, lines[-1])
 
 
 import_cache = {}
 
 def eval_library(context, canonical_module_name, program):
     fn = UserLispFunction(NIL(), program, canonical_module_name)
-    fn(Context(default_context_bindings(), environment=canonical_module_name), NIL())
-    import_cache[canonical_module_name] = fn.last_execute_context
+    force(fn(Context(default_context_bindings(), environment=canonical_module_name), NIL()))
+    modules()[canonical_module_name] = fn.last_execute_context
 
 
 def internal_import(context, canonical_module_name, program):
     """For importing names from within the minimalisp implementation"""
-    if canonical_module_name not in import_cache:
+    if canonical_module_name not in modules():
         eval_library(context, canonical_module_name, program)
-    context.update(import_cache[canonical_module_name])
+    context.attach(modules()[canonical_module_name])
 
 
 @pre_execute("IMPORT", 1)
 @static_validate_value_type('IMPORT', strings)
 def _import(context, source_file):
-    global import_cache
     canonical_module_name = os.path.abspath(source_file.v)
+    cache = modules()
 
-    if canonical_module_name not in import_cache:
-        try:
-            program = parse_program(open(canonical_module_name, 'r').read())
-        except IOError:
-            raise LispRuntimeError('IMPORT: invalid file to load "%s"' % canonical_module_name)
-        eval_library(context, canonical_module_name, program)
+    if canonical_module_name not in cache:
+        if BYTECODE_IMPORTS:
+            import bytecode
+            try:
+                codes = bytecode.load(canonical_module_name)
+            except IOError:
+                raise LispRuntimeError('IMPORT: invalid file to load "%s"' % canonical_module_name)
+            bytecode.run_library(canonical_module_name, codes)
+        else:
+            try:
+                program = parse_program(open(canonical_module_name, 'r').read())
+            except IOError:
+                raise LispRuntimeError('IMPORT: invalid file to load "%s"' % canonical_module_name)
+            eval_library(context, canonical_module_name, program)
 
-    context.update(import_cache[canonical_module_name])
+    context.attach(cache[canonical_module_name])
     return NIL()
 
 
+# PUTS and GETS are each split into the part which does the I/O and the parts which don't, so that
+# the scheduler (see scheduler.py) can do the I/O itself, without blocking.
+
+def puts_line(values):
+    """the line PUTS prints for values."""
+    if any([
+        not isinstance(v, (Value, Vector, Pair, Symbol, NIL)) and not hasattr(v, '__call__')
+        for v in values
+    ]) and not permissive():
+        raise LispRuntimeError("expected lisp objects, got %s" % repr(values))
+    return "".join([repr(value) for value in values])
+
+
 @pre_execute("PUTS")
 def puts(context, *values):
-    if not PERMISSIVE and any([
-        not isinstance(v, (Value, Pair, Symbol, NIL)) and not hasattr(v, '__call__') for v in values
-    ]):
-        raise LispRuntimeError("expected lisp objects, got %s" % repr(values))
-    print("".join([repr(value) for value in values]))
+    print(puts_line(values))
     return NIL()
 
 
-@pre_execute("GETS", 0)
-def gets(context, *symbols_to_bind):
-    # if called with no arguments, returns a single gets.
+def gets_prompts(symbols_to_bind):
+    """generates the (symbol, prompt) for each line GETS reads, in turn: a single line, for its
+    value, if called with no arguments (when symbol is None), otherwise one for each symbol to
+    bind."""
     if len(symbols_to_bind) == 0:
-        return parse_token_prompt(raw_input(">"))
+        yield None, ">"
+        return
 
-    # with arguments, binds N gets' to them.
     for s in symbols_to_bind:
         if not isinstance(s, Symbol):
-            if not PERMISSIVE:
+            if not permissive():
                 raise LispRuntimeError("GETS: cannot bind to non-symbol %r." % s)
         else:
-            context[s] = parse_token_prompt(raw_input("%s>" % repr(s)))
+            yield s, "%s>" % repr(s)
+
 
+def gets_bind(context, symbol, line):
+    """binds the value read for symbol, returning what GETS does."""
+    if symbol is None:
+        return parse_token_prompt(line)
+    context[symbol] = parse_token_prompt(line)
     return NIL()
 
 
+@pre_execute("GETS", 0)
+def gets(context, *symbols_to_bind):
+    # if called with no arguments, returns a single gets; with arguments, binds N gets' to them.
+    result = NIL()
+    for symbol, prompt in gets_prompts(symbols_to_bind):
+        result = gets_bind(context, symbol, raw_input(prompt))
+    return result
+
+
 @pre_execute("CONS", 2, 2)
 def cons(context, left=NIL(), right=NIL(), *args):
+    if SHARE:
+        return shared_pair(left, right)
     return Pair(left, right)
 
 
 @pre_execute("CAR", 1, 1)
 def car(context, pair=NIL(), *args):
     if not isinstance(pair, Pair):
-        if PERMISSIVE:
+        if permissive():
             return pair
         raise LispRuntimeError('CAR: %r is not a pair.' % pair)
 
@@ -304,13 +583,83 @@ def car(context, pair=NIL(), *args):
 @pre_execute("CDR", 1, 1)
 def cdr(context, pair=NIL(), *args):
     if not isinstance(pair, Pair):
-        if PERMISSIVE:
+        if permissive():
             return pair
         raise LispRuntimeError('CDR: %r is not a pair.' % pair)
 
     return pair.right
 
 
+# Vectors: an item can be got or set by its index, without walking a list. Indexes count from 0.
+
+def validate_vector(method, vector):
+    if not isinstance(vector, Vector):
+        raise LispRuntimeError('%s: %r is not a vector.' % (method, vector))
+
+
+def validate_index(method, vector, index):
+    validate_value(method, integers, index)
+    if not 0 <= index.v < len(vector.items):
+        raise LispRuntimeError('%s: index %r is out of range for a vector of length %d.' % (
+            method, index, len(vector.items)))
+
+
+@pre_execute("VECTOR")
+def vector(context, *items):
+    return Vector(list(items))
+
+
+@pre_execute("VLEN", 1, 1)
+def vlen(context, vector):
+    validate_vector("VLEN", vector)
+    return Value(len(vector.items), actual=True)
+
+
+@pre_execute("VGET", 2, 2)
+def vget(context, vector, index):
+    validate_vector("VGET", vector)
+    validate_index("VGET", vector, index)
+    return vector.items[index.v]
+
+
+@pre_execute("VSET", 3, 3)
+def vset(context, vector, index, value):
+    validate_vector("VSET", vector)
+    validate_index("VSET", vector, index)
+    vector.items[index.v] = value
+    return NIL()
+
+
+@pre_execute("VSLICE", 2, 3)
+def vslice(context, vector, start, end=None):
+    """a new vector of the items from start up to, but not including, end (or the last item), as
+    python slices them: negative indexes count from the end."""
+    validate_vector("VSLICE", vector)
+    if end is None:
+        validate_value("VSLICE", integers, start)
+        return Vector(vector.items[start.v:])
+    validate_value("VSLICE", integers, start, end)
+    return Vector(vector.items[start.v:end.v])
+
+
+@pre_execute("LIST->VECTOR", 1, 1)
+def list_to_vector(context, pair):
+    items = []
+    rest = pair
+    while isinstance(rest, Pair):
+        items.append(rest.left)
+        rest = rest.right
+    if rest is not NIL.instance and not permissive():
+        raise LispRuntimeError('LIST->VECTOR: %r is not a list.' % pair)
+    return Vector(items)
+
+
+@pre_execute("VECTOR->LIST", 1, 1)
+def vector_to_list(context, vector):
+    validate_vector("VECTOR->LIST", vector)
+    return Pair.pair_list_from_sexpr(vector.items, shared=SHARE)
+
+
 @pre_execute("+")
 @static_validate_value_type("+", numbers)
 def plus(context, *terms):
@@ -369,38 +718,44 @@ def split(context, input, substring=None):
     if substring:
         args.append(substring)
 
+    make_pair = shared_pair if SHARE else Pair
     for tok in reversed(input.v.split(*args)):
-        retvalue = Pair(Value(tok, actual=True), retvalue)
+        retvalue = make_pair(Value(tok, actual=True), retvalue)
 
     return retvalue
 
 
 @pre_execute("RAND", 0, 0)
 def rand(context):
-    return Value(random.random(), actual=True)
+    running = interpreter()
+    return Value((random if running is None else running.random).random(), actual=True)
 
 
 # Logical Functions:
-# By convention we use NIL as false, as well as using 0, the empty string and unbound Symbols
-# likewise. Thus, any other numeric value is true, as is a string, Pair or bound Symbol.
+# By convention we use NIL as false, as well as using 0, the empty string, the empty vector and
+# unbound Symbols likewise. Thus, any other numeric value is true, as is a string, Pair, vector or
+# bound Symbol.
 # We must choose a value to return from logical comparisons. The value that was compared is not
 # sufficient, since this breaks (== 0 x), and so on. We also do not want to introduce another type
 # (boolean) when we only want True but not False.
 # So, we choose to return Value(1, actual=True). This means we can (+ test test2 test3) and see how
 # many passed, among other things.
 
+def truthy(context, value):
+    return (isinstance(value, Pair) or
+        (isinstance(value, Symbol) and value in context) or
+        (isinstance(value, Value) and value.v) or
+        (isinstance(value, Vector) and len(value.items) > 0))
+
+
 @pre_execute("IF", 2, 3)
 def _if(context, test, then_do, else_do=None):
-    retvalue = NIL()
-
-    if (isinstance(test, Pair) or
-        (isinstance(test, Symbol) and test in context) or
-        (isinstance(test, Value) and test.v)):
-        retvalue = peval(context, then_do)
+    if truthy(context, test):
+        return TailCall(context, then_do)
     elif else_do:
-        retvalue = peval(context, else_do)
+        return TailCall(context, else_do)
 
-    return retvalue
+    return NIL()
 
 
 @pre_execute("=", 2)
@@ -459,6 +814,76 @@ def less_than(context, *terms):
     return retvalue
 
 
+# the common numbers of arguments to the arithmetic and comparison builtins, without the lists the
+# general versions build. Each gives exactly what the general version would: sum starts from 0, so
+# that (+ -0.0 -0.0) is 0.0, and reduce(mul, ...) from 1.
+
+@fixed_arity(plus, 2, numbers)
+def plus_2(context, a, b):
+    return Value(0 + a.v + b.v, actual=True)
+
+
+@fixed_arity(plus, 3, numbers)
+def plus_3(context, a, b, c):
+    return Value(0 + a.v + b.v + c.v, actual=True)
+
+
+@fixed_arity(minus, 1, numbers)
+def minus_1(context, a):
+    return Value(a.v - 0, actual=True)
+
+
+@fixed_arity(minus, 2, numbers)
+def minus_2(context, a, b):
+    return Value(a.v - (0 + b.v), actual=True)
+
+
+@fixed_arity(multiply, 2, numbers)
+def multiply_2(context, a, b):
+    return Value(1 * a.v * b.v, actual=True)
+
+
+@fixed_arity(multiply, 3, numbers)
+def multiply_3(context, a, b, c):
+    return Value(1 * a.v * b.v * c.v, actual=True)
+
+
+@fixed_arity(divide, 2, numbers)
+def divide_2(context, a, b):
+    return Value(a.v / (1 * b.v), actual=True)
+
+
+@fixed_arity(idivide, 2, integers)
+def idivide_2(context, a, b):
+    return Value(a.v // (1 * b.v), actual=True)
+
+
+@fixed_arity(modulo, 2, integers)
+def modulo_2(context, a, b):
+    return Value(a.v % (1 * b.v), actual=True)
+
+
+@fixed_arity(equal, 2)
+def equal_2(context, a, b):
+    if a != b:
+        return NIL()
+    return Value(1, actual=True)
+
+
+@fixed_arity(greater_than, 2, values)
+def greater_than_2(context, a, b):
+    if a.v <= b.v:
+        return NIL()
+    return Value(1, actual=True)
+
+
+@fixed_arity(less_than, 2, values)
+def less_than_2(context, a, b):
+    if a.v >= b.v:
+        return NIL()
+    return Value(1, actual=True)
+
+
 @pre_execute("DOWHILE", 1)
 def dowhile(context, *body):
     """works like EVAL, except it repeats the function body again and again until its return
@@ -468,16 +893,110 @@ def dowhile(context, *body):
     for line in body:
         result = peval(context, line)
 
-    while (isinstance(result, Pair) or
-        (isinstance(result, Symbol) and result in context) or
-        (isinstance(result, Value) and result.v)):
-
+    while truthy(context, result):
+        if BUDGET is not None:
+            BUDGET.step()
         for line in body:
             result = peval(context, line)
 
     return NIL()
 
 
+# The standard library (see stdlib.py), natively: these give what the minimalisp definitions
+# there do, without a user function call, and its own context, for every item of a list. Where
+# those would loop for ever (in permissive mode, CAR and CDR of NIL are NIL) these give up. A symbol
+# passed to NOT, AND or OR is true if it is bound in the caller's context, as for IF, rather than
+# in the module which defines the minimalisp versions; AND and OR evaluate their arguments once,
+# where those pass the later ones to APPLY, which evaluates them again; and APPLY evaluates its
+# arguments in the caller's context, not that module's. test_stdlib.py compares the two.
+
+@pre_execute("APPLY", 2, 2)
+def _apply(context, function, arguments):
+    # as (eval (cons 'f args)): the arguments are evaluated again, as those of the call.
+    if not hasattr(function, '__call__'):
+        raise LispRuntimeError("APPLY: %r is not a function." % function)
+    return TailCall(context, Pair(function, arguments))
+
+
+def add_index(start, index):
+    """start (the optional last argument of POS and LEN) plus index, as (+ start 1) index times."""
+    if start is None:
+        return Value(index, actual=True)
+    if index == 0:
+        return start
+    validate_value("+", numbers, start)
+    return Value(start.v + index, actual=True)
+
+
+@pre_execute("POS", 2, 3)
+def position(context, value, pair, start=None):
+    index = 0
+    rest = pair
+    while isinstance(rest, Pair):
+        if not (value != rest.left):
+            return add_index(start, index)
+        rest = rest.right
+        index += 1
+
+    if not permissive():
+        raise LispRuntimeError('POS: %r is not in %r.' % (value, pair))
+    if not (value != rest):
+        # the CAR of the end of the list.
+        return add_index(start, index)
+    return NIL()
+
+
+@pre_execute("LEN", 1, 2)
+def length(context, pair, start=None):
+    index = 0
+    rest = pair
+    while isinstance(rest, Pair):
+        rest = rest.right
+        index += 1
+
+    if truthy(context, rest):
+        if not permissive():
+            raise LispRuntimeError('LEN: %r is not a list.' % pair)
+        return NIL()
+    return add_index(start, index)
+
+
+@pre_execute("NOT", 1, 1)
+def _not(context, value):
+    if truthy(context, value):
+        return NIL()
+    return Value(1, actual=True)
+
+
+@pre_execute("AND", 1)
+def _and(context, *values):
+    for value in values:
+        if not truthy(context, value):
+            return NIL()
+    # (in permissive mode, AND of nothing is false.)
+    return Value(1, actual=True) if values else NIL()
+
+
+@pre_execute("OR", 1)
+def _or(context, *values):
+    for value in values:
+        if truthy(context, value):
+            return Value(1, actual=True)
+    return NIL()
+
+
+@pre_execute("RANDINT", 0, 1)
+def randint(context, limit=None):
+    """a random integer from 0 to limit (256 by default) inclusive, using the same random number
+    as (round (* limit (rand))), so that it gives the same integer for the same seed."""
+    running = interpreter()
+    r = (random if running is None else running.random).random()
+    if limit is None:
+        limit = Value(256, actual=True)
+    validate_value("*", numbers, limit)
+    return Value(int(round(1 * limit.v * r)), actual=True)
+
+
 class UserLispFunction(object):
     def __init__(self, argbindings, functionbody, definition_env, args_as_list=False):
         # both are unquoted pairs, which WITH will check for us.
@@ -486,6 +1005,8 @@ class UserLispFunction(object):
         self.functionbody = functionbody
         self.minc = 0
         self.env = definition_env
+        # the symbol it was first bound to, if any.
+        self.name = None
 
         if args_as_list:
             # a list of arguments may be arbitrarily long.
@@ -494,7 +1015,7 @@ class UserLispFunction(object):
             # find out how long argbindings is:
             args = []
             sargs = argbindings
-            while not isinstance(sargs, NIL):
+            while sargs is not NIL.instance:
                 args.append(sargs.left)
                 sargs = sargs.right
             self.maxc = len(args)
@@ -506,13 +1027,39 @@ class UserLispFunction(object):
 
     @instance_pre_execute("(user function)")
     def __call__(self, outer_context, *ap):
-        # initialise a new context, with arguments bound to names specified (or NIL if none passed):
+        return self.run_body(self.new_context(outer_context, ap))
+
+    @instance_pre_execute("(user function)")
+    def tail_call(self, finished_context, *ap):
+        """called by peval instead of __call__ when the calling context belongs to a function which
+        has already returned. Since nothing else can see that context, we bind our arguments
+        straight into it rather than chaining a new one on the end, so tail recursion runs in
+        constant space."""
+        return self.run_body(self.new_context(finished_context, ap, reuse=True))
+
+    def run_body(self, context):
+        self.last_execute_context = context
+
+        if not self.functionbody:
+            return NIL()
+
+        for line in self.functionbody[:-1]:
+            peval(context, line)
+
+        return TailCall(context, self.functionbody[-1], finished=True)
+
+    def new_context(self, outer_context, ap, reuse=False):
+        """initialise a new context, with arguments bound to names specified (or unbound if none
+        passed.)"""
         if self.env == outer_context.env:
-            context = Context(parent=outer_context)
+            if reuse and not outer_context.captured:
+                context = outer_context
+            else:
+                context = Context(parent=outer_context)
         else:
             # executing a function defined in a different file: go and retrieve
             # the correct outer scope.
-            context = Context(parent=import_cache[self.env], environment=self.env)
+            context = Context(parent=modules()[self.env], environment=self.env)
         ab = self.argbindings
 
         # bind the arguments passed:
@@ -524,16 +1071,11 @@ class UserLispFunction(object):
                 arg_binding = ab[i]
                 context[arg_binding] = arg_passed
 
-        retval = NIL()
-        for line in self.functionbody:
-            retval = peval(context, line)
-
-        self.last_execute_context = context
-
-        return retval
+        return context
 
 
-lib = {
+# the builtins every interpreter starts with.
+BUILTINS = {
     Symbol('bind'): bind,
     Symbol('with'): _with,
     Symbol('eval'): _eval,
@@ -543,6 +1085,13 @@ lib = {
     Symbol('cons'): cons,
     Symbol('car'): car,
     Symbol('cdr'): cdr,
+    Symbol('vector'): vector,
+    Symbol('vlen'): vlen,
+    Symbol('vget'): vget,
+    Symbol('vset'): vset,
+    Symbol('vslice'): vslice,
+    Symbol('list->vector'): list_to_vector,
+    Symbol('vector->list'): vector_to_list,
     Symbol('+'): plus,
     Symbol('-'): minus,
     Symbol('*'): multiply,
@@ -558,25 +1107,73 @@ lib = {
     Symbol('<'): less_than,
     Symbol('='): equal,
     Symbol('=='): identical,
-    Symbol('dowhile'): dowhile
+    Symbol('dowhile'): dowhile,
+    Symbol('apply'): _apply,
+    Symbol('pos'): position,
+    Symbol('len'): length,
+    Symbol('not'): _not,
+    Symbol('and'): _and,
+    Symbol('or'): _or,
+    Symbol('randint'): randint
 }
 
-def default_context_bindings():
-    return lib
+# the builtins which stdlib.py also defines in minimalisp.
+STDLIB = [Symbol(name) for name in ('apply', 'pos', 'len', 'not', 'and', 'or', 'randint')]
 
-def run(program, program_environment, with_math=False):
+# the builtins when no Interpreter is running, to which with_math adds the maths library for good.
+lib = dict(BUILTINS)
+
+def default_context_bindings():
+    running = interpreter()
+    if running is None:
+        return lib
+    return running.builtins
+
+def lisp_stdlib():
+    """the functions of STDLIB as defined in minimalisp, by stdlib.py. It is run the first time it
+    is needed, as a module would be."""
+    if "(stdlib)" not in modules():
+        from stdlib import stdlib
+        eval_library(None, "(stdlib)", parse_program(stdlib))
+    module = modules()["(stdlib)"]
+    return dict((symbol, module.own(symbol)) for symbol in STDLIB)
+
+
+def program_context(program_environment, with_math=False):
+    bindings = default_context_bindings()
     if with_math:
         import maths
-        lib.update(maths.maths_functions)
+        if bindings is lib:
+            lib.update(maths.maths_functions)
+        else:
+            # an Interpreter's builtins are its own business: give it the maths library when it is
+            # made, for its modules to see.
+            bindings = dict(bindings)
+            bindings.update(maths.maths_functions)
+
+    if LISP_STDLIB:
+        # (in place of the builtins, for this program only.)
+        bindings = dict(bindings)
+        bindings.update(lisp_stdlib())
 
     # we initialise the functions not implemented in the language (who do not
     # care about contexts) as being in the user's own environment.
-    context = Context(default_context_bindings(), environment=program_environment)
+    context = Context(bindings, environment=program_environment)
 
     # before we execute the program, ensure it's context is registered in the
     # import cache so that the functions can load an environment when run as
     # callbacks.
-    import_cache[program_environment] = context
+    modules()[program_environment] = context
+
+    return context
 
-    UserLispFunction(NIL(), program, program_environment)(context, NIL())
+
+def run(program, program_environment, with_math=False):
+    """program is an iterable of top level forms: either a list from parse_program, or a generator
+    such as parse.read_forms, in which case each form is run as soon as it has been read."""
+    # the program's own bindings go in a context of their own, as they would if it were the body
+    # of a user function.
+    context = Context(parent=program_context(program_environment, with_math))
+    for line in program:
+        peval(context, line)
 
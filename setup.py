@@ -9,6 +9,6 @@ setup(name='minimalisp',
     author_email='tehwalrus@h2j9k.org',
     url='https://github.com/joe-jordan/minimalisp',
     packages=['minimalisp'],
-    scripts=['scripts/minimalisp'],
+    scripts=['scripts/minimalisp', 'scripts/minimalisp-client'],
     include_package_data=True
 )
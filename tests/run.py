@@ -0,0 +1,41 @@
+"""Runs the checks of the python modules in this directory, or of those named:
+
+    python tests/run.py [test_engines test_values ...]
+
+Each module has a list, SECTIONS, of generators which yield a description of each of their checks,
+and whether it passed. Prints any check which fails, and how many of each section's passed, and
+exits with 1 if any failed."""
+
+from __future__ import print_function
+
+import os
+import sys
+import glob
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(DIRECTORY), "minimalisp"))
+
+MODULES = sorted(os.path.basename(name)[:-len(".py")]
+    for name in glob.glob(os.path.join(DIRECTORY, "test_*.py")))
+
+
+def run(name):
+    """runs the checks of the module name, and returns the number which failed."""
+    module = __import__(name)
+    failures = 0
+    for section in module.SECTIONS:
+        failed = total = 0
+        for description, passed in section():
+            total += 1
+            if not passed:
+                failed += 1
+                print("%s.%s: %s failed." % (name, section.__name__, description))
+        print("%s.%s: %d of %d checks passed." % (name, section.__name__, total - failed, total))
+        failures += failed
+    return failures
+
+
+if __name__ == "__main__":
+    names = [os.path.splitext(os.path.basename(name))[0] for name in sys.argv[1:]]
+    failures = sum(run(name) for name in names or MODULES)
+    sys.exit(1 if failures else 0)
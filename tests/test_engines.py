@@ -0,0 +1,504 @@
+"""Checks of the engines which run a program other than peval: that they give what it does, go where
+it cannot, and share its budgets and imports; and that the bytecode cache and the builtins' fixed
+arity implementations do what they stand in for. See run.py."""
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import itertools
+import subprocess
+from StringIO import StringIO
+
+import vm
+import values
+import compiled
+import stackless
+import lexical
+import bytecode
+import memo
+from vm import Context, LispRuntimeError
+from values import NIL, Value, Symbol, Pair
+from parse import parse_program
+from stackless import Machine
+from compiled import Compiler, CodeCache
+from stdlib import stdlib
+from lexical import LexicalCompiler
+from budget import Budget, BudgetExceeded
+from interpreter import Interpreter
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+MINIMALISP = os.path.join(os.path.dirname(TESTS), "scripts", "minimalisp")
+
+ENGINES = [
+    ('peval', vm.run),
+    ('compiled', compiled.run),
+    ('stackless', stackless.run),
+    ('lexical', lexical.run),
+    ('bytecode', bytecode.run),
+    ('memo', memo.run),
+]
+
+
+def write(filename, source):
+    with open(filename, 'w') as f:
+        f.write(source)
+
+
+# the stackless evaluator (stackless.py).
+
+DEFINITIONS = """
+(bind 'build (with '(n acc) '(if n '(build (- n 1) (cons n acc)) 'acc)))
+(bind 'count (with '(l) '(if l '(+ 1 (count (cdr l))) 0)))
+(bind 'sum (with '(n) '(if (< n 1) 0 '(+ n (sum (- n 1))))))
+(bind 'fib (with '(n) '(if (< n 2) n '(+ (fib (- n 1)) (fib (- n 2))))))
+"""
+
+# programs which peval can run too.
+STACKLESS_PROGRAMS = [
+    "(sum 100)",
+    "(fib 15)",
+    "(count (build 300 NIL))",
+    "(bind 'i 0) (dowhile '(bind 'i (+ i 1)) '(< i 1000)) i",
+    "(eval '(bind 'x 2) '(* x 3))",
+    "(car (cdr (build 5 NIL)))",
+    "(sum \"a\")",
+    "((with 'args '(count args)) 1 2 3)",
+]
+
+
+def value(evaluate, source):
+    """the value of the last line of source, after DEFINITIONS, or the error it raised."""
+    context = Context(parent=vm.program_context("(engine test)"))
+    try:
+        result = None
+        for line in parse_program(DEFINITIONS + source):
+            result = evaluate(context, line)
+        return repr(result)
+    except (LispRuntimeError, ValueError) as e:
+        return "error: %s" % e
+
+
+def overflows(evaluate, source):
+    try:
+        value(evaluate, source)
+    except RuntimeError:
+        return True
+    return False
+
+
+def long_list(n):
+    result = NIL.instance
+    for i in xrange(n):
+        result = Pair(Value(i, actual=True), result)
+    return result
+
+
+def stackless_evaluator():
+    for source in STACKLESS_PROGRAMS:
+        yield "%s gives what peval does" % source, \
+            value(Machine().evaluate, source) == value(vm.peval, source)
+
+    # deeper than peval can go. (Each call looks its functions up through every caller's context,
+    # so much deeper takes a while.)
+    deep = 2000
+    yield "non tail recursion %d deep" % deep, \
+        value(Machine().evaluate, "(count (build %d NIL))" % deep) == repr(deep)
+    yield "where peval runs out of python's stack", \
+        overflows(vm.peval, "(count (build %d NIL))" % deep)
+    yield "max_depth stops deep recursion with an error", \
+        value(Machine(max_depth=1000).evaluate, "(sum 2000)").startswith(
+            "error: maximum evaluation depth")
+    yield "max_depth allows shallower recursion", \
+        value(Machine(max_depth=1000).evaluate, "(sum 50)") == "1275"
+
+    # lists too long to print or compare recursively.
+    a, b = long_list(100000), long_list(100000)
+    yield "a long list prints", repr(a).startswith("(99999 . (99998 .")
+    yield "long lists compare equal", a == b
+    yield "long lists which differ at the end compare unequal", a != Pair(Value(0, actual=True), b)
+
+    # a lookup through a long chain of contexts.
+    context = Context(parent=vm.program_context("(engine test)"))
+    context[Symbol('deep')] = Value(1, actual=True)
+    for i in xrange(100000):
+        context = Context(parent=context)
+    yield "a symbol is found through a long chain of contexts", \
+        repr(context[Symbol('deep')]) == "1"
+
+
+# the closure compiler (compiled.py).
+
+def compiled_value(source, compiler=None):
+    """the value of the last line of source, after DEFINITIONS, run by compiler."""
+    if compiler is None:
+        compiler = Compiler()
+    return value(lambda context, line: compiler.compile_value(line)(context), source)
+
+
+# programs which rebind a function after a call to it has been compiled, and its function cached.
+REBINDING = [
+    "(bind 'f (with '(a b) '(+ a b))) (f 1 2) (bind '+ -) (f 1 2)",
+    "(bind 'f (with '(a b) '(+ a b))) (bind 'g (with '(+) '(f 1 2))) (cons (f 1 2) (g -))",
+    "(bind 'f (with '(a b) '(+ a b))) (f 1 2) (bind '+ (with '(a b) '(* a b))) (f 5 3)",
+    "(bind 'h (with '(n) '(if n '(+ 1 (h (- n 1))) 0))) (h 3) (bind '+ -) (h 3)",
+    "(bind 'i 2) (bind 'l NIL)"
+        " (dowhile '(eval (bind 'l (cons (+ 10 5) l)) (bind '+ -) (bind 'i (- i 1))) '(> i 0)) l",
+]
+
+
+def printed(options, name, directory):
+    """what scripts/minimalisp prints running tests/name, with options, from directory, with any
+    traceback (which goes through different python code in each engine) cut to its error."""
+    process = subprocess.Popen([sys.executable, MINIMALISP] + options + ["tests/" + name],
+        cwd=directory, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate("3\n4\n5\n")[0]
+    if "Traceback" in output:
+        output = output[:output.index("Traceback")] + output.rstrip("\n").rsplit("\n", 1)[-1]
+    return output
+
+
+def compiled_engine():
+    for source in REBINDING:
+        yield "%s gives what peval does" % source, \
+            compiled_value(source) == value(vm.peval, source)
+
+    # the programs in this directory, from a directory where they find the library they import,
+    # as they would be run.
+    directory = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(directory, "lib"))
+        write(os.path.join(directory, "lib", "ext.l"), stdlib)
+        os.symlink(TESTS, os.path.join(directory, "tests"))
+        for name in sorted(os.listdir(TESTS)):
+            if name.endswith(".l"):
+                yield "-c prints what peval does running %s" % name, \
+                    printed(["-c"], name, directory) == printed([], name, directory)
+    finally:
+        shutil.rmtree(directory)
+
+
+# the lexically scoped engine (lexical.py).
+
+def lexical_value(source, compiler=None):
+    """the value of the last line of source, after DEFINITIONS, run with lexical scope."""
+    if compiler is None:
+        compiler = LexicalCompiler()
+    return value(lambda context, line: compiler.compile_value(line)(context), source)
+
+
+def lexical_scope():
+    closures = "(bind 'x 1) (bind 'f (with '(y) '(+ x y))) (bind 'g (with '(x) '(f 0))) (g 2)"
+    yield "a function sees the bindings where it was defined", \
+        lexical_value(closures) == "1" and value(vm.peval, closures) == "2"
+    yield "even once the function it was defined in has returned", \
+        lexical_value("(bind 'adder (with '(n) '(with '(m) '(+ n m)))) ((adder 5) 1)") == "6"
+
+    # (a BIND whose symbol is only known when it runs, kept in the frame's extra bindings.)
+    computed = "(bind 'f (with '(l) '(bind (car l) 5) '(+ z 1))) (f '(z))"
+    yield "a symbol bound by a BIND which is not literal is found", \
+        lexical_value(computed) == value(vm.peval, computed) == "6"
+    computed = "(bind 'z 1) (bind 'f (with '(l) '(bind (car l) 5) 'z)) (cons (f '(z)) z)"
+    yield "and only in the function which bound it", \
+        lexical_value(computed) == value(vm.peval, computed) == "(5 . 1)"
+
+    # as deep as python's stack allows, with the limit raised as the benchmarks raise it.
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 20000))
+    try:
+        for source in ("(sum 1000)", "(count (build 2000 NIL))", "(fib 15)"):
+            yield "%s gives what peval does" % source, \
+                lexical_value(source) == value(vm.peval, source)
+    finally:
+        sys.setrecursionlimit(limit)
+
+    # more function bodies than the compiler keeps scopes for.
+    compiler = LexicalCompiler()
+    compiler.scopes = CodeCache(maxsize=4)
+    functions = "".join("(bind 'f%d (with '(n) '(+ n %d)))" % (i, i) for i in xrange(20))
+    source = functions + "(cons (f0 1) (cons (f19 1) (f0 1)))"
+    yield "functions give the same whether or not their scopes are kept", \
+        lexical_value(source, compiler) == value(vm.peval, source) == "(1 . (20 . 1))"
+    yield "no more scopes are kept than the cache's maxsize", len(compiler.scopes) <= 4
+
+
+# each builtin's implementations for a fixed number of arguments (vm.fixed_arity), called with every
+# combination of these, must give exactly what its general one does, telling 0.0 from -0.0 and 1
+# from 1.0.
+
+ARGUMENTS = [
+    Value(0, actual=True), Value(1, actual=True), Value(-7, actual=True), Value(2 ** 70, actual=True),
+    Value(0.0, actual=True), Value(-0.0, actual=True), Value(2.5, actual=True),
+    Value(-1e308, actual=True), Value(float('inf'), actual=True), Value(float('nan'), actual=True),
+    Value("a", actual=True),
+    NIL(), Pair(Value(1, actual=True), NIL()), Symbol('x'),
+]
+
+
+def outcome(function, context, arguments):
+    try:
+        result = function(context, *arguments)
+    except (vm.LispRuntimeError, ArithmeticError, ValueError, TypeError) as e:
+        return ('error', type(e), str(e))
+    if isinstance(result, Value):
+        v = result.v
+        return ('value', type(v), v.hex() if type(v) is float else v)
+    return ('other', repr(result))
+
+
+def specialised():
+    """yields each builtin's name, and a number of arguments it has its own implementation for."""
+    for symbol, builtin in sorted(vm.BUILTINS.items(), key=lambda item: repr(item[0])):
+        fast = getattr(builtin, 'fast', None)
+        if fast is None:
+            continue
+        for count in (1, 2, 3):
+            if fast[count] is not None and fast[count] is not builtin.execute:
+                yield symbol, builtin, count
+
+
+def fixed_arity():
+    context = Context(parent=vm.program_context("(engine test)"))
+    for symbol, builtin, count in specialised():
+        for arguments in itertools.product(ARGUMENTS, repeat=count):
+            expected = outcome(builtin.execute, context, arguments)
+            actual = outcome(builtin.fast[count], context, arguments)
+            yield "(%r %s) gives %r" % (symbol, " ".join(repr(a) for a in arguments), expected), \
+                actual == expected
+
+
+# a module IMPORTed by a program is seen through as it would be had its bindings been copied in.
+
+MODULES = {
+    'numbers.l': "(bind 'one 1) (bind 'two 2) (bind 'name \"numbers\")",
+    'letters.l': "(bind 'a \"a\") (bind 'name \"letters\")",
+    # a module which imports another.
+    'both.l': "(import \"letters.l\") (bind 'b \"b\")",
+    'functions.l': "(bind 'add-one (with '(n) '(+ n one))) (bind 'one 1)",
+}
+
+# programs, and what they should print.
+IMPORTING_PROGRAMS = [
+    ("(import \"numbers.l\") (puts one two)", "12"),
+    # an import overrides what was bound before it, and is shadowed by what is bound after it.
+    ("(bind 'one 100) (import \"numbers.l\") (puts one)", "1"),
+    ("(import \"numbers.l\") (bind 'one 100) (puts one \" \" two)", "100 2"),
+    # the module imported last wins.
+    ("(import \"numbers.l\") (import \"letters.l\") (puts name)", "letters"),
+    ("(import \"letters.l\") (import \"numbers.l\") (puts name)", "numbers"),
+    ("(import \"letters.l\") (import \"numbers.l\") (import \"letters.l\") (puts name)", "letters"),
+    # a module's own imports are seen through it.
+    ("(import \"both.l\") (puts a b name)", "abletters"),
+    # a function from a module finds its own bindings, or the caller's, as it did when copied.
+    ("(import \"functions.l\") (puts (add-one 1))", "2"),
+    # an import inside a function is seen only there.
+    ("(bind 'f (with '(x) '(import \"numbers.l\") '(+ x two))) (puts (f 1)) (puts 'two)",
+        "3\nTWO"),
+    ("(bind 'x 5) (import \"numbers.l\") (bind 'x (+ x one)) (puts x)", "6"),
+]
+
+
+def output(run, source):
+    """what source PUTS, run by run in an interpreter of its own, or the error it stops with."""
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        with Interpreter():
+            run(parse_program(source), "(engine test)")
+    except LispRuntimeError as e:
+        sys.stdout.write("error: %s\n" % e)
+    finally:
+        printed = sys.stdout.getvalue()
+        sys.stdout = stdout
+    return printed.rstrip("\n")
+
+
+def imports():
+    directory = tempfile.mkdtemp()
+    for name, source in MODULES.items():
+        write(os.path.join(directory, name), source)
+
+    # IMPORT finds modules relative to the current directory.
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        for engine, run in ENGINES:
+            for source, expected in IMPORTING_PROGRAMS:
+                yield "%s: %s prints %r" % (engine, source, expected), \
+                    output(run, source) == expected
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+# the bytecode cache (bytecode.load): foo.lc is written beside foo.l, used while foo.l is unchanged,
+# and rebuilt once it changes, and IMPORT only uses it under -b.
+
+def run_codes(codes):
+    """the value of the last of codes, run in a program context."""
+    context = Context(parent=vm.program_context("(engine test)"))
+    machine = bytecode.Machine()
+    result = None
+    for code in codes:
+        result = machine.execute(code, context)
+    return repr(result)
+
+
+def imported(source):
+    """the value of the last line of source, run by peval in an interpreter of its own, so that
+    it imports its modules afresh."""
+    with Interpreter():
+        context = Context(parent=vm.program_context("(engine test)"))
+        result = None
+        for line in parse_program(source):
+            result = vm.peval(context, line)
+        return repr(result)
+
+
+def compiles(filename):
+    """whether bytecode.load compiles filename, rather than reading its cache, and what it
+    returns."""
+    compile_program = bytecode.compile_program
+    compiled = []
+
+    def counting(program):
+        compiled.append(program)
+        return compile_program(program)
+
+    bytecode.compile_program = counting
+    try:
+        codes = bytecode.load(filename)
+    finally:
+        bytecode.compile_program = compile_program
+    return bool(compiled), codes
+
+
+def bytecode_cache():
+    directory = tempfile.mkdtemp()
+    try:
+        for check in bytecode_checks(directory):
+            yield check
+    finally:
+        os.chmod(directory, 0o700)
+        shutil.rmtree(directory)
+
+
+def bytecode_checks(directory):
+    program = os.path.join(directory, "program.l")
+    cache = program + "c"
+
+    write(program, "(bind 'x 20) (+ x 1)")
+    compiled, codes = compiles(program)
+    yield "a program is compiled the first time", compiled and run_codes(codes) == "21"
+    yield "and its cache written beside it", os.path.exists(cache)
+
+    compiled, codes = compiles(program)
+    yield "the cache is used while the program is unchanged", \
+        not compiled and run_codes(codes) == "21"
+
+    write(program, "(bind 'x 20) (+ x 2)")
+    compiled, codes = compiles(program)
+    yield "a changed program is compiled again", compiled and run_codes(codes) == "22"
+    compiled, codes = compiles(program)
+    yield "and the cache rebuilt", not compiled and run_codes(codes) == "22"
+
+    write(cache, "not bytecode")
+    compiled, codes = compiles(program)
+    yield "an unreadable cache is replaced", compiled and run_codes(codes) == "22"
+    yield "by a readable one", not compiles(program)[0]
+
+    os.chmod(directory, 0o500)
+    try:
+        os.remove(cache)
+    except OSError:
+        pass
+    try:
+        write(program + ".tmp", "")
+    except IOError:
+        # (unless we are root, for whom nothing is read only.)
+        compiled, codes = compiles(program)
+        yield "a program in a read only directory runs without a cache", \
+            compiled and run_codes(codes) == "22" and not os.path.exists(cache)
+    finally:
+        os.chmod(directory, 0o700)
+
+    script = os.path.join(directory, "script")
+    write(script, "(bind 'x 20) (+ x 3)")
+    write(script + "c", "not a cache")
+    files = sorted(os.listdir(directory))
+    yield "a program whose name does not end in .l is compiled each time", \
+        all(compiles(script)[0] and run_codes(compiles(script)[1]) == "23" for i in xrange(2))
+    yield "and writes nothing beside it", \
+        sorted(os.listdir(directory)) == files and open(script + "c").read() == "not a cache"
+
+    module = os.path.join(directory, "module.l")
+    write(module, "(bind 'version 1)")
+    source = "(import \"%s\") version" % module
+    yield "IMPORT writes no cache by default", \
+        imported(source) == "1" and not os.path.exists(module + "c")
+
+    vm.BYTECODE_IMPORTS = True
+    try:
+        yield "IMPORT under -b uses the cache", \
+            imported(source) == "1" and os.path.exists(module + "c")
+    finally:
+        vm.BYTECODE_IMPORTS = False
+
+
+# a Budget (budget.py) stops a program which goes over it, in every engine, and no longer applies
+# once it has ended.
+
+LOOP = parse_program("(bind 'i 0) (dowhile '(bind 'i (+ i 1)) '(< i 5000))")
+FOREVER = parse_program("(bind 'f (with '(n) '(f (+ n 1)))) (f 0)")
+ALLOCATING = parse_program("(bind 'l NIL) (dowhile '(bind 'l (cons 1 l)) 1)")
+
+
+class Clock(object):
+    """a clock which moves on a second each time it is read."""
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+def exceeds(program, run, **limits):
+    """the limit program ran out of, or None if it finished."""
+    try:
+        with Budget(**limits):
+            run(program, "(engine test)")
+    except BudgetExceeded as e:
+        return e.limit
+    return None
+
+
+def finishes(program, run):
+    try:
+        run(program, "(engine test)")
+    except BudgetExceeded:
+        return False
+    return True
+
+
+def budgets():
+    for name, run in ENGINES:
+        yield "%s: a loop of 5000 steps exceeds 1000 steps" % name, \
+            exceeds(LOOP, run, steps=1000) == 'steps'
+        yield "%s: a loop of 5000 steps fits in 100000" % name, \
+            exceeds(LOOP, run, steps=100000) is None
+        yield "%s: endless recursion exceeds 1000 steps" % name, \
+            exceeds(FOREVER, run, steps=1000) == 'steps'
+        yield "%s: endless consing exceeds 1000 allocations" % name, \
+            exceeds(ALLOCATING, run, allocations=1000) == 'allocations'
+        yield "%s: endless recursion exceeds 10 seconds" % name, \
+            exceeds(FOREVER, run, seconds=10, check_every=10, clock=Clock()) == 'seconds'
+        yield "%s: the budget is reset afterwards" % name, \
+            vm.BUDGET is None and values.BUDGET is None
+        yield "%s: a loop runs to the end after a budget" % name, finishes(LOOP, run)
+
+
+SECTIONS = [stackless_evaluator, compiled_engine, lexical_scope, fixed_arity, imports, bytecode_cache,
+    budgets]
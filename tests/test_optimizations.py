@@ -0,0 +1,215 @@
+"""Checks of the ways of running a program faster than peval does, which must not change what it
+gives: the memo (memo.py), folding constants (fold.py), and evaluating over many points at once
+(vectorized.py). See run.py."""
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+from StringIO import StringIO
+
+import vm
+from vm import Symbol
+from parse import parse_program, unparse
+from memo import Memo
+from fold import fold_program
+from interpreter import Interpreter
+from vectorized import evaluate_points, evaluate_each
+
+
+def run(source, memo=None):
+    """the values of the lines of source, run by peval or by memo."""
+    context = vm.Context(parent=vm.program_context("(optimization test)", with_math=True))
+    values = []
+    for line in parse_program(source):
+        if memo is None:
+            values.append(repr(vm.peval(context, line)))
+        else:
+            values.append(repr(memo.evaluate(context, line)))
+    return values
+
+
+# programs with numbers which are equal but not the same, such as 0.0 and -0.0. They are run with
+# one Memo, kept between them, so that a wrongly shared cache entry would show.
+SIGNED_ZEROS = [
+    "(bind 'y 0.0) (atan2 (* y 1.0) -1.0)",
+    "(bind 'y -0.0) (atan2 (* y 1.0) -1.0)",
+    "(atan2 (* 0.0 1.0) -1.0)",
+    "(atan2 (* -0.0 1.0) -1.0)",
+    "(bind 'y 0.0) (+ (* y 1.0) 0.0)",
+    "(bind 'y -0.0) (* (* y 1.0) 1.0)",
+    "(bind 'y 1) (+ (* y 2) 1)",
+    "(bind 'y 1.0) (+ (* y 2) 1)",
+]
+
+
+# programs which compare vectors, and then change them.
+VECTORS = [
+    "(bind 'v (vector 1)) (bind 'w (vector 1)) (= v w) (vset v 0 2) (= v w)",
+    "(bind 'v (vector 1)) (bind 'l (cons v NIL)) (bind 'm (cons (vector 1) NIL))"
+        " (= (cdr (cons 1 l)) m) (vset v 0 2) (= (cdr (cons 1 l)) m)",
+    "(bind 'v (vector 1)) (bind 'l (cons 0 (cons (cons v NIL) NIL)))"
+        " (car (cdr (cons 1 l))) (vset v 0 2) (= (car (cdr (cons 1 l))) (cons (vector 1) NIL))",
+]
+
+
+# programs which rebind what a cached subexpression reads, or calls.
+REBINDING = [
+    "(bind 'x 1) (+ (* x 2) 1) (bind 'x 5) (+ (* x 2) 1)",
+    "(bind 'x 1) (+ (* x 2) 1) (bind '+ -) (+ (* x 2) 1)",
+]
+
+# calls which do something other than give a value, and so must be made each time, each made
+# twice. (MODULE is replaced by the name of a module which PUTS when it is run.)
+IMPURE = [
+    "(bind 'n 0) (bind 'n (+ n 1)) (bind 'n (+ n 1)) n",
+    "(puts (+ 1 2)) (puts (+ 1 2))",
+    "(gets) (gets)",
+    "(rand) (rand)",
+    "(randint (+ 5 5)) (randint (+ 5 5))",
+    "(import MODULE) (import MODULE)",
+]
+
+
+def effects(source, memo=None):
+    """the values of the lines of source, and what it printed, run in an interpreter of its own
+    (with a seed, so that RAND gives the same numbers each time) with two lines of input."""
+    stdin, stdout = sys.stdin, sys.stdout
+    sys.stdin, sys.stdout = StringIO("first\nsecond\n"), StringIO()
+    try:
+        values = []
+        with Interpreter(seed=1):
+            context = vm.Context(parent=vm.program_context("(optimization test)"))
+            for line in parse_program(source):
+                if memo is None:
+                    values.append(repr(vm.peval(context, line)))
+                else:
+                    values.append(repr(memo.evaluate(context, line)))
+        return values, sys.stdout.getvalue()
+    finally:
+        sys.stdin, sys.stdout = stdin, stdout
+
+
+def memo():
+    shared = Memo(min_size=1)
+    for source in SIGNED_ZEROS + VECTORS + REBINDING:
+        yield "%s gives what peval does" % source, run(source, shared) == run(source)
+
+    # a subtree which is repeated.
+    counting = Memo(min_size=3)
+    context = vm.Context(parent=vm.program_context("(optimization test)"))
+    context[Symbol('x')] = vm.Value(2, actual=True)
+    twice = parse_program("(+ (* x 2) (* x 2))")[0]
+    counting.evaluate(context, twice)
+    yield "a repeated subtree is computed once", \
+        (counting.hits, counting.misses) == (1, 2) and counting.stats()['size'] == 2
+    counting.evaluate(context, twice)
+    yield "and the whole found in the cache the next time", \
+        (counting.hits, counting.misses) == (2, 2)
+    context[Symbol('x')] = vm.Value(3, actual=True)
+    yield "but not once the symbol it reads is rebound", \
+        repr(counting.evaluate(context, twice)) == "12" and \
+        (counting.hits, counting.misses) == (3, 4)
+
+    directory = tempfile.mkdtemp()
+    try:
+        module = os.path.join(directory, "module.l")
+        with open(module, 'w') as f:
+            f.write("(puts \"imported\")")
+        for source in IMPURE:
+            source = source.replace("MODULE", "\"%s\"" % module)
+            impure = Memo(min_size=1)
+            yield "%s is run each time, as by peval" % source, \
+                effects(source, impure) == effects(source)
+            context = vm.Context(parent=vm.program_context("(optimization test)"))
+            yield "%s is not cached" % source, \
+                not impure.analyse(context, parse_program(source)[0]).pure
+    finally:
+        shutil.rmtree(directory)
+
+    # distinct values of one subexpression, more than the cache holds.
+    bounded = Memo(maxsize=4, min_size=2)
+    context = vm.Context(parent=vm.program_context("(optimization test)"))
+    increment = parse_program("(+ x 1)")[0]
+    sizes = []
+    for i in xrange(10):
+        context[Symbol('x')] = vm.Value(i, actual=True)
+        bounded.evaluate(context, increment)
+        sizes.append(bounded.stats()['size'])
+    yield "the cache holds no more than maxsize values", max(sizes) <= 4 and bounded.misses == 10
+    bounded.evaluate(context, increment)
+    yield "the value used last is kept", bounded.hits == 1
+    context[Symbol('x')] = vm.Value(0, actual=True)
+    bounded.evaluate(context, increment)
+    yield "the value used least recently is not", bounded.hits == 1 and bounded.misses == 11
+
+
+# programs, and what fold_program simplifies them to.
+FOLDING = [
+    ("(+ 1 (* 2 3))", "7"),
+    ("(if 0 '(puts 1) '(puts (+ 1 1)))", "(PUTS 2)"),
+    # + can be rebound, by name or as data, so calls to it are left as they are.
+    ("(bind '+ -) (+ 1 2)", "(BIND '+ -) (+ 1 2)"),
+    ("(bind (car '(+)) -) (+ 1 2)", "(BIND (CAR '(+)) -) (+ 1 2)"),
+    ("(bind 'f (with '(+) '(+ 1 2))) (f -) (* 2 3)", "(BIND 'F (WITH '(+) '(+ 1 2))) (F -) 6"),
+    # IF evaluates both branches as its arguments, so one which does something is kept.
+    ("(if 1 2 (puts 3))", "(IF 1 2 (PUTS 3))"),
+    ("(if 0 (puts (+ 1 2)) 4)", "(IF 0 (PUTS 3) 4)"),
+    # calls which do something other than give a value, though their arguments are literal.
+    ("(rand)", "(RAND)"),
+    ("(puts 1 2)", "(PUTS 1 2)"),
+    ("(randint 5)", "(RANDINT 5)"),
+    ("(bind 'x 1) x", "(BIND 'X 1) X"),
+]
+
+
+def folding():
+    for source, expected in FOLDING:
+        folded = " ".join(unparse(line) for line in fold_program(parse_program(source))[0])
+        yield "%s folds to %s" % (source, expected), folded == expected
+        yield "which runs as %s does" % source, effects(folded) == effects(source)
+
+
+# expressions which read symbols bound to all sorts of things, evaluated over COLUMNS.
+
+BINDINGS = """
+(bind 'k 3)
+(bind 'f 2.5)
+(bind 'e '(+ x 1))
+(bind 's 'x)
+(bind 'nothing NIL)
+(bind 'v (vector 1 2))
+(bind 'g (with '(a) '(* a 2)))
+"""
+
+EXPRESSIONS = [
+    "(* k x)",
+    "(+ f x)",
+    "(* e 2)",
+    "(+ s 1)",
+    "(+ nothing x)",
+    "(+ v x)",
+    "(+ g x)",
+    "(+ car x)",
+    "(if (< x 2) k e)",
+]
+
+COLUMNS = {'x': [1, 2, 3.5]}
+
+
+def vectorized():
+    context = vm.Context(parent=vm.program_context("(optimization test)"))
+    for line in parse_program(BINDINGS):
+        vm.peval(context, line)
+
+    columns = dict((vm.Symbol(name), column) for name, column in COLUMNS.items())
+    for source in EXPRESSIONS:
+        expression = parse_program(source)[0]
+        expected = repr(evaluate_each(expression, columns, context))
+        yield "%s gives what it does point by point" % source, \
+            repr(evaluate_points(expression, COLUMNS, context=context)) == expected
+
+
+SECTIONS = [memo, folding, vectorized]
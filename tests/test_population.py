@@ -0,0 +1,109 @@
+"""Checks that evaluate_population (population.py) gives, for each program and case, what running
+the program by itself with the case's bindings does, however it is asked to evaluate them, and that
+parse.unparse, which it sends programs to its workers with, writes source which reads back as the
+same program. See run.py."""
+
+from __future__ import print_function
+
+import os
+
+import vm
+from vm import Context, LispRuntimeError, Symbol
+from parse import parse_program, unparse
+from population import evaluate_population, lisp_value
+from budget import BudgetExceeded
+
+PROGRAMS = [
+    "(+ x (* y y))",
+    "(- x y)",
+    "(/ x y)",
+    "(if (< x y) x y)",
+    "(bind 'z (* x 2)) (+ z y)",
+    "(bind 'square (with '(n) '(* n n))) (square (+ x y))",
+    "(car x)",
+    "(cos x)",
+    "(* x 1.5)",
+    "undefined",
+    "(bind 'i 0) (dowhile '(bind 'i (+ i 1)) '(< i 100)) (+ i x)",
+]
+
+CASES = [{'x': 1, 'y': 2}, {'x': 3, 'y': 0}, {'x': -2.5, 'y': 4}, {'x': 0, 'y': -0.0}]
+
+LOOPING = "(bind 'i 0) (dowhile '(bind 'i (+ i 1)) 1) i"
+
+
+def outcome(result):
+    """what to compare of a result: the type of an error, or the type and repr of a value."""
+    if isinstance(result, BaseException):
+        return type(result)
+    if isinstance(result, vm.Value):
+        return type(result.v), repr(result)
+    return repr(result)
+
+
+def expected(source, case, with_math=True):
+    """the result of running source by itself with case's bindings."""
+    context = Context(parent=vm.program_context("(population test)", with_math))
+    for name, value in case.items():
+        context[Symbol(name)] = lisp_value(value)
+    try:
+        result = None
+        for line in parse_program(source):
+            result = vm.peval(context, line)
+        return outcome(result)
+    except (LispRuntimeError, ArithmeticError, ValueError) as e:
+        return outcome(e)
+
+
+def outcomes(results):
+    return [[outcome(r) for r in row] for row in results]
+
+
+def population():
+    wanted = [[expected(p, case) for case in CASES] for p in PROGRAMS]
+
+    results = evaluate_population(PROGRAMS, CASES, processes=1, with_math=True)
+    yield "there is a row for each program and a column for each case", \
+        len(results) == len(PROGRAMS) and all(len(row) == len(CASES) for row in results)
+    yield "each program gives what it does by itself", outcomes(results) == wanted
+
+    yield "a pool of workers gives the same", \
+        outcomes(evaluate_population(PROGRAMS, CASES, processes=2, with_math=True)) == wanted
+    yield "so does memoizing", \
+        outcomes(evaluate_population(PROGRAMS, CASES, processes=1, with_math=True, memo=100)) == \
+        wanted
+    yield "and folding", \
+        outcomes(evaluate_population(PROGRAMS, CASES, processes=1, with_math=True, fold=True)) == \
+        wanted
+
+    forms = [parse_program(p) for p in PROGRAMS]
+    yield "lists of parsed forms give the same", \
+        outcomes(evaluate_population(forms, CASES, processes=1, with_math=True)) == wanted
+    trees = [f[0] for f in forms if len(f) == 1]
+    yield "parsed trees give the same", \
+        outcomes(evaluate_population(trees, CASES, processes=1, with_math=True)) == \
+        [row for f, row in zip(forms, wanted) if len(f) == 1]
+
+    results = evaluate_population([LOOPING, "(+ x 1)"], CASES, processes=1,
+        budget={'steps': 1000})
+    yield "a program over its budget gives BudgetExceeded for each case", \
+        all(isinstance(r, BudgetExceeded) for r in results[0])
+    yield "without affecting the others", \
+        [outcome(r) for r in results[1]] == [expected("(+ x 1)", case) for case in CASES]
+
+
+
+def unparsing():
+    # every form of the tests, written out and read back.
+    tests = os.path.dirname(os.path.abspath(__file__))
+    for name in ("tutorial.l", "valid.l", "parse_this.l"):
+        with open(os.path.join(tests, name)) as f:
+            program = parse_program(f.read())
+        read_back = [parse_program(unparse(form))[0] for form in program]
+        # (= ignores quoting, so compare what each writes out as too.)
+        yield "%s reads back from unparse as the same program" % name, \
+            read_back == program and [unparse(f) for f in read_back] == \
+            [unparse(f) for f in program]
+
+
+SECTIONS = [population, unparsing]
@@ -0,0 +1,370 @@
+"""Checks of the state a program runs in: that Interpreters (interpreter.py) keep their builtins,
+modules, settings and random numbers to themselves; that the scheduler (scheduler.py) interleaves
+the programs it runs and feeds each its input; and that the native APPLY, POS, LEN, NOT, AND, OR
+and RANDINT give what their definitions in stdlib.py do. See run.py."""
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import subprocess
+
+import vm
+from vm import LispRuntimeError, Symbol
+from parse import parse_program
+from interpreter import Interpreter
+from scheduler import Scheduler, WAITING, FINISHED
+from profiler import Profiler
+
+MINIMALISP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts",
+    "minimalisp")
+
+
+def run(interpreter, source):
+    """the value of the last line of source run in interpreter, or "error" if it raised one."""
+    try:
+        with interpreter:
+            context = vm.Context(parent=vm.program_context("(runtime test)"))
+            value = None
+            for line in parse_program(source):
+                value = vm.peval(context, line)
+            return repr(value)
+    except (LispRuntimeError, ValueError):
+        return "error"
+
+
+def write(filename, source):
+    with open(filename, 'w') as f:
+        f.write(source)
+
+
+def interpreters():
+    directory = tempfile.mkdtemp()
+    try:
+        for check in interpreter_checks(directory):
+            yield check
+    finally:
+        shutil.rmtree(directory)
+
+
+def interpreter_checks(directory):
+    lib = dict(vm.lib)
+
+    with_math, without = Interpreter(with_math=True), Interpreter()
+    yield "the maths library is only in the interpreter made with it", \
+        run(with_math, "(cos 0)") == "1.0" and run(without, "(cos 0)") == "error"
+
+    with_math.builtins[Symbol('double')] = vm.BUILTINS[Symbol('+')]
+    yield "a builtin added to one interpreter is only in that one", \
+        run(with_math, "(double 2 2)") == "4" and run(without, "(double 2 2)") == "error"
+    yield "the builtins outside any interpreter are unchanged", vm.lib == lib
+
+    permissive, strict = Interpreter(permissive=True), Interpreter()
+    yield "only the permissive interpreter is permissive", \
+        run(permissive, "(car 5)") == "5" and run(strict, "(car 5)") == "error"
+    yield "nor is anything outside it", not vm.permissive()
+
+    module = os.path.join(directory, "module.l")
+    program = "(import \"%s\") version" % module
+    first, second = Interpreter(), Interpreter()
+    write(module, "(bind 'version 1)")
+    yield "a module is imported", run(first, program) == "1"
+    write(module, "(bind 'version 2)")
+    yield "another interpreter imports the module afresh", run(second, program) == "2"
+    yield "the first keeps the module it imported", run(first, program) == "1"
+    yield "the import cache outside any interpreter is untouched", \
+        os.path.abspath(module) not in vm.import_cache
+    first.forget_modules()
+    yield "an interpreter which forgets its modules imports them again", run(first, program) == "2"
+
+    numbers = "(cons (randint 1000000) (cons (randint 1000000) NIL))"
+    seeded, same_seed, other = Interpreter(seed=1), Interpreter(seed=1), Interpreter(seed=2)
+    expected = run(seeded, numbers)
+    run(other, numbers)
+    yield "interpreters with the same seed give the same random numbers", \
+        run(same_seed, numbers) == expected and run(other, numbers) != expected
+
+    with permissive:
+        with strict:
+            inner = vm.permissive(), vm.interpreter() is strict
+        outer = vm.permissive(), vm.interpreter() is permissive
+    yield "an interpreter used inside another gives it back its settings afterwards", \
+        inner == (False, True) and outer == (True, True) and vm.interpreter() is None
+
+    # each thread runs its own interpreter over and over, while the other runs its.
+    results = {}
+
+    def repeatedly(name, interpreter):
+        results[name] = set(run(interpreter, "(car 5)") for i in xrange(200))
+
+    threads = [threading.Thread(target=repeatedly, args=("permissive", permissive)),
+        threading.Thread(target=repeatedly, args=("strict", strict))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    yield "interpreters running in threads at once keep their own settings", \
+        results == {"permissive": set(["5"]), "strict": set(["error"])}
+
+    # one interpreter entered in two threads, inside another in the first, and left in the order
+    # it was entered.
+    shared = Interpreter()
+    entered, left = threading.Event(), threading.Event()
+    afterwards = {}
+
+    def first():
+        with permissive:
+            with shared:
+                entered.wait()
+            afterwards['first'] = vm.interpreter()
+            left.set()
+
+    def second():
+        with shared:
+            entered.set()
+            left.wait()
+        afterwards['second'] = vm.interpreter()
+
+    threads = [threading.Thread(target=first), threading.Thread(target=second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    yield "an interpreter used in two threads at once gives each back what it was running", \
+        afterwards == {'first': permissive, 'second': None}
+
+
+# PUTS its name and a count three times, with enough calls in between to use up a turn each time,
+# and then reads two lines.
+PROGRAM = """
+(bind 'busy (with '(n) '(if (> n 0) '(busy (- n 1)) 0)))
+(bind 'i 0)
+(dowhile '(eval (puts "%(name)s" i) (busy 50) (bind 'i (+ i 1))) '(< i 3))
+(puts "%(name)s waits")
+(bind 'first (gets))
+(bind 'second (gets))
+(puts "%(name)s got " first " then " second)
+second
+"""
+
+
+def spawn(scheduler, name, log):
+    return scheduler.spawn(parse_program(PROGRAM % {'name': name}), on_output=log.append)
+
+
+def scheduling():
+    log = []
+    scheduler = Scheduler(quantum=10)
+    a, b = spawn(scheduler, "a", log), spawn(scheduler, "b", log)
+
+    scheduler.run()
+    yield "the tasks take turns", log == ['a0', 'b0', 'a1', 'b1', 'a2', 'b2', 'a waits', 'b waits']
+    yield "both wait for input", a.state == b.state == WAITING
+
+    del log[:]
+    b.feed("1")
+    scheduler.run()
+    yield "a task with half its input still waits", log == [] and b.state == WAITING
+
+    b.feed("2")
+    scheduler.run()
+    yield "a task gets its input in order", log == ['b got 1 then 2']
+    yield "the other task still waits", a.state == WAITING
+    yield "a finished task has the value of its last line", \
+        b.state == FINISHED and repr(b.value) == '2' and b.error is None
+    yield "a finished task is forgotten", scheduler.tasks == [a]
+
+    del log[:]
+    a.feed("3")
+    a.close_input()
+    scheduler.run()
+    yield "GETS after the input is closed raises EOFError", \
+        a.state == FINISHED and isinstance(a.error, EOFError) and log == []
+
+    yield "nothing is left to run", not scheduler.step()
+
+    # fed before it first runs, a task never waits.
+    log = []
+    scheduler = Scheduler(quantum=10)
+    c = spawn(scheduler, "c", log)
+    c.feed("x")
+    c.feed("y")
+    scheduler.run()
+    yield "input fed in advance is read in order", \
+        log[-1:] == ['c got x then y'] and c.state == FINISHED
+
+
+BIG = "(bind 'big (split \"%s\"))\n" % " ".join(str(i) for i in range(2000))
+
+PROGRAMS = [
+    "(len NIL)",
+    "(len '(1))",
+    "(len '(1 2 3))",
+    "(len '(1 2 3) 10)",
+    "(len '(1 2 3) 0.5)",
+    "(len NIL 7)",
+    "(len '(1 2) \"a\")",
+    "(len '(1 . 2))",
+    "(len 5)",
+    "(len 0)",
+    BIG + "(len big)",
+
+    "(pos 1 '(1 2 3))",
+    "(pos 3 '(1 2 3))",
+    "(pos \"b\" '(\"a\" \"b\"))",
+    "(pos '(1) '((0) (1)))",
+    "(pos 1.0 '(0 1))",
+    "(pos 2 '(1 2 3) 5)",
+    "(pos 1 '(1 2 3) \"a\")",
+    "(pos 9 '(1 2 3))",
+    "(pos 9 NIL)",
+    BIG + "(pos \"1999\" big)",
+
+    "(not 0)",
+    "(not 1)",
+    "(not NIL)",
+    "(not '(1))",
+    "(not \"\")",
+    "(not \"a\")",
+    "(not 'undefined)",
+
+    "(and 1)",
+    "(and 0)",
+    "(and 1 2)",
+    "(and 1 0)",
+    "(and 0 1)",
+    "(and NIL 1 1)",
+    "(and 1 1 1 \"x\")",
+    "(and)",
+
+    "(or 0)",
+    "(or 1)",
+    "(or 0 1)",
+    "(or NIL NIL)",
+    "(or 0 \"\" 5)",
+    "(or)",
+
+    "(apply + '(1 2 3))",
+    "(apply + NIL)",
+    "(apply cons '(1 2))",
+    "(apply not '(0))",
+    "(apply len '('(1 2 3)))",
+    "(apply (with '(a b) '(- a b)) '(5 3))",
+    "(apply and '(1 1 0))",
+    "(apply 5 '(1))",
+
+    "(randint)",
+    "(randint 10)",
+    "(randint 0)",
+    "(randint 2.5)",
+    "(randint \"a\")",
+    "(bind 'r NIL) (dowhile '(bind 'r (cons (randint 3) r)) '(< (len r) 50)) r",
+]
+
+# programs whose results differ, with what each gives: native, then minimalisp.
+DIFFERENCES = [
+    # AND and OR in minimalisp pass their later arguments on with (apply and (cdr args)), which
+    # evaluates them again, as code.
+    ("(and 1 '(car NIL))", "1", "error"),
+    ("(or 0 '(car NIL))", "1", "error"),
+    ("(and 1 '(1 2))", "1", "error"),
+    ("(bind 'x 0) (and 1 'x)", "1", "error"),
+    # APPLY evaluates the arguments again too, in both, but in minimalisp in the stdlib module's
+    # context rather than the caller's.
+    ("(bind 'x 5) (apply + '(x))", "5", "error"),
+    # NOT, AND and OR test whether a symbol is bound where they are called, as IF does, rather
+    # than in the stdlib module.
+    ("(bind 'x 1) (not 'x)", "NIL", "1"),
+    ("(bind 'x 1) (and 'x)", "1", "NIL"),
+    ("(bind 'x 1) (or 'x)", "1", "NIL"),
+]
+
+# programs for which the minimalisp definitions would not loop for ever in permissive mode. (Where
+# they would, e.g. (pos 9 '(1 2 3)), the native ones give NIL.)
+PERMISSIVE_PROGRAMS = [
+    "(and)",
+    "(or)",
+    "(pos NIL '(1 2))",
+    "(pos 3 '(1 2 3))",
+    "(len '(1 2 3))",
+    "(not NIL)",
+]
+
+
+def lisp_stdlib(interpreter, source):
+    """the value of the last line of source run in interpreter with the minimalisp stdlib."""
+    vm.LISP_STDLIB = True
+    try:
+        return run(interpreter, source)
+    finally:
+        vm.LISP_STDLIB = False
+
+
+def compare(programs, permissive):
+    # the same seed for each, so that RANDINT gives both the same numbers.
+    native = Interpreter(permissive=permissive, seed=1)
+    lisp = Interpreter(permissive=permissive, seed=1)
+    for source in programs:
+        expected = lisp_stdlib(lisp, source)
+        yield "%s%s gives %s" % ("(permissive) " if permissive else "",
+            source.splitlines()[-1], expected), run(native, source) == expected
+
+
+def native_stdlib():
+    for check in compare(PROGRAMS, False):
+        yield check
+    for check in compare(PERMISSIVE_PROGRAMS, True):
+        yield check
+
+    native, lisp = Interpreter(seed=1), Interpreter(seed=1)
+    for source, native_expected, lisp_expected in DIFFERENCES:
+        yield "%s gives %s natively and %s in minimalisp" % (
+            source, native_expected, lisp_expected), \
+            (run(native, source), lisp_stdlib(lisp, source)) == (native_expected, lisp_expected)
+
+
+# counts down from n, with a call to F, IF and < for each number and to - for each but the last.
+COUNTDOWN = "(bind 'f (with '(n) '(if (< n 1) 0 '(f (- n 1))))) (f 5) (+ 1 2)"
+
+
+def profiling():
+    with Profiler() as profiler:
+        vm.run(parse_program(COUNTDOWN), "(runtime test)")
+    calls = dict((name, stats.calls) for name, stats in profiler.stats.items())
+    yield "each function's calls are counted", calls == {
+        'BIND': 1, 'WITH': 1, 'F': 6, 'IF': 6, '<': 6, '-': 5, '+': 1}
+    yield "the profiler is removed afterwards", vm.PROFILER is None
+
+    # without a profiler, nothing is recorded.
+    call, made = Profiler.call, []
+    Profiler.call = lambda self, *args: made.append(args)
+    try:
+        vm.run(parse_program(COUNTDOWN), "(runtime test)")
+    finally:
+        Profiler.call = call
+    yield "no profiler is called when none is running", not made
+
+    directory = tempfile.mkdtemp()
+    try:
+        program = os.path.join(directory, "countdown.l")
+        write(program, COUNTDOWN + " (puts \"done\")")
+        for options, profiled in (([], False), (["--profile"], True)):
+            process = subprocess.Popen([sys.executable, MINIMALISP] + options + [program],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output, report = process.communicate()
+            rows = dict(line.split()[:2] for line in report.splitlines()[1:])
+            yield "minimalisp %s prints the program's output" % " ".join(options), \
+                output == "done\n"
+            if profiled:
+                yield "and a report of the calls to each function", \
+                    report.startswith("function") and rows['F'] == "6" and rows['-'] == "5"
+            else:
+                yield "and no report", report == ""
+    finally:
+        shutil.rmtree(directory)
+
+
+SECTIONS = [interpreters, scheduling, native_stdlib, profiling]
@@ -0,0 +1,106 @@
+"""Checks that programs run through minimalisp-client on a server (server.py) print what they would
+have run by minimalisp itself. Starts a server on a socket in a temporary directory, runs each
+program both ways, and stops it. See run.py."""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+import subprocess
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+MINIMALISP = os.path.join(SCRIPTS, "minimalisp")
+CLIENT = os.path.join(SCRIPTS, "minimalisp-client")
+
+# programs, with the options and input to run each with.
+PROGRAMS = [
+    ("(puts (+ 1 2))", [], ""),
+    ("(puts (sin 0) \" \" (cos 0))", ['-m'], ""),
+    ("(puts \"before\") (car 5) (puts \"after\")", [], ""),
+    ("(puts (car 5)) (puts \"after\")", ['-p'], ""),
+    ("(bind 'a (gets)) (bind 'b (gets)) (puts b \" \" a)", [], "first\nsecond\n"),
+    ("(import \"module.l\") (puts (twice 21))", [], ""),
+    ("(bind 'f (with '(n) '(if (< n 1) 0 '(+ 1 (f (- n 1)))))) (puts (f 200))", ['-c'], ""),
+    ("(bind 'f (with '(n) '(if (< n 1) 0 '(+ 1 (f (- n 1)))))) (puts (f 200))", ['-s'], ""),
+    ("(bind 'f (with '(n) '(if (< n 1) 0 '(+ 1 (f (- n 1)))))) (puts (f 200))", ['-b'], ""),
+    ("(bind 'x 1) (bind 'f (with '(y) '(puts x))) (bind 'g (with '(x) '(f 0))) (g 2)",
+        ['--lexical'], ""),
+    ("(puts (+ (* 2 3) (* 2 3)))", ['--memo'], ""),
+    ("(bind 'i 0) (dowhile '(bind 'i (+ i 1)) 1)", ['--max-steps', '1000'], ""),
+]
+
+MODULE = "(bind 'twice (with '(n) '(* 2 n))) (bind 'version %d)"
+
+
+def output(command, directory, stdin=""):
+    process = subprocess.Popen(command, cwd=directory, stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return process.communicate(stdin)[0]
+
+
+def write(filename, source):
+    with open(filename, 'w') as f:
+        f.write(source)
+
+
+def start_server(directory, socket_name):
+    server = subprocess.Popen([sys.executable, MINIMALISP, "--serve", socket_name], cwd=directory)
+    for i in xrange(100):
+        if os.path.exists(socket_name):
+            return server
+        time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("the server did not start.")
+
+
+def server_checks(directory, socket_name):
+    write(os.path.join(directory, "module.l"), MODULE % 1)
+    program = os.path.join(directory, "program.l")
+
+    def client(options, stdin=""):
+        return output([sys.executable, CLIENT, "--socket", socket_name] + options + [program],
+            directory, stdin)
+
+    for source, options, stdin in PROGRAMS:
+        write(program, source)
+        expected = output([sys.executable, MINIMALISP] + options + [program], directory, stdin)
+        actual = client(options, stdin)
+        yield "%s %s gives %r, as minimalisp does" % (" ".join(options), source, expected), \
+            actual == expected
+
+    source = "(puts \"from stdin\")"
+    yield "a program sent on stdin runs", output([sys.executable, CLIENT, "--socket", socket_name],
+        directory, source) == "from stdin\n"
+
+    write(program, "(import \"module.l\") (puts version)")
+    client([])
+    write(os.path.join(directory, "module.l"), MODULE % 2)
+    yield "an imported module is kept between requests", client([]) == "1\n"
+    yield "--reload imports it afresh", client(["--reload"]) == "2\n"
+
+    # a program the server has already parsed, changed.
+    write(program, "(puts \"changed\")")
+    yield "a changed program is parsed again", client([]) == "changed\n"
+
+
+def server():
+    directory = tempfile.mkdtemp()
+    socket_name = os.path.join(directory, "minimalisp.sock")
+    process = start_server(directory, socket_name)
+    try:
+        for check in server_checks(directory, socket_name):
+            yield check
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait()
+    try:
+        yield "the server removes its socket when stopped", not os.path.exists(socket_name)
+    finally:
+        shutil.rmtree(directory)
+
+
+SECTIONS = [server]
@@ -0,0 +1,173 @@
+"""Checks of the values programs are made of (values.py): that symbols are interned, even when
+created in threads at once, that vectors are indexed, sliced and converted as documented, that
+shared (hash-consed) pairs compare as the plain pairs they stand for do, and that pairs which are
+equal hash alike. See run.py."""
+
+from __future__ import print_function
+
+import sys
+import threading
+
+import vm
+from values import NIL, Value, Symbol, Vector, Pair, SharedPair, shared_pair, share, clear_shared
+from parse import parse_program
+
+SOURCES = [
+    "(1 2)", "(1.0 2)", "(1 2 3)", "'(1 2)", "(1 '(2))", "(1 (2))", "(0.0)", "(-0.0)",
+    "(a b)", "('a b)", "(\"a\" b)", "(\"b\" b)", "((1 2) (1 2))", "(NIL)", "(1 . 2)",
+]
+
+
+def trees():
+    """new plain copies of the trees to compare."""
+    result = [parse_program(source)[0] for source in SOURCES]
+    nan = Value(float('nan'), actual=True)
+    result.append(Pair(nan, NIL.instance))
+    result.append(Pair(Vector([Value(1, actual=True)]), NIL.instance))
+    result.append(Pair(Vector([Value(1.0, actual=True)]), NIL.instance))
+    return result
+
+
+def sharing():
+    plain, other = trees(), trees()
+    shared, shared_other = [share(t) for t in trees()], [share(t) for t in trees()]
+
+    for i, a in enumerate(plain):
+        for j, b in enumerate(other):
+            expected = a == b
+            yield "%r = %r shared" % (a, b), (shared[i] == shared_other[j]) == expected
+            yield "%r shared = %r" % (a, b), (shared[i] == b) == expected
+            yield "%r = %r, shared" % (a, b), (a == shared[j]) == expected
+
+    yield "every pair below a shared pair is shared", \
+        all(type(p) is SharedPair for p in (shared[0], shared[0].right, shared[12].left))
+    yield "equal structures are shared as one pair", \
+        share(parse_program("(1 2)")[0]) is shared[0] and shared[12].left is shared[12].right.left
+    yield "as are the lists the reader builds when asked", \
+        parse_program("(1 2)", shared=True)[0] is shared[0]
+    yield "a quoted list is not the unquoted one", shared[3] is not shared[0]
+    yield "0.0 and -0.0 are kept apart", shared[6].left.v.hex() != shared[7].left.v.hex()
+    yield "shared_pair shares what it is given", \
+        shared_pair(Value(1, actual=True), parse_program("(2)")[0]) is shared[0]
+
+    # pairs from before clear_shared are no longer taken to be the only copies.
+    clear_shared()
+    fresh = [share(t) for t in trees()]
+    yield "pairs shared before clear_shared are not those shared after", fresh[0] is not shared[0]
+    for i, a in enumerate(plain):
+        for j, b in enumerate(other):
+            yield "%r = %r across generations" % (a, b), (shared[i] == fresh[j]) == (a == b)
+
+
+def hashing():
+    plain, other = trees(), trees()
+    before = [[a == b for b in other] for a in plain]
+    hashes = [hash(t) for t in plain + other]
+
+    for i, a in enumerate(plain):
+        for j, b in enumerate(other):
+            if before[i][j]:
+                yield "%r and %r hash alike" % (a, b), hash(a) == hash(b)
+            # the cached hashes are used to tell pairs apart quickly: the answer must not change.
+            yield "%r = %r once hashed" % (a, b), (a == b) == before[i][j]
+
+    yield "hashes are cached", [hash(t) for t in plain + other] == hashes
+    yield "a shared pair hashes as the plain one", \
+        all(hash(share(t)) == hash(t) for t in trees())
+    programs = plain + other + [share(t) for t in trees()]
+    distinct = []
+    for program in programs:
+        if not any(program == d for d in distinct):
+            distinct.append(program)
+    yield "equal programs are one in a set", len(set(programs)) == len(distinct)
+
+    # (a list which is long, and one which is deep on the left, neither of which can be hashed by
+    # recursing.)
+    long_list, deep = NIL.instance, NIL.instance
+    for i in xrange(100000):
+        long_list = Pair(Value(i, actual=True), long_list)
+        deep = Pair(deep, Value(i, actual=True))
+    yield "a long list hashes", isinstance(hash(long_list), int)
+    yield "a deep tree hashes", isinstance(hash(deep), int)
+
+
+def symbols():
+    yield "a symbol is interned", Symbol('abc') is Symbol('ABC') is Symbol('abc').unquoted
+    yield "as is a quoted one", Symbol('abc', True) is Symbol('ABC', True) is not Symbol('abc')
+
+    # threads creating the same new symbols at once, switching as often as they can.
+    names = ["threaded-%d" % i for i in xrange(20000)]
+    created = []
+
+    def create(upper):
+        created.append([Symbol(n.upper() if upper else n, quoted) for n in names
+            for quoted in (False, True)])
+
+    threads = [threading.Thread(target=create, args=(i % 2,)) for i in xrange(8)]
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setcheckinterval(interval)
+    yield "threads creating the same symbols at once get the same ones", \
+        len(created) == 8 and all(all(a is b for a, b in zip(created[0], c)) for c in created)
+
+
+# programs using vectors, and the value of their last lines, or the error they stop with.
+VECTORS = [
+    ("(vget (vector 1 2) 1)", "2"),
+    ("(vget (vector 1 2) 2)", "error: VGET: index 2 is out of range for a vector of length 2."),
+    ("(vget (vector 1 2) -1)", "error: VGET: index -1 is out of range for a vector of length 2."),
+    ("(vget (vector) 0)", "error: VGET: index 0 is out of range for a vector of length 0."),
+    ("(vset (vector 1 2) 5 0)", "error: VSET: index 5 is out of range for a vector of length 2."),
+    ("(vset (vector 1 2) -1 0)", "error: VSET: index -1 is out of range for a vector of length 2."),
+    ("(vget (vector 1 2) 1.0)", "error: VGET: expected (<type 'int'>, <type 'long'>), found 1.0"),
+    # slices count negative bounds from the end, and are cut to the vector, as python's are.
+    ("(vslice (vector 1 2 3 4) -3 -1)", "[2 3]"),
+    ("(vslice (vector 1 2 3 4) -1)", "[4]"),
+    ("(vslice (vector 1 2 3 4) 1 -1)", "[2 3]"),
+    ("(vslice (vector 1 2 3) -10 10)", "[1 2 3]"),
+    ("(vslice (vector 1 2 3) 2 1)", "[]"),
+    ("(vslice (vector 1 2 3) -1 -2)", "[]"),
+    # to a list and back.
+    ("(vector->list (list->vector '(1 \"a\" (2 3) NIL)))",
+        "(1 . (a . ((2 . (3 . NIL)) . (NIL . NIL))))"),
+    ("(bind 'l '(1 (2) 3)) (= (vector->list (list->vector l)) l)", "1"),
+    ("(bind 'v (vector 1 (vector 2) NIL)) (= (list->vector (vector->list v)) v)", "1"),
+    ("(list->vector (vector->list (vector)))", "[]"),
+    ("(vector->list (list->vector NIL))", "NIL"),
+    ("(list->vector (cons 1 2))", "error: LIST->VECTOR: (1 . 2) is not a list."),
+    ("(vector->list '(1 2))", "error"),
+]
+
+
+def vector_value(source, context=None):
+    if context is None:
+        context = vm.Context(parent=vm.program_context("(values test)"))
+    try:
+        result = None
+        for line in parse_program(source):
+            result = vm.peval(context, line)
+        return repr(result)
+    except (vm.LispRuntimeError, ValueError) as e:
+        return "error: %s" % e
+
+
+def vectors():
+    for source, expected in VECTORS:
+        actual = vector_value(source)
+        if expected == "error":
+            yield "%s raises an error" % source, actual.startswith("error: ")
+        else:
+            yield "%s gives %s" % (source, expected), actual == expected
+
+    context = vm.Context(parent=vm.program_context("(values test)"))
+    vector_value("(bind 'v (vector 1 2)) (vset v 2 0)", context)
+    yield "a VSET out of range changes nothing", vector_value("v", context) == "[1 2]"
+
+
+SECTIONS = [symbols, vectors, sharing, hashing]